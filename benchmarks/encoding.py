@@ -0,0 +1,76 @@
+"""Size and encoding time of the evaluation payloads in JSON and in MessagePack.
+
+    python -m benchmarks.encoding [--flags N] [--static-share S] [--repeat N]
+
+Encodes the rules sent by get_rules and the results of an evaluation of a cached environment,
+with the static results spliced in, in both formats.
+"""
+import argparse
+import json
+import timeit
+
+from src.common.content_types import msgpack
+from src.evaluation_cache import _deserialize, _serialize
+from src.models import Environment, FlagRule
+
+
+def _environment(flags: int, static_share: float) -> Environment:
+    static_flags = int(flags * static_share)
+    return Environment.construct(
+        id="e" * 24,
+        name="env",
+        flags={
+            f"flag_{i}": FlagRule(
+                rules=True
+                if i < static_flags
+                else {
+                    "and": [
+                        {"in": [{"var": "user.country"}, ["US", "CA", "GB"]]},
+                        {">": [{"var": "user.age"}, i]},
+                    ]
+                },
+                default=False,
+            )
+            for i in range(flags)
+        },
+        server_side_keys={},
+        client_side_keys={},
+    )
+
+
+def _report(name: str, size: int, seconds: float, repeat: int):
+    print(f"{name:<20}{size:>10} bytes{seconds / repeat * 1e6:>12.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flags", type=int, default=300)
+    parser.add_argument("--static-share", type=float, default=0.5)
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+    if msgpack is None:
+        raise SystemExit("msgpack isn't installed")
+
+    compact = _deserialize(_serialize(_environment(args.flags, args.static_share))[1])
+    results = compact.evaluate_dynamic_flags({"user": {"country": "US", "age": 100}})
+    compact.dump_results_msgpack(results)
+    rules = {f_name: flag.db_representation() for f_name, flag in compact.flags.items()}
+
+    print("get_rules")
+    for name, encode in (
+        ("json", lambda: json.dumps(rules).encode()),
+        ("msgpack", lambda: msgpack.packb(rules)),
+        ("msgpack, cached", compact.dump_rules_msgpack),
+    ):
+        _report(name, len(encode()), timeit.timeit(encode, number=args.repeat), args.repeat)
+
+    print("evaluation results")
+    for name, encode in (
+        ("json", lambda: compact.dump_results(results)),
+        ("msgpack", lambda: compact.dump_results_msgpack(results)),
+    ):
+        _report(name, len(encode()), timeit.timeit(encode, number=args.repeat), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
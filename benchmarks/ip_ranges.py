@@ -0,0 +1,65 @@
+"""Lookup time of the ip_in_ranges operation against the number of networks.
+
+    python -m benchmarks.ip_ranges [--networks N [N ...]] [--lookups N]
+
+Compiles rules of random IPv4 and IPv6 networks and reports the time to build the prefix
+tries and the time of a lookup, next to a linear scan of the networks with ipaddress.
+"""
+import argparse
+import ipaddress
+import random
+import time
+
+from src.lib.json_logic import compile_rule
+
+
+def _networks(count: int, rng: random.Random) -> list:
+    networks = []
+    for i in range(count):
+        if i % 4:
+            network = (rng.getrandbits(32), rng.randint(12, 28))
+        else:
+            network = (rng.getrandbits(128), rng.randint(24, 64))
+        networks.append(ipaddress.ip_network(network, strict=False))
+    return networks
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--networks", type=int, nargs="+", default=[10, 1000, 10000])
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    print(f"{'networks':>10}{'build ms':>12}{'trie us':>12}{'scan us':>12}")
+    for count in args.networks:
+        networks = _networks(count, rng)
+        addresses = [
+            str(ipaddress.ip_address(rng.getrandbits(32 if i % 4 else 128)))
+            for i in range(args.lookups)
+        ]
+
+        started_at = time.perf_counter()
+        evaluator = compile_rule(
+            {"ip_in_ranges": [{"var": "ip"}, [str(network) for network in networks]]}
+        )
+        build = time.perf_counter() - started_at
+
+        contexts = [{"ip": address} for address in addresses]
+        started_at = time.perf_counter()
+        trie_results = [evaluator(context) for context in contexts]
+        trie = (time.perf_counter() - started_at) / len(contexts)
+
+        started_at = time.perf_counter()
+        scan_results = []
+        for address in addresses:
+            parsed = ipaddress.ip_address(address)
+            scan_results.append(any(parsed in network for network in networks))
+        scan = (time.perf_counter() - started_at) / len(addresses)
+
+        assert trie_results == scan_results
+        print(f"{count:>10}{build * 1e3:>12.1f}{trie * 1e6:>12.2f}{scan * 1e6:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Memory taken by the environments of the evaluation cache.
+
+    python -m benchmarks.memory [--environments N] [--flags N] [--keys N] [--distinct-rules]
+
+Decodes the same serialized environments into Beanie documents and into the compact
+representation of the cache, and reports the bytes taken per environment. By default the
+environments have the same rules, like the flags added to a project, --distinct-rules gives
+every environment its own rules.
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+from typing import Callable, List
+
+from src.evaluation_cache import _deserialize, _serialize
+from src.models import ApiKeyDescription, Environment, FlagRule
+
+
+def _environments_data(
+    environments: int, flags: int, keys: int, distinct_rules: bool
+) -> List[bytes]:
+    data = []
+    for i in range(environments):
+        environment = Environment.construct(
+            id=f"{i:024x}",
+            name=f"env{i}",
+            flags={
+                f"flag_{j}": FlagRule(
+                    rules={
+                        "and": [
+                            {"==": [{"var": "user.country"}, "US"]},
+                            {">": [{"var": "user.age"}, i * flags + j if distinct_rules else j]},
+                        ]
+                    },
+                    default=False,
+                )
+                for j in range(flags)
+            },
+            server_side_keys={
+                f"server{i}_{j}" * 2: ApiKeyDescription(name=f"server_{j}") for j in range(keys)
+            },
+            client_side_keys={
+                f"client{i}_{j}" * 2: ApiKeyDescription(name=f"client_{j}") for j in range(keys)
+            },
+        )
+        data.append(_serialize(environment)[1])
+    return data
+
+
+def _document(data: bytes) -> Environment:
+    # how the cache decoded environments into the models, without the database
+    fields = json.loads(data)
+    fields["flags"] = {name: FlagRule(**rule) for name, rule in fields["flags"].items()}
+    for keys_field in ("server_side_keys", "client_side_keys"):
+        fields[keys_field] = {
+            key: ApiKeyDescription(**description) for key, description in fields[keys_field].items()
+        }
+    environment = Environment.construct(**fields)
+    environment.compile()
+    return environment
+
+
+def _measure(decode: Callable[[bytes], object], data: List[bytes]) -> float:
+    gc.collect()
+    tracemalloc.start()
+    decoded = [decode(d) for d in data]
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del decoded
+    return size / len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--environments", type=int, default=1000)
+    parser.add_argument("--flags", type=int, default=50)
+    parser.add_argument("--keys", type=int, default=2)
+    parser.add_argument("--distinct-rules", action="store_true")
+    args = parser.parse_args()
+
+    data = _environments_data(args.environments, args.flags, args.keys, args.distinct_rules)
+    print(f"serialized{sum(map(len, data)) / len(data):>30.0f} bytes per environment")
+    for name, decode in (("Environment", _document), ("CompactEnvironment", _deserialize)):
+        print(f"{name:<30}{_measure(decode, data):>10.0f} bytes per environment")
+
+
+if __name__ == "__main__":
+    main()
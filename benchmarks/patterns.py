@@ -0,0 +1,58 @@
+"""Evaluation time of the pattern operations, with the patterns prepared once or on every call.
+
+    python -m benchmarks.patterns [--repeat N]
+
+Every operation is evaluated by a compiled rule, which prepares its literal patterns on
+compilation, and by matching with patterns prepared on every call, which is what evaluating
+the rule would cost without the preparation, along with an equivalent rule of the other
+operations where there is one. Note that ``re`` keeps its own cache of compiled patterns, so
+the regex prepared on every call costs a lookup of that cache rather than a compilation.
+"""
+import argparse
+import timeit
+
+from src.lib.json_logic import PATTERN_OPERATIONS, ContextIndex, compile_rule
+
+_CONTEXT = {"email": "someone@mail.example.com", "app": "2.14.3"}
+_DOMAINS = [f"@domain{i}.com" for i in range(20)] + ["@mail.example.com"]
+
+# operation, its arguments after the value and a rule of the other operations doing the same
+_CASES = [
+    ("regex", [r"@(mail\.)?example\.com$"], None),
+    ("starts_with", ["someone@"], {"==": [{"var": "email"}, "someone@mail.example.com"]}),
+    (
+        "ends_with",
+        [_DOMAINS],
+        {"or": [{"in": [domain, {"var": "email"}]} for domain in _DOMAINS]},
+    ),
+    ("semver", [">=", "2.9.0"], None),
+    ("version_in", [">=1.2.0 <2.0.0 || ^2.9 || ~3.1"], None),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"{'operation':<14}{'compiled':>12}{'per call':>12}{'other ops':>12}  us per evaluation")
+    for op, patterns, equivalent in _CASES:
+        prepare, match = PATTERN_OPERATIONS[op]
+        value_path = "app" if op in ("semver", "version_in") else "email"
+        evaluator = compile_rule({op: [{"var": value_path}, *patterns]})
+        timings = [
+            timeit.timeit(lambda: evaluator(_CONTEXT), number=args.repeat),
+            timeit.timeit(
+                lambda: match(ContextIndex(_CONTEXT).get(value_path), prepare(*patterns)),
+                number=args.repeat,
+            ),
+        ]
+        if equivalent is not None:
+            other = compile_rule(equivalent)
+            timings.append(timeit.timeit(lambda: other(_CONTEXT), number=args.repeat))
+        columns = "".join(f"{t / args.repeat * 1e6:>12.2f}" for t in timings)
+        print(f"{op:<14}{columns}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Startup time of the service.
+
+    python -m benchmarks.startup [--runs N] [--skip-database]
+
+Measures building the full and the evaluation-only app in fresh interpreters,
+and the database initialization with and without the schema setup (needs Mongo
+from MONGODB_CONNECTION_URL).
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# importing src.app builds the app of the EVALUATION_ONLY setting, as uvicorn src.app:app does
+_BUILD_APP = """
+import time
+started_at = time.perf_counter()
+import src.app
+print(time.perf_counter() - started_at)
+"""
+
+
+def _report(name: str, timings):
+    print(
+        f"{name:<40} median {statistics.median(timings) * 1000:8.1f} ms"
+        f"   min {min(timings) * 1000:8.1f} ms"
+    )
+
+
+def measure_app_build(runs: int):
+    for name, evaluation_only in (("full app", False), ("evaluation-only app", True)):
+        timings = [
+            float(
+                subprocess.check_output(
+                    [sys.executable, "-c", _BUILD_APP],
+                    env={**os.environ, "EVALUATION_ONLY": str(evaluation_only).lower()},
+                )
+            )
+            for _ in range(runs)
+        ]
+        _report(f"build {name}", timings)
+
+
+async def measure_database_init(runs: int):
+    from src.app import initiate_database
+    from src.common.base_model import SCHEMA_VERSIONS_COLLECTION
+    from src.common.db import get_mongo_client
+
+    database = get_mongo_client().get_default_database()
+    with_schema, without_schema = [], []
+    for _ in range(runs):
+        await database[SCHEMA_VERSIONS_COLLECTION].delete_many({})
+        started_at = time.perf_counter()
+        await initiate_database()
+        with_schema.append(time.perf_counter() - started_at)
+
+        started_at = time.perf_counter()
+        await initiate_database()
+        without_schema.append(time.perf_counter() - started_at)
+
+    _report("database init with schema setup", with_schema)
+    _report("database init, schema is up to date", without_schema)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--skip-database", action="store_true")
+    args = parser.parse_args()
+
+    measure_app_build(args.runs)
+    if not args.skip_database:
+        asyncio.run(measure_database_init(args.runs))
+
+
+if __name__ == "__main__":
+    main()
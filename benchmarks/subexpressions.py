@@ -0,0 +1,74 @@
+"""Evaluation time of an environment whose flags have subexpressions in common.
+
+    python -m benchmarks.subexpressions [--flags N] [--segments N] [--repeat N]
+
+Every flag is a combination of a few of the same segments, like the checks of the country
+or of the plan repeated in many flags, and the dynamic flags of the compact environment,
+which evaluates the repeated segments once per request, are evaluated next to the same
+flags compiled one by one.
+"""
+import argparse
+import random
+import timeit
+
+from src.compact_environment import CompactFlag
+from src.evaluation_cache import _deserialize, _serialize
+from src.models import Environment, FlagRule
+
+
+def _segments(count: int) -> list:
+    countries = ["US", "CA", "GB", "DE", "FR", "JP", "BR", "IN", "AU", "NL"]
+    segments = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            segments.append({"in": [{"var": "user.country"}, countries[i % 10 :] + [f"X{i}"]]})
+        elif kind == 1:
+            segments.append({"ends_with": [{"var": "user.email"}, [f"@corp{i}.com", "@a.com"]]})
+        else:
+            segments.append({">=": [{"var": "user.age"}, 18 + i]})
+    return segments
+
+
+def _environment(flags: int, segments: int) -> Environment:
+    rng = random.Random(1)
+    pool = _segments(segments)
+    return Environment.construct(
+        id="e" * 24,
+        name="env",
+        flags={
+            f"flag_{i}": FlagRule(rules={"and": rng.sample(pool, 3)}, default=False)
+            for i in range(flags)
+        },
+        server_side_keys={},
+        client_side_keys={},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flags", type=int, default=200)
+    parser.add_argument("--segments", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=300)
+    args = parser.parse_args()
+
+    environment = _environment(args.flags, args.segments)
+    compact = _deserialize(_serialize(environment)[1])
+    unshared = {
+        f_name: CompactFlag.from_dict(f_rule.db_representation())
+        for f_name, f_rule in environment.flags.items()
+    }
+    context = {"user": {"country": "DE", "email": "someone@a.com", "age": 30}}
+    assert compact.evaluate_dynamic_flags(context) == Environment.evaluate_rules(unshared, context)
+
+    shared_time = timeit.timeit(lambda: compact.evaluate_dynamic_flags(context), number=args.repeat)
+    unshared_time = timeit.timeit(
+        lambda: Environment.evaluate_rules(unshared, context), number=args.repeat
+    )
+    print(f"deduplication ratio {compact.dedup_ratio():.2f}")
+    print(f"shared subexpressions {shared_time / args.repeat * 1e3:>8.3f} ms per evaluation")
+    print(f"flags one by one      {unshared_time / args.repeat * 1e3:>8.3f} ms per evaluation")
+
+
+if __name__ == "__main__":
+    main()
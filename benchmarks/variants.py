@@ -0,0 +1,58 @@
+"""Quality of the distribution of the contexts between the variants of a flag.
+
+    python -m benchmarks.variants [--contexts N] [--weights W [W ...]]
+
+Assigns contexts with sequential keys, like user ids, reports the share of every variant
+against its weight with the chi-square statistic of the counts, then doubles the weight of the
+first variant and reports which contexts moved, which all have to move to the first variant.
+"""
+import argparse
+import time
+from collections import Counter
+
+from src.models import FlagRule
+
+
+def _flag_rule(weights) -> FlagRule:
+    return FlagRule(
+        variants=[{"value": f"v{i}", "weight": w} for i, w in enumerate(weights)],
+        default="off",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--contexts", type=int, default=200000)
+    parser.add_argument("--weights", type=int, nargs="+", default=[50, 25, 15, 10])
+    args = parser.parse_args()
+
+    flag_rule = _flag_rule(args.weights)
+    evaluator = flag_rule.compile()
+    contexts = [{"key": f"user-{i}"} for i in range(args.contexts)]
+    started_at = time.perf_counter()
+    assigned = [evaluator(context) for context in contexts]
+    elapsed = time.perf_counter() - started_at
+
+    counts = Counter(assigned)
+    total_weight = sum(args.weights)
+    chi_square = 0.0
+    for i, weight in enumerate(args.weights):
+        expected = args.contexts * weight / total_weight
+        chi_square += (counts[f"v{i}"] - expected) ** 2 / expected
+        print(f"v{i}{weight / total_weight:>12.2%}{counts[f'v{i}'] / args.contexts:>12.2%}")
+    print(f"chi-square {chi_square:.2f} with {len(args.weights) - 1} degrees of freedom")
+    print(f"{elapsed / args.contexts * 1e6:.2f} us per assignment")
+
+    increased = _flag_rule([args.weights[0] * 2, *args.weights[1:]])
+    increased.reallocate(flag_rule)
+    evaluator = increased.compile()
+    moved = Counter(
+        (old, new)
+        for old, new in zip(assigned, (evaluator(context) for context in contexts))
+        if old != new
+    )
+    print(f"moved after doubling the weight of v0: {dict(moved)}")
+
+
+if __name__ == "__main__":
+    main()
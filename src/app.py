@@ -1,27 +1,75 @@
-from beanie import init_beanie
+import asyncio
+
 from fastapi import FastAPI
 
+from src.common.base_model import init_documents
 from src.common.db import get_mongo_client
+from src.common.logger import get_logger
 from src import models
+from src.evaluation_cache import (
+    restore_evaluation_cache,
+    start_evaluation_cache,
+    stop_evaluation_cache,
+)
+from src.evaluation_pool import stop_evaluation_pool
+from src.evaluation_sessions import start_evaluation_sessions, stop_evaluation_sessions
+from src.exposures import start_exposure_recorder, stop_exposure_recorder
 from src.routes import init_routes
+from src.unique_contexts import start_unique_contexts_counter, stop_unique_contexts_counter
+from src.settings import settings
+
+logger = get_logger(__name__)
 
 
-def get_app() -> FastAPI:
+def get_app(evaluation_only: bool = False) -> FastAPI:
     _app = FastAPI()
-    init_routes(_app)
+    init_routes(_app, evaluation_only=evaluation_only)
+    _app.add_event_handler("startup", start_database)
+    _app.add_event_handler("shutdown", stop_services)
     return _app
 
 
-app = get_app()
+def get_evaluation_app() -> FastAPI:
+    """App for evaluation nodes: uvicorn --factory src.app:get_evaluation_app"""
+    return get_app(evaluation_only=True)
 
 
-@app.on_event("startup")
 async def start_database():
-    await initiate_database()
+    if restore_evaluation_cache():
+        # evaluation is served from the persisted snapshot while Mongo is connecting
+        asyncio.create_task(initiate_database_in_background())
+    else:
+        await initiate_database()
+    await start_evaluation_cache()
+    await start_exposure_recorder()
+    await start_unique_contexts_counter()
+    await start_evaluation_sessions()
+
+
+async def stop_services():
+    await stop_evaluation_sessions()
+    # buffered exposures and counters are written before the process exits
+    await stop_exposure_recorder()
+    await stop_unique_contexts_counter()
+    await stop_evaluation_cache()
+    stop_evaluation_pool()
 
 
 async def initiate_database():
-    await init_beanie(
+    await init_documents(
         database=get_mongo_client().get_default_database(),
         document_models=[models.Project, models.Environment],
     )
+
+
+async def initiate_database_in_background(retry_interval: float = 5.0):
+    while True:
+        try:
+            await initiate_database()
+            return
+        except Exception as e:
+            logger.warning(f"Fail to initiate database: {e}")
+            await asyncio.sleep(retry_interval)
+
+
+app = get_app(evaluation_only=settings.EVALUATION_ONLY)
@@ -0,0 +1,131 @@
+import base64
+import gzip
+import hashlib
+import json
+from collections import OrderedDict
+from enum import Enum
+from typing import Dict, Iterable, Optional, Tuple
+
+from src.common.metrics import metrics
+from src.lib.json_logic import project_data
+from src.models import Environment, FlagEvaluationResult
+from src.settings import settings
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class ContentEncoding(Enum):
+    BROTLI = "br"
+    GZIP = "gzip"
+    IDENTITY = "identity"
+
+
+def choose_encoding(accept_encoding: str) -> ContentEncoding:
+    accepted = {
+        token.split(";")[0].strip().lower() for token in accept_encoding.split(",") if token
+    }
+    if brotli is not None and ContentEncoding.BROTLI.value in accepted:
+        return ContentEncoding.BROTLI
+    if ContentEncoding.GZIP.value in accepted:
+        return ContentEncoding.GZIP
+    return ContentEncoding.IDENTITY
+
+
+def short_flag_id(flag_name: str) -> str:
+    """Stable 6 characters id of the flag, SDKs compute it the same way to map values back"""
+    digest = hashlib.blake2b(flag_name.encode(), digest_size=4).digest()
+    return base64.urlsafe_b64encode(digest).decode()[:6]
+
+
+def short_flag_ids(flag_names: Iterable[str]) -> Dict[str, str]:
+    """Ids of the flags in payloads, the full name for flags whose short id is ambiguous.
+
+    A short id is used only when no other flag has the same one and no flag is named like
+    it, so SDKs take a key which is the name of a flag as that flag, and short ids otherwise.
+    """
+    flag_names = set(flag_names)
+    by_short_id: Dict[str, list] = {}
+    for flag_name in flag_names:
+        by_short_id.setdefault(short_flag_id(flag_name), []).append(flag_name)
+    ids = {}
+    for short_id, names in by_short_id.items():
+        unique = len(names) == 1 and short_id not in flag_names
+        for flag_name in names:
+            ids[flag_name] = short_id if unique else flag_name
+    return ids
+
+
+def _compress(payload: bytes, encoding: ContentEncoding) -> bytes:
+    if encoding == ContentEncoding.BROTLI:
+        return brotli.compress(payload, quality=5)
+    if encoding == ContentEncoding.GZIP:
+        return gzip.compress(payload, compresslevel=6)
+    return payload
+
+
+class ClientBootstrapCache:
+    """Encoded and compressed flag values for client SDKs.
+
+    Payloads are cached by the version of the environment's rules and by the values of
+    the context fields those rules read, so all the contexts of the same cohort get the
+    same precompressed payload without evaluation and encoding. The results are kept with
+    the payload, so the values served from the cache are still recorded.
+    """
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._payloads: "OrderedDict[tuple, Tuple[bytes, Dict[str, FlagEvaluationResult]]]" = (
+            OrderedDict()
+        )
+
+    @staticmethod
+    def _context_key(environment: Environment, context: Optional[dict]) -> str:
+        paths = environment.context_paths()
+        projection = project_data(context, paths) if paths is not None else context
+        data = json.dumps(projection, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+    async def get_payload(
+        self,
+        environment: Environment,
+        context: Optional[dict],
+        short_ids: bool,
+        encoding: ContentEncoding,
+    ) -> Tuple[bytes, Dict[str, FlagEvaluationResult]]:
+        key = (
+            environment.id,
+            environment.rules_version(),
+            self._context_key(environment, context),
+            short_ids,
+            encoding,
+        )
+        cached = self._payloads.get(key)
+        if cached is not None:
+            metrics.inc("client_bootstrap_cache_hits_total")
+            self._payloads.move_to_end(key)
+            return cached
+
+        metrics.inc("client_bootstrap_cache_misses_total")
+        results = await environment.evaluate_flags(context) or {}
+        ids = short_flag_ids(results) if short_ids else {}
+        values = {ids.get(f_name, f_name): result.value for f_name, result in results.items()}
+        payload = _compress(json.dumps(values, separators=(",", ":")).encode(), encoding)
+
+        self._payloads[key] = payload, results
+        if len(self._payloads) > self._max_size:
+            self._payloads.popitem(last=False)
+        return payload, results
+
+
+_client_bootstrap_cache = None
+
+
+def get_client_bootstrap_cache() -> ClientBootstrapCache:
+    global _client_bootstrap_cache
+    if not _client_bootstrap_cache:
+        _client_bootstrap_cache = ClientBootstrapCache(settings.CLIENT_BOOTSTRAP_CACHE_SIZE)
+
+    return _client_bootstrap_cache
@@ -0,0 +1,119 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, List
+
+from src.common.metrics import metrics
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, class_name: str, reason: str):
+        super().__init__(f"Request of {class_name} is rejected: {reason}")
+        self.reason = reason
+
+
+class AdmissionClass:
+    def __init__(self, name: str, max_concurrency: int, max_queue: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+
+
+class AdmissionController:
+    """Limits concurrent requests per class and in total, queueing the requests over limits.
+
+    Classes are given in the order of their priority: a freed slot goes to the first waiting
+    request of the highest priority class which is under its own limit, and a request isn't
+    started while requests of higher priority classes wait for a slot.
+    """
+
+    def __init__(self, max_concurrency: int, classes: List[AdmissionClass], queue_timeout: float):
+        self._max_concurrency = max_concurrency
+        self._classes: Dict[str, AdmissionClass] = {c.name: c for c in classes}
+        self._queue_timeout = queue_timeout
+        self._running = 0
+
+    def _can_start(self, admission_class: AdmissionClass) -> bool:
+        return (
+            admission_class.running < admission_class.max_concurrency
+            and self._running < self._max_concurrency
+        )
+
+    def _is_preceded(self, admission_class: AdmissionClass) -> bool:
+        """Whether there are waiting requests which have to be started before the class'"""
+        for c in self._classes.values():
+            if c is admission_class:
+                return bool(c.waiters)
+            # classes waiting for their own slots don't hold back the others
+            if c.waiters and c.running < c.max_concurrency:
+                return True
+        return False
+
+    def _start(self, admission_class: AdmissionClass):
+        admission_class.running += 1
+        self._running += 1
+        metrics.set(
+            "admission_in_flight", admission_class.running, route_class=admission_class.name
+        )
+
+    def _update_queue_depth(self, admission_class: AdmissionClass):
+        metrics.set(
+            "admission_queue_depth", len(admission_class.waiters), route_class=admission_class.name
+        )
+
+    async def acquire(self, class_name: str):
+        admission_class = self._classes[class_name]
+        if self._can_start(admission_class) and not self._is_preceded(admission_class):
+            self._start(admission_class)
+            return
+
+        if len(admission_class.waiters) >= admission_class.max_queue:
+            metrics.inc("admission_rejected_total", route_class=class_name, reason="queue_full")
+            raise AdmissionRejected(class_name, "queue_full")
+
+        future = asyncio.get_running_loop().create_future()
+        admission_class.waiters.append(future)
+        self._update_queue_depth(admission_class)
+        metrics.inc("admission_queued_total", route_class=class_name)
+        started_at = time.monotonic()
+        try:
+            await asyncio.wait_for(future, self._queue_timeout)
+        except asyncio.TimeoutError:
+            metrics.inc("admission_rejected_total", route_class=class_name, reason="timeout")
+            raise AdmissionRejected(class_name, "timeout")
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was given right before the cancellation
+                self.release(class_name)
+            raise
+        finally:
+            if future in admission_class.waiters:
+                admission_class.waiters.remove(future)
+                # the requests held back by this one may start now
+                self._dispatch()
+            self._update_queue_depth(admission_class)
+            metrics.inc(
+                "admission_wait_seconds_total",
+                time.monotonic() - started_at,
+                route_class=class_name,
+            )
+
+    def release(self, class_name: str):
+        admission_class = self._classes[class_name]
+        admission_class.running -= 1
+        self._running -= 1
+        metrics.set("admission_in_flight", admission_class.running, route_class=class_name)
+        self._dispatch()
+
+    def _dispatch(self):
+        for admission_class in self._classes.values():
+            while admission_class.waiters and self._can_start(admission_class):
+                future = admission_class.waiters.popleft()
+                if future.done():
+                    continue
+                self._start(admission_class)
+                future.set_result(None)
+            if self._running >= self._max_concurrency:
+                return
@@ -1,17 +1,28 @@
+import asyncio
 from datetime import datetime
-from typing import Optional, List, Union
+from typing import ClassVar, Optional, List, Type, Union
 from uuid import uuid4
 
 from beanie import Document, WriteRules
 from beanie.odm.actions import ActionDirections
 from beanie.odm.documents import DocType
 from beanie.odm.fields import ExpressionField
+from beanie.odm.settings.document import DocumentSettings
 from beanie.odm.operators.update.general import BaseUpdateGeneralOperator
+from motor.motor_asyncio import AsyncIOMotorDatabase
 from pydantic import Field, BaseModel, root_validator
 from pymongo.client_session import ClientSession
 
+from src.common.db import MongoClientRole, get_mongo_client
+
+SCHEMA_VERSIONS_COLLECTION = "schema_versions"
+
 
 class BaseDocument(Document):
+    # bump it on changes of the indexes, validators or collection options,
+    # so they are applied on the next startup
+    schema_version: ClassVar[int] = 1
+
     id: str = Field(default_factory=lambda: uuid4().hex, alias="_id")
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
@@ -42,6 +53,51 @@ class BaseDocument(Document):
         ):
             await database.create_collection(cls._document_settings.motor_collection.name)
 
+    @classmethod
+    async def init_document(
+        cls, database: AsyncIOMotorDatabase, stored_schema_version: Optional[int]
+    ) -> None:
+        if stored_schema_version != cls.schema_version:
+            await cls.init_model(database, allow_index_dropping=False)
+            await database[SCHEMA_VERSIONS_COLLECTION].update_one(
+                {"_id": cls.__name__}, {"$set": {"version": cls.schema_version}}, upsert=True
+            )
+            return
+
+        # the collection, its indexes and validators are already there, so only the part
+        # of init_model which doesn't talk to the database is left
+        cls._document_settings = cls._local_document_settings(database)
+        cls.init_fields()
+        cls.init_cache()
+        cls.init_actions()
+
+    @classmethod
+    def _local_document_settings(cls, database: AsyncIOMotorDatabase) -> DocumentSettings:
+        """Settings like DocumentSettings.init builds them, without its buildInfo and indexes"""
+        settings_class = getattr(cls, "Settings", None)
+        document_settings = DocumentSettings.parse_obj(
+            {} if settings_class is None else dict(vars(settings_class))
+        )
+        document_settings.motor_db = database
+        if document_settings.union_doc is not None:
+            document_settings.name = document_settings.union_doc.register_doc(cls)
+        if not document_settings.name:
+            document_settings.name = cls.__name__
+        document_settings.motor_collection = database[document_settings.name]
+        return document_settings
+
+    @classmethod
+    def get_collection_for_role(cls, role: MongoClientRole):
+        database = get_mongo_client(role).get_default_database()
+        return database[cls.get_motor_collection().name]
+
+    @classmethod
+    async def find_many_for_role(
+        cls: Type[DocType], query: dict, role: MongoClientRole
+    ) -> List[DocType]:
+        """Find documents through the client of the role, e.g. evaluation reads from secondaries"""
+        return [cls.parse_obj(doc) async for doc in cls.get_collection_for_role(role).find(query)]
+
     @classmethod
     def update_many(cls, *args, **kwargs):
         return cls._document_settings.motor_collection.update_many(*args, **kwargs)
@@ -65,3 +121,16 @@ class Push(BaseUpdateGeneralOperator):
 
 class Pull(BaseUpdateGeneralOperator):
     operator = "$pull"
+
+
+async def init_documents(database: AsyncIOMotorDatabase, document_models: List[Type[BaseDocument]]):
+    """Replacement of init_beanie which skips the schema setup when it's up to date"""
+    stored_schema_versions = {
+        doc["_id"]: doc["version"] async for doc in database[SCHEMA_VERSIONS_COLLECTION].find()
+    }
+    await asyncio.gather(
+        *[
+            model.init_document(database, stored_schema_versions.get(model.__name__))
+            for model in document_models
+        ]
+    )
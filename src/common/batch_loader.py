@@ -0,0 +1,75 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, List, Optional, TypeVar
+
+from src.common.metrics import metrics
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class BatchLoader(Generic[K, V]):
+    """Loads values by keys, sharing loads between concurrent callers.
+
+    Concurrent loads of the same key wait for the same in-flight future, and keys
+    requested within ``window`` seconds are loaded with a single ``load_many`` call.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        load_many: Callable[[List[K]], Awaitable[Dict[K, V]]],
+        window: float,
+        max_batch_size: int,
+    ):
+        self._name = name
+        self._load_many = load_many
+        self._window = window
+        self._max_batch_size = max_batch_size
+        self._in_flight: Dict[K, asyncio.Future] = {}
+        self._pending: Dict[K, asyncio.Future] = {}
+        self._dispatch_handle: Optional[asyncio.TimerHandle] = None
+
+    async def load(self, key: K) -> Optional[V]:
+        future = self._in_flight.get(key)
+        if future is not None:
+            metrics.inc(f"{self._name}_coalesced_total")
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._in_flight[key] = future
+            self._pending[key] = future
+            self._schedule_dispatch()
+
+        # a cancelled caller must not cancel the load the others are waiting for
+        return await asyncio.shield(future)
+
+    def _schedule_dispatch(self):
+        if len(self._pending) >= self._max_batch_size:
+            if self._dispatch_handle:
+                self._dispatch_handle.cancel()
+            self._dispatch()
+        elif self._dispatch_handle is None:
+            self._dispatch_handle = asyncio.get_running_loop().call_later(
+                self._window, self._dispatch
+            )
+
+    def _dispatch(self):
+        self._dispatch_handle = None
+        batch, self._pending = self._pending, {}
+        asyncio.ensure_future(self._load(batch))
+
+    async def _load(self, batch: Dict[K, asyncio.Future]):
+        metrics.inc(f"{self._name}_batches_total")
+        metrics.inc(f"{self._name}_keys_total", len(batch))
+        try:
+            values = await self._load_many(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(values.get(key))
+        finally:
+            for key in batch:
+                self._in_flight.pop(key, None)
@@ -0,0 +1,36 @@
+from typing import Any
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_MEDIA_TYPES = {"application/msgpack", "application/x-msgpack"}
+
+
+def _media_types(header: str) -> set:
+    return {token.split(";")[0].strip().lower() for token in header.split(",") if token}
+
+
+def accepts_msgpack(request: Request) -> bool:
+    return msgpack is not None and bool(
+        _media_types(request.headers.get("Accept", "")) & MSGPACK_MEDIA_TYPES
+    )
+
+
+def is_msgpack(request: Request) -> bool:
+    return bool(_media_types(request.headers.get("Content-Type", "")) & MSGPACK_MEDIA_TYPES)
+
+
+class MsgPackResponse(Response):
+    """Content is packed as it is, bytes are sent as already packed"""
+
+    media_type = "application/msgpack"
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return msgpack.packb(content)
@@ -1,14 +1,108 @@
+import threading
+import time
+from enum import Enum
+from typing import Dict
+
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
 
+from src.common.metrics import metrics
 from src.settings import settings
 
 
-_mongo_client = None
+class MongoClientRole(Enum):
+    # reads and writes of the admin API, always on the primary
+    ADMIN = "admin"
+    # evaluation reads, which tolerate bounded staleness and can go to secondaries
+    EVALUATION = "evaluation"
+
+
+class _PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Connection pool usage of a client, by its role"""
+
+    def __init__(self, role: MongoClientRole):
+        self._role = role.value
+        # check out is started and finished in the same thread, which waits for a connection
+        self._local = threading.local()
+        # current numbers of connections, exposed as gauges
+        self._lock = threading.Lock()
+        self._checked_out = 0
+        self._connections = 0
+
+    def _update_checked_out(self, delta: int):
+        with self._lock:
+            self._checked_out += delta
+            metrics.set("mongo_pool_checked_out", self._checked_out, role=self._role)
+
+    def _update_connections(self, delta: int):
+        with self._lock:
+            self._connections += delta
+            metrics.set("mongo_pool_connections", self._connections, role=self._role)
+
+    def connection_check_out_started(self, event):
+        self._local.started_at = time.monotonic()
+
+    def _record_wait(self):
+        started_at = getattr(self._local, "started_at", None)
+        if started_at is not None:
+            metrics.inc(
+                "mongo_pool_wait_seconds_total", time.monotonic() - started_at, role=self._role
+            )
+            self._local.started_at = None
+
+    def connection_checked_out(self, event):
+        self._record_wait()
+        metrics.inc("mongo_pool_checkouts_total", role=self._role)
+        self._update_checked_out(1)
+
+    def connection_check_out_failed(self, event):
+        self._record_wait()
+        metrics.inc("mongo_pool_checkout_failures_total", role=self._role, reason=event.reason)
+
+    def connection_checked_in(self, event):
+        self._update_checked_out(-1)
+
+    def connection_created(self, event):
+        self._update_connections(1)
+
+    def connection_closed(self, event):
+        self._update_connections(-1)
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+
+def _client_options(role: MongoClientRole) -> dict:
+    if role == MongoClientRole.EVALUATION:
+        options = {
+            "maxPoolSize": settings.MONGODB_EVALUATION_POOL_SIZE,
+            "readPreference": settings.MONGODB_EVALUATION_READ_PREFERENCE,
+        }
+        if settings.MONGODB_EVALUATION_READ_PREFERENCE != "primary":
+            options["maxStalenessSeconds"] = settings.MONGODB_EVALUATION_MAX_STALENESS_SECONDS
+        return options
+
+    return {"maxPoolSize": settings.MONGODB_ADMIN_POOL_SIZE, "readPreference": "primary"}
+
+
+_mongo_clients: Dict[MongoClientRole, AsyncIOMotorClient] = {}
 
 
-def get_mongo_client():
-    global _mongo_client
-    if not _mongo_client:
-        _mongo_client = AsyncIOMotorClient(settings.MONGODB_CONNECTION_URL)
+def get_mongo_client(role: MongoClientRole = MongoClientRole.ADMIN):
+    if role not in _mongo_clients:
+        _mongo_clients[role] = AsyncIOMotorClient(
+            settings.MONGODB_CONNECTION_URL,
+            event_listeners=[_PoolMetricsListener(role)],
+            **_client_options(role),
+        )
 
-    return _mongo_client
+    return _mongo_clients[role]
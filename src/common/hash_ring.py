@@ -0,0 +1,26 @@
+import bisect
+import hashlib
+from typing import Iterable, List, Optional
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hashing of keys to nodes.
+
+    Every node is put on the ring ``vnodes`` times and a key belongs to the first node
+    after the key's hash, so when a node joins or leaves only the keys of its points
+    move, which is about 1/N of all the keys.
+    """
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = 100):
+        points = sorted((_hash(f"{node}#{i}"), node) for node in set(nodes) for i in range(vnodes))
+        self._hashes: List[int] = [h for h, _ in points]
+        self._nodes: List[str] = [node for _, node in points]
+
+    def node_for(self, key: str) -> Optional[str]:
+        if not self._hashes:
+            return None
+        return self._nodes[bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)]
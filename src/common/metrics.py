@@ -0,0 +1,70 @@
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metrics:
+    """In-process counters and gauges exposed in the Prometheus text format"""
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[Labels, float]] = defaultdict(dict)
+        self._gauges: Dict[str, Dict[Labels, float]] = defaultdict(dict)
+        self._collectors: List[Callable[[], None]] = []
+        # mongo pool events come from the threads of the motor executor
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _labels(labels: dict) -> Labels:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = self._labels(labels)
+        with self._lock:
+            self._gauges[name][key] = value
+
+    def clear(self, name: str):
+        """Drop all the series of a gauge, e.g. of the labels which are gone"""
+        with self._lock:
+            self._gauges.pop(name, None)
+
+    def get(self, name: str, **labels) -> float:
+        key = self._labels(labels)
+        with self._lock:
+            series = self._counters.get(name) or self._gauges.get(name) or {}
+            return series.get(key, 0)
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Register a function which updates gauges right before they are exposed"""
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], None]):
+        self._collectors.remove(collector)
+
+    def expose(self) -> str:
+        for collector in self._collectors:
+            collector()
+
+        lines = []
+        # other threads add series while they are rendered otherwise
+        with self._lock:
+            for kind, metrics in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted(metrics):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for labels, value in metrics[name].items():
+                        if labels:
+                            rendered = ",".join(f'{k}="{v}"' for k, v in labels)
+                            lines.append(f"{name}{{{rendered}}} {value}")
+                        else:
+                            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
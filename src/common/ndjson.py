@@ -0,0 +1,38 @@
+from typing import AsyncIterator
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+class LineTooLong(ValueError):
+    pass
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_line_size: int) -> AsyncIterator[bytes]:
+    """Split a stream into lines, holding in memory at most one line"""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+        if len(buffer) > max_line_size:
+            raise LineTooLong(f"Line is longer than {max_line_size} bytes")
+    if buffer:
+        yield buffer
+
+
+class NDJSONStreamingResponse(StreamingResponse):
+    """Streaming response whose content is produced while the request body is still read.
+
+    StreamingResponse listens for the client disconnection with ``receive``, which would
+    take the chunks of the request body away from the content generator. Here the
+    disconnection shows up as a failed ``send`` instead.
+    """
+
+    media_type = "application/x-ndjson"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,49 @@
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class TokenBucket:
+    """Allows ``rate`` requests per second on average and bursts of ``burst`` requests"""
+
+    __slots__ = ("rate", "burst", "_tokens", "_updated_at")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+
+    def take(self) -> float:
+        """Take a token, returns 0 on success or seconds until a token is available"""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets by keys, the least recently used buckets are evicted over ``max_buckets``"""
+
+    def __init__(self, max_buckets: int):
+        self._max_buckets = max_buckets
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def take(self, key: str, rate: float, burst: Optional[float] = None) -> float:
+        """Take a token from the bucket of the key, a rate of 0 means no limit"""
+        if not rate:
+            return 0.0
+
+        burst = burst or max(rate, 1)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+            if len(self._buckets) > self._max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.rate, bucket.burst = rate, burst
+        return bucket.take()
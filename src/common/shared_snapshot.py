@@ -0,0 +1,197 @@
+import fcntl
+import json
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Dict, Optional, Tuple
+
+from src.common.logger import get_logger
+
+logger = get_logger(__name__)
+
+# generation of the published snapshot, generation which is being written,
+# time when the data was loaded from the source, whether it was restored from a backup
+_HEADER = struct.Struct("<QQd?")
+# length of the index at the beginning of every buffer
+_INDEX_SIZE = struct.Struct("<Q")
+
+RecordVersion = str
+
+
+class SnapshotTooLarge(ValueError):
+    pass
+
+
+class SharedSnapshot:
+    """Set of serialized records published by one process and read by all the others.
+
+    The segment consists of a header and two buffers. A new snapshot is always written
+    to the buffer which is not used by the current generation, and the generation is
+    bumped only after the write is finished, so readers never see a partial snapshot.
+    Every buffer starts with a JSON index ``{record_id: [offset, length, version]}``
+    followed by the records themselves, offsets are counted from the end of the index.
+    """
+
+    def __init__(self, name: str, size: int, lock_file: str):
+        self._lock_file = lock_file
+        self._lock_fd = None
+        self._shm = self._open_segment(name, size)
+        self._buffer_size = (self._shm.size - _HEADER.size) // 2
+
+        self._generation = 0
+        self._data_offset = 0
+        self._index: Dict[str, Tuple[int, int, RecordVersion]] = {}
+
+    @staticmethod
+    def _open_segment(name: str, size: int) -> shared_memory.SharedMemory:
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            shm = shared_memory.SharedMemory(name=name)
+        # the segment outlives every single worker, so it must not be unlinked
+        # by the resource tracker when the process that opened it exits
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+    def _read_header(self) -> Tuple[int, int, float, bool]:
+        return _HEADER.unpack_from(self._shm.buf, 0)
+
+    def _buffer_offset(self, generation: int) -> int:
+        return _HEADER.size + (generation % 2) * self._buffer_size
+
+    @property
+    def generation(self) -> int:
+        return self._read_header()[0]
+
+    @property
+    def published_at(self) -> Optional[float]:
+        generation, _, published_at, _ = self._read_header()
+        return published_at if generation else None
+
+    @property
+    def restored(self) -> bool:
+        return self._read_header()[3]
+
+    def _sync_index(self) -> int:
+        while True:
+            generation = self._read_header()[0]
+            if generation == self._generation:
+                return generation
+
+            offset = self._buffer_offset(generation)
+            (index_size,) = _INDEX_SIZE.unpack_from(self._shm.buf, offset)
+            start = offset + _INDEX_SIZE.size
+            index_data = bytes(self._shm.buf[start : start + min(index_size, self._buffer_size)])
+
+            # like in read(), the index of a buffer which is being rewritten may be torn
+            writing = self._read_header()[1]
+            if writing <= generation + 1:
+                self._index = json.loads(index_data)
+                self._data_offset = start + index_size
+                self._generation = generation
+                return generation
+
+    def version(self, record_id: str) -> Optional[RecordVersion]:
+        self._sync_index()
+        position = self._index.get(record_id)
+        return position[2] if position else None
+
+    def read(self, record_id: str) -> Optional[Tuple[RecordVersion, bytes]]:
+        while True:
+            generation = self._sync_index()
+            position = self._index.get(record_id)
+            if not position:
+                return None
+
+            offset, length, version = position
+            start = self._data_offset + offset
+            data = bytes(self._shm.buf[start : start + length])
+
+            # the buffer is reused for the generation after the next one, if the writer
+            # has already started it the copy may be torn and has to be taken again
+            writing = self._read_header()[1]
+            if writing <= generation + 1:
+                return version, data
+
+    def record_ids(self):
+        self._sync_index()
+        return self._index.keys()
+
+    def acquire_leadership(self) -> bool:
+        """Try to become the only process which publishes snapshots"""
+        if self._lock_fd is not None:
+            return True
+
+        fd = open(self._lock_file, "w")
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            fd.close()
+            return False
+
+        self._lock_fd = fd
+        return True
+
+    @property
+    def is_leader(self) -> bool:
+        return self._lock_fd is not None
+
+    def publish(
+        self,
+        records: Dict[str, Tuple[RecordVersion, bytes]],
+        published_at: Optional[float] = None,
+        restored: bool = False,
+    ) -> int:
+        index = {}
+        offset = 0
+        for record_id, (version, data) in records.items():
+            index[record_id] = [offset, len(data), version]
+            offset += len(data)
+        index_data = json.dumps(index).encode()
+
+        data_start = _INDEX_SIZE.size + len(index_data)
+        if data_start + offset > self._buffer_size:
+            raise SnapshotTooLarge(
+                f"Snapshot of {data_start + offset} bytes doesn't fit "
+                f"into the buffer of {self._buffer_size} bytes"
+            )
+        generation, _, previous_published_at, previous_restored = self._read_header()
+        new_generation = generation + 1
+        _HEADER.pack_into(
+            self._shm.buf, 0, generation, new_generation, previous_published_at, previous_restored
+        )
+
+        buffer_offset = self._buffer_offset(new_generation)
+        _INDEX_SIZE.pack_into(self._shm.buf, buffer_offset, len(index_data))
+        self._shm.buf[buffer_offset + _INDEX_SIZE.size : buffer_offset + data_start] = index_data
+        position = buffer_offset + data_start
+        for _, data in records.values():
+            self._shm.buf[position : position + len(data)] = data
+            position += len(data)
+
+        _HEADER.pack_into(
+            self._shm.buf,
+            0,
+            new_generation,
+            new_generation,
+            published_at or time.time(),
+            restored,
+        )
+        return new_generation
+
+    def touch(self, published_at: Optional[float] = None) -> None:
+        """Mark the published snapshot as loaded from the source again, when it's unchanged"""
+        generation, writing, _, _ = self._read_header()
+        _HEADER.pack_into(self._shm.buf, 0, generation, writing, published_at or time.time(), False)
+
+    def close(self):
+        if self._lock_fd is not None:
+            self._lock_fd.close()
+            self._lock_fd = None
+        self._index = {}
+        self._shm.close()
+
+    def unlink(self):
+        # SharedMemory.unlink unregisters the segment from the resource tracker itself
+        resource_tracker.register(self._shm._name, "shared_memory")
+        self._shm.unlink()
@@ -0,0 +1,32 @@
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+from src.common.shared_snapshot import RecordVersion
+
+Records = Dict[str, Tuple[RecordVersion, bytes]]
+
+
+def dump_records(path: str, records: Records, published_at: float) -> None:
+    """Write records to the file atomically, so a crash never leaves a partial snapshot"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(json.dumps({"published_at": published_at}).encode() + b"\n")
+        for record_id, (version, data) in records.items():
+            f.write(b" ".join((record_id.encode(), version.encode(), data)) + b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_records(path: str) -> Optional[Tuple[Records, float]]:
+    if not os.path.exists(path):
+        return None
+
+    records = {}
+    with open(path, "rb") as f:
+        header = json.loads(f.readline())
+        for line in f:
+            record_id, version, data = line.rstrip(b"\n").split(b" ", 2)
+            records[record_id.decode()] = (version.decode(), data)
+    return records, header["published_at"]
@@ -0,0 +1,337 @@
+import hashlib
+import json
+import sys
+from collections import ChainMap
+from types import MappingProxyType
+from weakref import WeakValueDictionary
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Mapping,
+    MutableMapping,
+    NamedTuple,
+    Optional,
+)
+
+from src.common.content_types import msgpack
+from src.lib.json_logic import SharedSubexpressions
+from src.models import (
+    ALLOWED_TYPES,
+    Environment,
+    FlagEvaluation,
+    FlagEvaluationResult,
+    FlagRule,
+    Variant,
+    flags_context_paths,
+    order_flags,
+)
+
+
+def _hash_key(api_key: str) -> bytes:
+    return hashlib.blake2b(api_key.encode(), digest_size=16).digest()
+
+
+def _flag_rule(data: dict) -> FlagRule:
+    flag_rule = FlagRule.construct(**data)
+    if flag_rule.variants is not None:
+        flag_rule.variants = [Variant(**v) for v in flag_rule.variants]
+    return flag_rule
+
+
+class _CompiledFlag:
+    __slots__ = ("evaluator", "paths", "prerequisites", "nodes", "__weakref__")
+
+    def __init__(self, flag_rule: FlagRule, evaluator: Optional[Callable[[Any], Any]] = None):
+        self.evaluator: Callable[[Any], Any] = evaluator or flag_rule.compile()
+        paths = flag_rule.var_paths()
+        self.paths: Optional[FrozenSet[str]] = (
+            None if paths is None else frozenset(sys.intern(p) for p in paths)
+        )
+        prerequisites = flag_rule.prerequisites()
+        self.prerequisites: Optional[FrozenSet[str]] = (
+            None if prerequisites is None else frozenset(prerequisites)
+        )
+        self.nodes: int = flag_rule.complexity()
+
+
+# compiled flags by their JSON, shared by all the environments with the same flags
+_compiled_flags: "WeakValueDictionary[str, _CompiledFlag]" = WeakValueDictionary()
+
+
+class CompactFlag(NamedTuple):
+    """Rules of a flag with their evaluator, duck-typed as FlagRule for the evaluation.
+
+    The flag is kept as interned JSON, it is needed only to be sent to SDKs and to the
+    evaluation pool, and the flags copied from a project share both the JSON and the evaluator.
+    """
+
+    flag_json: str
+    default: Optional[ALLOWED_TYPES]
+    compiled: _CompiledFlag
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "CompactFlag":
+        flag_json = sys.intern(json.dumps(data, separators=(",", ":"), sort_keys=True))
+        compiled = _compiled_flags.get(flag_json)
+        if compiled is None:
+            compiled = _compiled_flags[flag_json] = _CompiledFlag(_flag_rule(data))
+        return cls(flag_json, data["default"], compiled)
+
+    @property
+    def rules(self) -> Any:
+        return self.db_representation()["rules"]
+
+    def compile(self) -> Callable[[Any], Any]:
+        return self.compiled.evaluator
+
+    def var_paths(self) -> Optional[FrozenSet[str]]:
+        return self.compiled.paths
+
+    def prerequisites(self) -> Optional[FrozenSet[str]]:
+        return self.compiled.prerequisites
+
+    def complexity(self) -> int:
+        return self.compiled.nodes
+
+    def db_representation(self) -> dict:
+        return json.loads(self.flag_json)
+
+
+class _SharedFlags:
+    """Flags whose rules have subexpressions in common with other flags of the environment,
+    compiled into one DAG, and the deduplication ratio of the operations of all the rules"""
+
+    __slots__ = ("flags", "dedup_ratio", "__weakref__")
+
+    def __init__(self, flags: Mapping[str, CompactFlag]):
+        shared = SharedSubexpressions(
+            {name: flag.db_representation()["rules"] for name, flag in flags.items()}
+        )
+        self.dedup_ratio = shared.dedup_ratio()
+        self.flags: Dict[str, CompactFlag] = {}
+        for name in shared.sharing_rules():
+            flag_rule = _flag_rule(flags[name].db_representation())
+            try:
+                evaluator = flag_rule.build_evaluator(shared.compile(name))
+            except Exception:
+                # the flag fails on evaluation, as compiled on its own
+                continue
+            self.flags[name] = flags[name]._replace(compiled=_CompiledFlag(flag_rule, evaluator))
+
+
+# shared flags by the rules version, shared by all the environments with the same flags
+_shared_flags: "WeakValueDictionary[str, _SharedFlags]" = WeakValueDictionary()
+
+
+class KeyLimits(NamedTuple):
+    rate_limit: Optional[float] = None
+    rate_limit_burst: Optional[int] = None
+
+
+_NO_LIMITS = KeyLimits()
+
+
+class HashedKeys:
+    """API keys of an environment, only their hashes and the limits which are set are kept"""
+
+    __slots__ = ("_hashes", "_limits")
+
+    def __init__(self, descriptions: Dict[str, dict]):
+        self._hashes: FrozenSet[bytes] = frozenset(_hash_key(key) for key in descriptions)
+        self._limits: Dict[bytes, KeyLimits] = {
+            _hash_key(key): KeyLimits(d.get("rate_limit"), d.get("rate_limit_burst"))
+            for key, d in descriptions.items()
+            if d.get("rate_limit") is not None or d.get("rate_limit_burst") is not None
+        }
+
+    def get(self, api_key: Optional[str]) -> Optional[KeyLimits]:
+        # keys of other schemes or missing keys are None
+        if not isinstance(api_key, str):
+            return None
+        key_hash = _hash_key(api_key)
+        if key_hash not in self._hashes:
+            return None
+        return self._limits.get(key_hash, _NO_LIMITS)
+
+    def __contains__(self, api_key: Optional[str]) -> bool:
+        return isinstance(api_key, str) and _hash_key(api_key) in self._hashes
+
+
+def _results_fragment(results: Mapping[str, FlagEvaluationResult]) -> str:
+    """Members of the JSON object of the results, without the braces"""
+    return ",".join(
+        f"{json.dumps(f_name)}:"
+        + json.dumps(
+            {"value": res.value, "status": res.status.value, "reason": res.reason},
+            separators=(",", ":"),
+        )
+        for f_name, res in results.items()
+    )
+
+
+def _packed_results_pairs(packer: "msgpack.Packer", results: Mapping[str, FlagEvaluationResult]):
+    """Keys and values of the MessagePack map of the results, without the map's header"""
+    return b"".join(
+        packer.pack(f_name)
+        + packer.pack({"value": res.value, "status": res.status.value, "reason": res.reason})
+        for f_name, res in results.items()
+    )
+
+
+class CompactEnvironment:
+    """Immutable environment of the evaluation cache, duck-typed as Environment for evaluation.
+
+    It keeps only what evaluation needs: compiled flags under interned names, the hashes of
+    the API keys and the values derived from the rules, computed once at construction.
+    Flags whose rules don't read the context are evaluated once as well, and their results
+    are kept along with their JSON, and their MessagePack once it's requested, so a request
+    evaluates and encodes only the dynamic flags. The dynamic
+    flags are ordered after their prerequisites, which read the context if any of theirs does.
+    Subexpressions found in the rules of several flags are evaluated once per request.
+    """
+
+    __slots__ = (
+        "id",
+        "flags",
+        "dynamic_flags",
+        "static_results",
+        "_static_evaluations",
+        "_static_json",
+        "_static_msgpack",
+        "_rules_msgpack",
+        "server_side_keys",
+        "client_side_keys",
+        "_rules_version",
+        "_rules_complexity",
+        "_context_paths",
+        "_shared_flags",
+    )
+
+    def __init__(self, fields: dict):
+        self.id = sys.intern(fields["_id"])
+        data = json.dumps(fields.get("flags") or {}, sort_keys=True)
+        self._rules_version = hashlib.blake2b(data.encode(), digest_size=8).hexdigest()
+
+        flags = {
+            sys.intern(name): CompactFlag.from_dict(rule)
+            for name, rule in (fields.get("flags") or {}).items()
+        }
+        shared_flags = _shared_flags.get(self._rules_version)
+        if shared_flags is None:
+            shared_flags = _shared_flags[self._rules_version] = _SharedFlags(flags)
+        self._shared_flags = shared_flags
+        flags.update(shared_flags.flags)
+        self.flags: Optional[Mapping[str, CompactFlag]] = (
+            None if fields.get("flags") is None else MappingProxyType(flags)
+        )
+        self.server_side_keys = HashedKeys(fields["server_side_keys"])
+        self.client_side_keys = HashedKeys(fields["client_side_keys"])
+
+        self._rules_complexity = sum(flag.complexity() for flag in flags.values())
+        try:
+            order = order_flags(flags)
+        except ValueError:
+            # stored before the prerequisites were validated, such flags fail on evaluation
+            order = None
+        flags_paths = flags_context_paths(flags, order)
+        self._context_paths: Optional[FrozenSet[str]] = (
+            None
+            if any(paths is None for paths in flags_paths.values())
+            else frozenset(sys.intern(path) for paths in flags_paths.values() for path in paths)
+        )
+
+        static_results = {}
+        static_evaluations: Dict[str, FlagEvaluation] = {}
+        for name in order or flags:
+            if flags_paths[name] == set():
+                evaluated = ChainMap({}, static_evaluations)
+                try:
+                    static_results[name] = Environment.evaluate_rules(
+                        {name: flags[name]}, None, flags, evaluated
+                    )[name]
+                except ValueError:
+                    # the result isn't valid, e.g. the default is missing,
+                    # and the flag fails the same way on every request
+                    continue
+                static_evaluations[name] = evaluated[name]
+        self.static_results: Mapping[str, FlagEvaluationResult] = MappingProxyType(static_results)
+        self._static_evaluations: Mapping[str, FlagEvaluation] = MappingProxyType(
+            static_evaluations
+        )
+        self.dynamic_flags: Mapping[str, CompactFlag] = MappingProxyType(
+            {name: flags[name] for name in order or flags if name not in static_results}
+        )
+        self._static_json = _results_fragment(self.static_results)
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError(f"{type(self).__name__} is immutable")
+        super().__setattr__(name, value)
+
+    def rules_version(self) -> str:
+        return self._rules_version
+
+    def rules_complexity(self) -> int:
+        return self._rules_complexity
+
+    def context_paths(self) -> Optional[FrozenSet[str]]:
+        return self._context_paths
+
+    def dedup_ratio(self) -> float:
+        """Operations in the rules per operation evaluated, 1.0 when no subtree is repeated"""
+        return self._shared_flags.dedup_ratio
+
+    async def get_all_rules(self) -> Optional[Mapping[str, CompactFlag]]:
+        return self.flags
+
+    def _evaluations(self) -> MutableMapping[str, FlagEvaluation]:
+        """Evaluations of a request, over the static ones which are shared without copying"""
+        return ChainMap({}, self._static_evaluations)
+
+    def evaluate_dynamic_flags(self, context: dict) -> Dict[str, FlagEvaluationResult]:
+        return Environment.evaluate_rules(
+            self.dynamic_flags, context, self.flags, self._evaluations()
+        )
+
+    def dump_results(self, dynamic_results: Dict[str, FlagEvaluationResult]) -> bytes:
+        """JSON of the results of all the flags, given the results of the dynamic ones"""
+        fragments = [self._static_json, _results_fragment(dynamic_results)]
+        return ("{" + ",".join(f for f in fragments if f) + "}").encode()
+
+    def dump_results_msgpack(self, dynamic_results: Dict[str, FlagEvaluationResult]) -> bytes:
+        """MessagePack of the results of all the flags, given the results of the dynamic ones"""
+        packer = msgpack.Packer()
+        if not hasattr(self, "_static_msgpack"):
+            self._static_msgpack = _packed_results_pairs(packer, self.static_results)
+        return (
+            packer.pack_map_header(len(self.static_results) + len(dynamic_results))
+            + self._static_msgpack
+            + _packed_results_pairs(packer, dynamic_results)
+        )
+
+    def dump_rules_msgpack(self) -> bytes:
+        if not hasattr(self, "_rules_msgpack"):
+            self._rules_msgpack = msgpack.packb(
+                None
+                if self.flags is None
+                else {f_name: flag.db_representation() for f_name, flag in self.flags.items()}
+            )
+        return self._rules_msgpack
+
+    async def evaluate_flag(self, flag_name: str, context: dict) -> Optional[FlagEvaluationResult]:
+        result = self.static_results.get(flag_name)
+        if result is not None:
+            return result
+        flag = self.dynamic_flags.get(flag_name)
+        if not flag:
+            return
+        return Environment.evaluate_rules(
+            {flag_name: flag}, context, self.flags, self._evaluations()
+        )[flag_name]
+
+    async def evaluate_flags(self, context: dict) -> Optional[Dict[str, FlagEvaluationResult]]:
+        if not self.flags:
+            return
+        return {**self.static_results, **self.evaluate_dynamic_flags(context)}
@@ -0,0 +1,282 @@
+import asyncio
+import hashlib
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+from src.common.db import MongoClientRole
+from src.common.logger import get_logger
+from src.common.metrics import metrics
+from src.common.shared_snapshot import SharedSnapshot, RecordVersion, SnapshotTooLarge
+from src.common.snapshot_file import Records, dump_records, load_records
+from src.compact_environment import CompactEnvironment
+from src.models import Environment
+from src.settings import settings
+from src.sharding import Shard, get_shard
+
+logger = get_logger(__name__)
+
+# how many environments are decoded between giving control back to the event loop
+_WARM_UP_CHUNK_SIZE = 100
+
+
+def _serialize(environment: Environment) -> Tuple[RecordVersion, bytes]:
+    data = environment.json(by_alias=True, exclude={"created_at", "updated_at"}).encode()
+    return hashlib.blake2b(data, digest_size=8).hexdigest(), data
+
+
+def _deserialize(data: bytes) -> CompactEnvironment:
+    # the data was validated before it got into the snapshot, and the compact environment
+    # doesn't need the database to be initialized, so a restored snapshot is served
+    # while Mongo is still unreachable
+    return CompactEnvironment(json.loads(data))
+
+
+class EvaluationCache:
+    """Environments used for flags evaluation.
+
+    All the environments, or only the node's shard of them, live once per host in a shared
+    memory snapshot, which is refreshed from Mongo by a single worker. Every worker decodes only the environments
+    it is asked for and keeps them until their version in the snapshot changes.
+    """
+
+    def __init__(
+        self,
+        shared: SharedSnapshot,
+        refresh_interval: float,
+        load_concurrency: int,
+        load_batch_size: int,
+        snapshot_path: Optional[str] = None,
+        persist_interval: float = 60.0,
+        shard: Optional[Shard] = None,
+    ):
+        self._shared = shared
+        self._refresh_interval = refresh_interval
+        self._load_concurrency = load_concurrency
+        self._load_batch_size = load_batch_size
+        self._snapshot_path = snapshot_path
+        self._persist_interval = persist_interval
+        self._shard = shard
+        self._persisted_at: Optional[float] = None
+        self._unpersisted: Optional[Tuple[Records, float]] = None
+        self._environments: Dict[str, Tuple[RecordVersion, CompactEnvironment]] = {}
+        self._warmed_up = False
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, environment_id: str) -> Optional[CompactEnvironment]:
+        version = self._shared.version(environment_id)
+        if version is None:
+            self._environments.pop(environment_id, None)
+            return None
+
+        cached = self._environments.get(environment_id)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        record = self._shared.read(environment_id)
+        if record is None:
+            return None
+        version, data = record
+        environment = _deserialize(data)
+        self._environments[environment_id] = (version, environment)
+        return environment
+
+    async def _load(self, ids: List[str], semaphore: asyncio.Semaphore) -> List[Environment]:
+        async with semaphore:
+            return await Environment.find_many_for_role(
+                {"_id": {"$in": ids}}, MongoClientRole.EVALUATION
+            )
+
+    async def refresh(self) -> int:
+        ids = await Environment.get_collection_for_role(MongoClientRole.EVALUATION).distinct("_id")
+        if self._shard:
+            ids = [environment_id for environment_id in ids if self._shard.owns(environment_id)]
+        semaphore = asyncio.Semaphore(self._load_concurrency)
+        batches = await asyncio.gather(
+            *[
+                self._load(ids[i : i + self._load_batch_size], semaphore)
+                for i in range(0, len(ids), self._load_batch_size)
+            ]
+        )
+        records = {env.id: _serialize(env) for batch in batches for env in batch}
+        published_at = time.time()
+        if self._is_published(records):
+            # workers keep what they decoded, only the time of the load is updated
+            self._shared.touch(published_at)
+            return self._shared.generation
+        generation = self._shared.publish(records, published_at=published_at)
+        if self._snapshot_path:
+            self._unpersisted = (records, published_at)
+        return generation
+
+    def _is_published(self, records: Records) -> bool:
+        if not self._shared.generation or len(self._shared.record_ids()) != len(records):
+            return False
+        return all(
+            self._shared.version(record_id) == version
+            for record_id, (version, _) in records.items()
+        )
+
+    def restore(self) -> bool:
+        """Publish the last persisted snapshot, to serve it until Mongo is available"""
+        if not self._snapshot_path:
+            return False
+        try:
+            loaded = load_records(self._snapshot_path)
+        except (OSError, ValueError, KeyError) as e:
+            # environments are loaded from the database instead
+            logger.error(f"Fail to restore environments from {self._snapshot_path}: {e}")
+            return False
+        if loaded is None:
+            return False
+
+        # other workers serve whatever the leader has published
+        if self._shared.acquire_leadership() and not self._shared.generation:
+            records, published_at = loaded
+            self._shared.publish(records, published_at=published_at, restored=True)
+            logger.info(f"Restored {len(records)} environments from {self._snapshot_path}")
+        return True
+
+    async def _persist(self):
+        if not self._unpersisted or not self._shared.is_leader:
+            return
+        if self._persisted_at and time.monotonic() - self._persisted_at < self._persist_interval:
+            return
+
+        records, published_at = self._unpersisted
+        self._unpersisted = None
+        self._persisted_at = time.monotonic()
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, dump_records, self._snapshot_path, records, published_at
+            )
+        except OSError as e:
+            logger.warning(f"Fail to persist environments: {e}")
+
+    async def _try_refresh(self):
+        try:
+            if self._shared.acquire_leadership():
+                await self.refresh()
+        except SnapshotTooLarge as e:
+            logger.error(f"Fail to publish environments: {e}")
+        except Exception as e:
+            logger.warning(f"Fail to refresh environments: {e}")
+
+    async def warm_up(self):
+        while not self._shared.generation:
+            await self._try_refresh()
+            if not self._shared.generation:
+                await asyncio.sleep(self._refresh_interval)
+
+        started_at = time.monotonic()
+        for i, environment_id in enumerate(list(self._shared.record_ids())):
+            self.get(environment_id)
+            if i % _WARM_UP_CHUNK_SIZE == 0:
+                await asyncio.sleep(0)
+
+        self._warmed_up = True
+        logger.info(
+            f"Warmed up {len(self._environments)} environments "
+            f"in {time.monotonic() - started_at:.3f}s"
+        )
+
+    async def _run(self):
+        await self.warm_up()
+        while True:
+            await asyncio.sleep(self._refresh_interval)
+            await self._try_refresh()
+            await self._persist()
+
+    def status(self) -> dict:
+        published_at = self._shared.published_at
+        staleness = None if published_at is None else time.time() - published_at
+        return {
+            "ready": self._warmed_up,
+            "leader": self._shared.is_leader,
+            "generation": self._shared.generation,
+            "environments": len(self._environments),
+            "staleness": staleness,
+            "restored": self._shared.restored,
+            "stale": self._shared.restored
+            or staleness is None
+            or staleness > settings.EVALUATION_CACHE_MAX_STALENESS,
+        }
+
+    def collect_metrics(self):
+        status = self.status()
+        metrics.set("evaluation_cache_ready", int(status["ready"]))
+        metrics.set("evaluation_cache_generation", status["generation"])
+        metrics.set("evaluation_cache_environments", status["environments"])
+        metrics.set("evaluation_cache_restored", int(status["restored"]))
+        metrics.set("evaluation_cache_stale", int(status["stale"]))
+        if status["staleness"] is not None:
+            metrics.set("evaluation_cache_staleness_seconds", status["staleness"])
+        metrics.clear("evaluation_cache_dedup_ratio")
+        for environment_id, (_, environment) in self._environments.items():
+            metrics.set(
+                "evaluation_cache_dedup_ratio",
+                environment.dedup_ratio(),
+                environment=environment_id,
+            )
+
+    async def start(self):
+        metrics.add_collector(self.collect_metrics)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            metrics.remove_collector(self.collect_metrics)
+            self._task.cancel()
+            self._task = None
+        self._environments = {}
+        self._shared.close()
+
+
+_evaluation_cache = None
+
+
+def get_evaluation_cache() -> Optional[EvaluationCache]:
+    global _evaluation_cache
+    if not settings.EVALUATION_CACHE_ENABLED:
+        return None
+    if not _evaluation_cache:
+        _evaluation_cache = EvaluationCache(
+            SharedSnapshot(
+                settings.EVALUATION_CACHE_SHM_NAME,
+                settings.EVALUATION_CACHE_SHM_SIZE,
+                settings.EVALUATION_CACHE_LOCK_FILE,
+            ),
+            settings.EVALUATION_CACHE_REFRESH_INTERVAL,
+            settings.EVALUATION_CACHE_LOAD_CONCURRENCY,
+            settings.EVALUATION_CACHE_LOAD_BATCH_SIZE,
+            settings.EVALUATION_CACHE_SNAPSHOT_PATH,
+            settings.EVALUATION_CACHE_PERSIST_INTERVAL,
+            get_shard(),
+        )
+
+    return _evaluation_cache
+
+
+def get_readiness() -> dict:
+    cache = get_evaluation_cache()
+    if not cache:
+        return {"ready": True, "live": True}
+    return {"live": True, **cache.status()}
+
+
+def restore_evaluation_cache() -> bool:
+    cache = get_evaluation_cache()
+    return bool(cache) and cache.restore()
+
+
+async def start_evaluation_cache():
+    cache = get_evaluation_cache()
+    if cache:
+        await cache.start()
+
+
+async def stop_evaluation_cache():
+    global _evaluation_cache
+    if _evaluation_cache:
+        await _evaluation_cache.stop()
+        _evaluation_cache = None
@@ -0,0 +1,99 @@
+import asyncio
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from src.common.metrics import metrics
+from src.lib.json_logic import count_nodes
+from src.models import Environment, FlagEvaluationResult, FlagRule
+from src.settings import settings
+
+# compiled rules of the environments evaluated by the current pool process
+_pool_environments: "OrderedDict[str, Tuple[str, Dict[str, FlagRule]]]" = OrderedDict()
+_POOL_ENVIRONMENTS_LIMIT = 1000
+
+
+def _evaluate_in_pool(
+    environment_id: str, version: str, flags: Optional[dict], context: dict
+) -> Optional[Dict[str, FlagEvaluationResult]]:
+    cached = _pool_environments.get(environment_id)
+    if cached is None or cached[0] != version:
+        if flags is None:
+            # the rules aren't loaded into this process yet, the caller has to send them
+            return None
+        cached = (version, {f_name: FlagRule(**f_rule) for f_name, f_rule in flags.items()})
+        for flag_rule in cached[1].values():
+            flag_rule.compile()
+        _pool_environments[environment_id] = cached
+        if len(_pool_environments) > _POOL_ENVIRONMENTS_LIMIT:
+            _pool_environments.popitem(last=False)
+
+    _pool_environments.move_to_end(environment_id)
+    return Environment.evaluate_rules(cached[1], context)
+
+
+class EvaluationPool:
+    """Evaluates expensive requests in other processes, to not block the event loop.
+
+    The cost of a request is the number of nodes in the rules of the environment plus
+    the number of nodes in the context. Requests cheaper than ``cost_threshold`` are
+    evaluated inline, since sending them to another process costs more than evaluation.
+    """
+
+    def __init__(self, max_workers: int, cost_threshold: int):
+        self._cost_threshold = cost_threshold
+        self._executor = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+
+    def is_expensive(self, environment: Environment, context: Optional[dict]) -> bool:
+        cost = environment.rules_complexity()
+        if cost < self._cost_threshold:
+            cost += count_nodes(context)
+        return cost >= self._cost_threshold
+
+    async def evaluate_flags(
+        self, environment: Environment, context: Optional[dict]
+    ) -> Optional[Dict[str, FlagEvaluationResult]]:
+        rules = await environment.get_all_rules()
+        if not rules:
+            return
+
+        metrics.inc("evaluations_offloaded_total")
+        loop = asyncio.get_running_loop()
+        version = environment.rules_version()
+        results = await loop.run_in_executor(
+            self._executor, _evaluate_in_pool, environment.id, version, None, context
+        )
+        if results is None:
+            flags = {f_name: f_rule.db_representation() for f_name, f_rule in rules.items()}
+            results = await loop.run_in_executor(
+                self._executor, _evaluate_in_pool, environment.id, version, flags, context
+            )
+        return results
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_evaluation_pool = None
+
+
+def get_evaluation_pool() -> Optional[EvaluationPool]:
+    global _evaluation_pool
+    if not settings.EVALUATION_POOL_WORKERS:
+        return None
+    if not _evaluation_pool:
+        _evaluation_pool = EvaluationPool(
+            settings.EVALUATION_POOL_WORKERS, settings.EVALUATION_POOL_COST_THRESHOLD
+        )
+
+    return _evaluation_pool
+
+
+def stop_evaluation_pool():
+    global _evaluation_pool
+    if _evaluation_pool:
+        _evaluation_pool.shutdown()
+        _evaluation_pool = None
@@ -0,0 +1,373 @@
+import asyncio
+import json
+from typing import (
+    AbstractSet,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    FrozenSet,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from starlette.websockets import WebSocket
+
+from src.common.db import MongoClientRole
+from src.common.logger import get_logger
+from src.common.metrics import metrics
+from src.evaluation_cache import get_evaluation_cache
+from src.exposures import track_results
+from src.lib.json_logic import project_data
+from src.models import Environment, FlagEvaluationResult, flags_context_paths, order_flags
+from src.settings import settings
+
+logger = get_logger(__name__)
+
+LoadEnvironments = Callable[[List[str]], Awaitable[Dict[str, Environment]]]
+# value, status and reason of a result, tuples take a fraction of the memory of dicts
+Value = Tuple[Any, str, str]
+
+
+class SessionsLimitReached(Exception):
+    pass
+
+
+class EvaluationSession:
+    """Context registered by a client and the values last sent to it"""
+
+    __slots__ = ("environment_id", "context", "flags", "values", "websocket")
+
+    def __init__(
+        self,
+        environment_id: str,
+        context: Optional[dict],
+        flags: Optional[FrozenSet[str]],
+        websocket: WebSocket,
+    ):
+        self.environment_id = environment_id
+        self.context = context
+        # flags the client is interested in, None for all of them
+        self.flags = flags
+        self.values: Dict[str, Value] = {}
+        self.websocket = websocket
+
+
+class _EnvironmentSessions:
+    __slots__ = ("sessions", "rules_version", "flag_versions")
+
+    def __init__(self, environment: Environment, flags: dict):
+        self.sessions: Set[EvaluationSession] = set()
+        self.rules_version = environment.rules_version()
+        self.flag_versions = _flag_versions(flags)
+
+
+def _flag_versions(flags: dict) -> Dict[str, str]:
+    return {
+        f_name: json.dumps(f_rule.db_representation(), sort_keys=True)
+        for f_name, f_rule in flags.items()
+    }
+
+
+def _value(result: FlagEvaluationResult) -> Value:
+    return result.value, result.status.value, result.reason
+
+
+def _values(results: Dict[str, FlagEvaluationResult]) -> Dict[str, Value]:
+    return {f_name: _value(res) for f_name, res in results.items()}
+
+
+def _message(values: Dict[str, Value], removed: AbstractSet[str] = frozenset()) -> dict:
+    message = {
+        "results": {
+            f_name: {"value": value, "status": status, "reason": reason}
+            for f_name, (value, status, reason) in values.items()
+        }
+    }
+    if removed:
+        message["removed"] = sorted(removed)
+    return message
+
+
+def _affected_flags(flags: dict, changed: Set[str], order: Optional[List[str]]) -> Set[str]:
+    """Changed flags and the flags requiring them"""
+    if order is None:
+        # the prerequisites can't be followed, any flag with prerequisites may be affected
+        return changed | {f_name for f_name, f_rule in flags.items() if f_rule.prerequisites()}
+
+    affected = set(changed)
+    for f_name in order:
+        if flags[f_name].prerequisites() & affected:
+            affected.add(f_name)
+    return affected
+
+
+class EvaluationSessions:
+    """Pushes new values of flags to the clients which registered their contexts.
+
+    Sessions are grouped by environment, and a single task checks the rules version of the
+    environments with sessions every ``poll_interval`` seconds, so an idle session costs
+    only its context and the values sent to it. When the rules change, only the changed
+    flags and the flags requiring them are evaluated, once per distinct projection of the
+    contexts on the paths the flags read, and a session gets only the values which changed.
+    """
+
+    def __init__(
+        self,
+        load_environments: LoadEnvironments,
+        poll_interval: float,
+        max_sessions: int,
+        send_timeout: float,
+    ):
+        self._load_environments = load_environments
+        self._poll_interval = poll_interval
+        self._max_sessions = max_sessions
+        self._send_timeout = send_timeout
+        self._environments: Dict[str, _EnvironmentSessions] = {}
+        self._sessions_count = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def open(
+        self,
+        environment: Environment,
+        context: Optional[dict],
+        flags: Optional[AbstractSet[str]],
+        websocket: WebSocket,
+    ) -> EvaluationSession:
+        if self._sessions_count >= self._max_sessions:
+            metrics.inc("evaluation_sessions_rejected_total")
+            raise SessionsLimitReached(f"Worker has {self._sessions_count} sessions")
+
+        session = EvaluationSession(
+            environment.id, context, None if flags is None else frozenset(flags), websocket
+        )
+        sessions = self._environments.get(environment.id)
+        if sessions is not None:
+            environment = await self._refresh(sessions, environment)
+        all_flags = await environment.get_all_rules() or {}
+        # the group may have been created or closed while the environment was loaded
+        sessions = self._environments.get(environment.id)
+        if sessions is None:
+            sessions = self._environments[environment.id] = _EnvironmentSessions(
+                environment, all_flags
+            )
+        sessions.sessions.add(session)
+        self._sessions_count += 1
+        metrics.set("evaluation_sessions", self._sessions_count)
+
+        await self._send_all(session, environment, all_flags)
+        return session
+
+    async def update(
+        self,
+        session: EvaluationSession,
+        environment: Environment,
+        context: Optional[dict],
+        flags: Optional[AbstractSet[str]],
+    ):
+        sessions = self._environments.get(session.environment_id)
+        if sessions is not None:
+            environment = await self._refresh(sessions, environment)
+        session.context = context
+        session.flags = None if flags is None else frozenset(flags)
+        session.values = {}
+        await self._send_all(session, environment, await environment.get_all_rules() or {})
+
+    async def _refresh(
+        self, sessions: _EnvironmentSessions, environment: Environment
+    ) -> Environment:
+        """Environment to evaluate a session of the group with.
+
+        The environment of a request can be older or newer than the rules the group was
+        last evaluated with. The current one is loaded then, and the group is brought up
+        to date with it, so the session doesn't keep values no poll would change.
+        """
+        if environment.rules_version() == sessions.rules_version:
+            return environment
+        current = await self._load_environments([environment.id])
+        environment = current.get(environment.id, environment)
+        if environment.rules_version() != sessions.rules_version:
+            await self._push_changes(sessions, environment)
+        return environment
+
+    def close(self, session: EvaluationSession):
+        sessions = self._environments.get(session.environment_id)
+        if sessions is None or session not in sessions.sessions:
+            return
+        sessions.sessions.discard(session)
+        if not sessions.sessions:
+            del self._environments[session.environment_id]
+        self._sessions_count -= 1
+        metrics.set("evaluation_sessions", self._sessions_count)
+
+    async def _send_all(self, session: EvaluationSession, environment: Environment, flags: dict):
+        rules = (
+            flags
+            if session.flags is None
+            else {f_name: f_rule for f_name, f_rule in flags.items() if f_name in session.flags}
+        )
+        results = Environment.evaluate_rules(rules, session.context, flags)
+        track_results(session.environment_id, results, session.context)
+        session.values = _values(results)
+        await self._send(session, _message(session.values))
+
+    async def _send(self, session: EvaluationSession, message: dict):
+        try:
+            await asyncio.wait_for(session.websocket.send_json(message), self._send_timeout)
+            metrics.inc("evaluation_session_pushes_total")
+        except Exception as e:
+            # the client doesn't read its messages, it has to open a new session
+            logger.info(f"Fail to send to session of {session.environment_id}: {e}")
+            self.close(session)
+            try:
+                await session.websocket.close(code=1011)
+            except Exception:
+                pass
+
+    async def poll(self):
+        if not self._environments:
+            return
+        environments = await self._load_environments(list(self._environments))
+        for environment_id, environment in environments.items():
+            sessions = self._environments.get(environment_id)
+            if sessions is not None and environment.rules_version() != sessions.rules_version:
+                await self._push_changes(sessions, environment)
+
+    async def _push_changes(self, sessions: _EnvironmentSessions, environment: Environment):
+        flags = await environment.get_all_rules() or {}
+        flag_versions = _flag_versions(flags)
+        changed = {
+            f_name
+            for f_name, version in flag_versions.items()
+            if sessions.flag_versions.get(f_name) != version
+        }
+        removed = set(sessions.flag_versions) - set(flag_versions)
+        sessions.rules_version = environment.rules_version()
+        sessions.flag_versions = flag_versions
+        try:
+            order = order_flags(flags)
+        except ValueError:
+            order = None
+        affected = _affected_flags(flags, changed, order)
+        if not affected and not removed:
+            return
+        flags_paths = flags_context_paths(flags, order)
+
+        # sessions which see the same values of the paths read by their flags get the same results
+        evaluations: Dict[str, Dict[str, FlagEvaluationResult]] = {}
+        messages = []
+        for session in list(sessions.sessions):
+            names = affected if session.flags is None else affected & session.flags
+            gone = removed if session.flags is None else removed & session.flags
+            if not names and not gone:
+                continue
+
+            results = {}
+            if names:
+                results = self._evaluate(names, flags, flags_paths, session.context, evaluations)
+            changed = {
+                f_name: result
+                for f_name, result in results.items()
+                if session.values.get(f_name) != _value(result)
+            }
+            # only the pushed values are served to the client
+            track_results(session.environment_id, changed, session.context)
+            changed_values = _values(changed)
+            session.values.update(changed_values)
+            for f_name in gone:
+                session.values.pop(f_name, None)
+
+            if changed_values or gone:
+                messages.append((session, _message(changed_values, gone)))
+
+        await asyncio.gather(*[self._send(session, message) for session, message in messages])
+
+    @staticmethod
+    def _evaluate(
+        names: AbstractSet[str],
+        flags: dict,
+        flags_paths: dict,
+        context: Optional[dict],
+        evaluations: Dict[str, Dict[str, FlagEvaluationResult]],
+    ) -> Dict[str, FlagEvaluationResult]:
+        key = None
+        if all(flags_paths[f_name] is not None for f_name in names):
+            paths = set().union(*[flags_paths[f_name] for f_name in names])
+            key = json.dumps([sorted(names), project_data(context, paths)])
+            if key in evaluations:
+                return evaluations[key]
+
+        metrics.inc("evaluation_session_evaluations_total")
+        rules = {f_name: flags[f_name] for f_name in names}
+        results = Environment.evaluate_rules(rules, context, flags)
+        if key is not None:
+            evaluations[key] = results
+        return results
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._poll_interval)
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.warning(f"Fail to check environments of sessions: {e}")
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for sessions in list(self._environments.values()):
+            for session in list(sessions.sessions):
+                self.close(session)
+                try:
+                    await session.websocket.close(code=1001)
+                except Exception:
+                    pass
+
+
+async def _load_environments(environment_ids: List[str]) -> Dict[str, Environment]:
+    cache = get_evaluation_cache()
+    if cache:
+        cached = {environment_id: cache.get(environment_id) for environment_id in environment_ids}
+        return {environment_id: env for environment_id, env in cached.items() if env is not None}
+
+    environments = await Environment.find_many_for_role(
+        {"_id": {"$in": environment_ids}}, MongoClientRole.EVALUATION
+    )
+    return {env.id: env for env in environments}
+
+
+_evaluation_sessions = None
+
+
+def get_evaluation_sessions() -> Optional[EvaluationSessions]:
+    global _evaluation_sessions
+    if not settings.EVALUATION_SESSIONS_ENABLED:
+        return None
+    if not _evaluation_sessions:
+        _evaluation_sessions = EvaluationSessions(
+            _load_environments,
+            settings.EVALUATION_SESSIONS_POLL_INTERVAL,
+            settings.EVALUATION_SESSIONS_MAX_SESSIONS,
+            settings.EVALUATION_SESSIONS_SEND_TIMEOUT,
+        )
+
+    return _evaluation_sessions
+
+
+async def start_evaluation_sessions():
+    sessions = get_evaluation_sessions()
+    if sessions:
+        await sessions.start()
+
+
+async def stop_evaluation_sessions():
+    global _evaluation_sessions
+    if _evaluation_sessions:
+        await _evaluation_sessions.stop()
+        _evaluation_sessions = None
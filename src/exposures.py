@@ -0,0 +1,180 @@
+import asyncio
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from pymongo.errors import CollectionInvalid
+
+from src.common.db import get_mongo_client
+from src.common.logger import get_logger
+from src.common.metrics import metrics
+from src.lib.json_logic import project_data
+from src.models import FlagEvaluationResult
+from src.settings import settings
+from src.unique_contexts import get_unique_contexts_counter
+
+logger = get_logger(__name__)
+
+EXPOSURES_COLLECTION = "exposures"
+
+
+class ExposureRecorder:
+    """Records which flag values were served to whom, without waiting for Mongo.
+
+    Exposures are appended to a bounded in-memory buffer and written with insert_many
+    to a time-series collection when ``flush_size`` of them are collected or every
+    ``flush_interval`` seconds. When the buffer is full new exposures are dropped and
+    counted, so a slow database never grows the memory or the latency of evaluation.
+    """
+
+    def __init__(self, buffer_size: int, flush_size: int, flush_interval: float, context_key: str):
+        self._buffer = deque()
+        self._buffer_size = buffer_size
+        self._flush_size = flush_size
+        self._flush_interval = flush_interval
+        self._context_key_paths = {context_key}
+        self._flush_requested = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def _context_key(self, context: Optional[dict]) -> Any:
+        [(_, found, value)] = project_data(context, self._context_key_paths)
+        return value if found else None
+
+    def record(
+        self,
+        environment_id: str,
+        results: Optional[Dict[str, FlagEvaluationResult]],
+        context: Optional[dict],
+    ):
+        if not results:
+            return
+
+        free = self._buffer_size - len(self._buffer)
+        if free < len(results):
+            metrics.inc("exposures_dropped_total", len(results) - max(free, 0))
+        if free <= 0:
+            return
+
+        timestamp = datetime.utcnow()
+        context_key = self._context_key(context)
+        for flag_name, result in list(results.items())[:free]:
+            self._buffer.append(
+                {
+                    "timestamp": timestamp,
+                    "meta": {"environment_id": environment_id, "flag": flag_name},
+                    "value": result.value,
+                    "context_key": context_key,
+                }
+            )
+        metrics.inc("exposures_recorded_total", min(free, len(results)))
+
+        if len(self._buffer) >= self._flush_size:
+            self._flush_requested.set()
+
+    async def flush(self):
+        while self._buffer:
+            batch = [
+                self._buffer.popleft() for _ in range(min(self._flush_size, len(self._buffer)))
+            ]
+            try:
+                await self._collection().insert_many(batch, ordered=False)
+                metrics.inc("exposures_flushed_total", len(batch))
+            except Exception as e:
+                metrics.inc("exposures_flush_failures_total", len(batch))
+                logger.warning(f"Fail to flush {len(batch)} exposures: {e}")
+
+    @staticmethod
+    def _collection():
+        return get_mongo_client().get_default_database()[EXPOSURES_COLLECTION]
+
+    @staticmethod
+    async def create_collection():
+        try:
+            await get_mongo_client().get_default_database().create_collection(
+                EXPOSURES_COLLECTION,
+                timeseries={
+                    "timeField": "timestamp",
+                    "metaField": "meta",
+                    "granularity": "seconds",
+                },
+            )
+        except CollectionInvalid:
+            # already exists
+            pass
+
+    async def _run(self):
+        try:
+            await self.create_collection()
+        except Exception as e:
+            # exposures are still written, only into a regular collection
+            logger.warning(f"Fail to create {EXPOSURES_COLLECTION} collection: {e}")
+
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            # cancelling would lose the batch being inserted, the task stops after its flush
+            self._stopping = True
+            self._flush_requested.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+
+_exposure_recorder = None
+
+
+def get_exposure_recorder() -> Optional[ExposureRecorder]:
+    global _exposure_recorder
+    if not settings.EXPOSURES_ENABLED:
+        return None
+    if not _exposure_recorder:
+        _exposure_recorder = ExposureRecorder(
+            settings.EXPOSURES_BUFFER_SIZE,
+            settings.EXPOSURES_FLUSH_SIZE,
+            settings.EXPOSURES_FLUSH_INTERVAL,
+            settings.EXPOSURES_CONTEXT_KEY,
+        )
+
+    return _exposure_recorder
+
+
+def is_tracking() -> bool:
+    return bool(get_exposure_recorder() or get_unique_contexts_counter())
+
+
+def track_results(
+    environment_id: str,
+    results: Optional[Dict[str, FlagEvaluationResult]],
+    context: Optional[dict],
+):
+    """Record the values served to a context, on every path which serves them"""
+    recorder = get_exposure_recorder()
+    if recorder:
+        recorder.record(environment_id, results, context)
+    counter = get_unique_contexts_counter()
+    if counter:
+        counter.record(environment_id, results, context)
+
+
+async def start_exposure_recorder():
+    recorder = get_exposure_recorder()
+    if recorder:
+        await recorder.start()
+
+
+async def stop_exposure_recorder():
+    global _exposure_recorder
+    if _exposure_recorder:
+        await _exposure_recorder.stop()
+        _exposure_recorder = None
@@ -0,0 +1,81 @@
+import hashlib
+import math
+from typing import Dict
+
+_HASH_BITS = 64
+
+
+def hash_value(value: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """Approximate count of distinct values in ``2 ** precision`` bytes.
+
+    The standard error is ``1.04 / sqrt(2 ** precision)``, about 1.6% for the default
+    precision. Sketches of the same precision are merged by taking the maximum of every
+    register, so merging is commutative and idempotent.
+    """
+
+    def __init__(self, precision: int = 12):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be from 4 to 16")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add_hash(self, value_hash: int) -> bool:
+        """Add a 64 bits hash of the value, returns whether the sketch was changed"""
+        index = value_hash >> (_HASH_BITS - self.precision)
+        rest = value_hash & ((1 << (_HASH_BITS - self.precision)) - 1)
+        rank = _HASH_BITS - self.precision - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def add(self, value: bytes) -> bool:
+        return self.add_hash(hash_value(value))
+
+    def merge(self, other: "HyperLogLog"):
+        if other.precision != self.precision:
+            raise ValueError("only sketches of the same precision can be merged")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def reduce(self, precision: int) -> "HyperLogLog":
+        """The same sketch with a lower precision, as if the values were added to it"""
+        if precision > self.precision:
+            raise ValueError("a sketch can't be converted to a higher precision")
+        shift = self.precision - precision
+        sketch = HyperLogLog(precision)
+        for i, r in enumerate(self.registers):
+            if not r:
+                continue
+            # the dropped index bits become the leading bits of the rest of the hash
+            dropped = i & ((1 << shift) - 1)
+            rank = shift - dropped.bit_length() + 1 if dropped else r + shift
+            if rank > sketch.registers[i >> shift]:
+                sketch.registers[i >> shift] = rank
+        return sketch
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is more precise for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def to_dict(self) -> Dict[str, int]:
+        """Non zero registers, by their index"""
+        return {str(i): r for i, r in enumerate(self.registers) if r}
+
+    @classmethod
+    def from_dict(cls, registers: Dict[str, int], precision: int = 12) -> "HyperLogLog":
+        sketch = cls(precision)
+        for i, r in registers.items():
+            if not 0 <= int(i) < len(sketch.registers):
+                raise ValueError(f"register {i} is out of a sketch of precision {precision}")
+            sketch.registers[int(i)] = r
+        return sketch
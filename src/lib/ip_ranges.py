@@ -0,0 +1,96 @@
+import ipaddress
+import socket
+from typing import Dict, Iterable, Optional, Tuple, Union
+
+# a node maps the next byte of the address to its child, or to True when all the addresses
+# with the bytes so far are in the ranges
+_Node = Dict[int, Union["_Node", bool]]
+
+_IPV4_MAPPED_PREFIX = bytes(10) + b"\xff\xff"
+
+
+def _pack(address: str) -> Optional[Tuple[int, bytes]]:
+    """IP version and bytes of the address, IPv4-mapped IPv6 addresses are IPv4"""
+    # inet_pton parses the address several times faster than ipaddress
+    try:
+        return 4, socket.inet_pton(socket.AF_INET, address)
+    except (OSError, ValueError):
+        pass
+    try:
+        packed = socket.inet_pton(socket.AF_INET6, address)
+    except (OSError, ValueError):
+        return None
+    if packed[:12] == _IPV4_MAPPED_PREFIX:
+        return 4, packed[12:]
+    return 6, packed
+
+
+class IPRanges:
+    """IPv4 and IPv6 networks in prefix tries with a byte per level.
+
+    Prefixes which don't end on a byte boundary are expanded into the bytes they cover, and
+    networks inside already added ones are dropped, so a lookup walks at most 4 levels for
+    IPv4 and 16 for IPv6 whatever the number of networks.
+    """
+
+    __slots__ = ("_roots", "_everything")
+
+    def __init__(self, networks: Iterable[str] = ()):
+        self._roots: Dict[int, _Node] = {4: {}, 6: {}}
+        self._everything = {4: False, 6: False}
+        for network in networks:
+            self.add(network)
+
+    def add(self, network: str) -> None:
+        if not isinstance(network, str):
+            raise ValueError(f"Invalid network: {network!r}")
+        # host bits are ignored, 10.1.2.3/8 is 10.0.0.0/8
+        parsed = ipaddress.ip_network(network.strip(), strict=False)
+        if parsed.prefixlen == 0:
+            self._everything[parsed.version] = True
+            return
+
+        data = parsed.network_address.packed
+        full_bytes, remaining_bits = divmod(parsed.prefixlen, 8)
+        node = self._roots[parsed.version]
+        for byte in data[: full_bytes if remaining_bits else full_bytes - 1]:
+            child = node.get(byte)
+            if child is True:
+                return
+            if child is None:
+                child = node[byte] = {}
+            node = child
+
+        if not remaining_bits:
+            node[data[full_bytes - 1]] = True
+            return
+        first = data[full_bytes] & (0xFF << (8 - remaining_bits)) & 0xFF
+        for byte in range(first, first + (1 << (8 - remaining_bits))):
+            node[byte] = True
+
+    def __contains__(self, address) -> bool:
+        """Whether the address is in the ranges, False for values which aren't addresses"""
+        parsed = _pack(address) if isinstance(address, str) else None
+        if parsed is None:
+            return False
+        version, packed = parsed
+        if self._everything[version]:
+            return True
+
+        node = self._roots[version]
+        for byte in packed:
+            child = node.get(byte)
+            if child is True:
+                return True
+            if child is None:
+                return False
+            node = child
+        return False
+
+
+def parse_ranges(networks) -> IPRanges:
+    if isinstance(networks, str):
+        networks = [networks]
+    if not isinstance(networks, (list, tuple)):
+        raise ValueError(f"Invalid networks: {networks!r}")
+    return IPRanges(networks)
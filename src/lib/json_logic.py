@@ -2,9 +2,14 @@
 # which supposed to be a Python implementation of the jsonLogic JS library:
 # https://github.com/jwadhams/json-logic-js
 
+import json
+import re
 import sys
-from functools import reduce
-from typing import Optional
+from collections import Counter
+from functools import lru_cache, reduce
+from typing import Any, Callable, Dict, Mapping, Optional, Set, Tuple
+
+from src.lib import ip_ranges, versions
 
 OPERATIONS = {
     "==": (lambda a, b: a == b),
@@ -33,6 +38,77 @@ OPERATIONS = {
 }
 
 
+def _regex(pattern) -> "re.Pattern":
+    if not isinstance(pattern, str):
+        raise ValueError(f"Invalid regex: {pattern!r}")
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        raise ValueError(f"Invalid regex {pattern!r}: {e}")
+
+
+def _affixes(affixes) -> Tuple[str, ...]:
+    affixes = tuple(affixes) if isinstance(affixes, (list, tuple)) else (affixes,)
+    if not all(isinstance(affix, str) for affix in affixes):
+        raise ValueError(f"Invalid prefix or suffix: {affixes!r}")
+    return affixes
+
+
+def _version_comparison(op, version) -> Tuple[Callable[[Any, Any], bool], versions.VersionKey]:
+    if op not in versions.COMPARISONS:
+        raise ValueError(f"Invalid version comparison: {op!r}")
+    return versions.COMPARISONS[op], versions.parse_version(version)
+
+
+# operations whose arguments after the first one are patterns, which are prepared once
+# when they are literals of the rule: op -> (preparation of the patterns, matching of the
+# first argument against the prepared patterns)
+PATTERN_OPERATIONS: Dict[str, Tuple[Callable[..., Any], Callable[[Any, Any], Any]]] = {
+    "regex": (_regex, lambda a, pattern: isinstance(a, str) and pattern.search(a) is not None),
+    "starts_with": (_affixes, lambda a, prefixes: isinstance(a, str) and a.startswith(prefixes)),
+    "ends_with": (_affixes, lambda a, suffixes: isinstance(a, str) and a.endswith(suffixes)),
+    "semver": (
+        _version_comparison,
+        lambda a, comparison: comparison[0](versions.parse_version(a), comparison[1]),
+    ),
+    "version_in": (versions.parse_range, versions.satisfies),
+    "ip_in_ranges": (ip_ranges.parse_ranges, lambda a, ranges: a in ranges),
+}
+
+
+def _hashable(value):
+    return tuple(value) if isinstance(value, list) else value
+
+
+def _pattern_operation(prepare, match) -> Callable[..., Any]:
+    # patterns computed during evaluation, and those of evaluate(), are prepared once as well
+    prepare = lru_cache(maxsize=1024)(prepare)
+    return lambda a, *patterns: match(a, prepare(*map(_hashable, patterns)))
+
+
+OPERATIONS.update(
+    {op: _pattern_operation(prepare, match) for op, (prepare, match) in PATTERN_OPERATIONS.items()}
+)
+
+
+@lru_cache(maxsize=1024)
+def _prepare_literal(op: str, patterns: str):
+    return PATTERN_OPERATIONS[op][0](*json.loads(patterns))
+
+
+def prepare_patterns(op: str, patterns: list):
+    """Patterns written in a rule, prepared once for all the parses and compilations of it.
+
+    Rules are parsed on every load of their environment, so an IP trie or a regex of a
+    rule is built only when it isn't among the recently prepared ones.
+    """
+    try:
+        key = json.dumps(patterns, sort_keys=True, separators=(",", ":"))
+    except (TypeError, ValueError):
+        return PATTERN_OPERATIONS[op][0](*patterns)
+    return _prepare_literal(op, key)
+
+
 def _get_value(_data, key):
     if type(_data) == dict:
         if key in _data.keys():
@@ -46,6 +122,50 @@ def _get_value(_data, key):
             raise ValueError(f"Invalid context: key '{key}': {e}")
 
 
+def _get_var(data, a):
+    return reduce(_get_value, str(a).split("."), data)
+
+
+class ContextIndex:
+    """Values of the context by their dotted paths, shared by all the rules of a request.
+
+    A path is resolved once, on the first lookup, from the already resolved value of its
+    parent path, so rules reading ``user.*`` walk the context's ``user`` only once.
+    ``flags`` gives the values of other flags of the request to the "flag" operation.
+    """
+
+    __slots__ = ("data", "flags", "_values", "_shared")
+
+    def __init__(self, data: Optional[dict], flags: Optional[Callable[[str], Any]] = None):
+        self.data = data or {}
+        self.flags = flags
+        # path -> (whether the path exists, its value or the error of the lookup)
+        self._values = {}
+        # the same of the subexpressions shared by rules, by their evaluators
+        self._shared = {}
+
+    def get(self, path):
+        path = str(path)
+        resolved = self._values.get(path)
+        if resolved is None:
+            parent, _, key = path.rpartition(".")
+            try:
+                resolved = (True, _get_value(self.get(parent) if parent else self.data, key))
+            except (ValueError, TypeError) as e:
+                resolved = (False, e)
+            self._values[path] = resolved
+
+        found, value = resolved
+        if not found:
+            raise value.with_traceback(None)
+        return value
+
+    def flag(self, name):
+        if self.flags is None:
+            raise ValueError(f"Value of flag '{name}' isn't available")
+        return self.flags(str(name))
+
+
 def evaluate(tests, data: Optional[dict]):
     # You've recursed to a primitive, stop!
     if tests is None or type(tests) != dict:
@@ -56,13 +176,9 @@ def evaluate(tests, data: Optional[dict]):
     op = next(iter(tests))
     values = tests[op]
 
-    OPERATIONS["var"] = lambda a: reduce(
-        _get_value,
-        str(a).split("."),
-        data,
-    )
-
-    if op not in OPERATIONS:
+    # "var" depends on the data, so it's resolved here instead of being put into
+    # the shared OPERATIONS, which keeps evaluation safe to run concurrently
+    if op != "var" and op not in OPERATIONS:
         raise RuntimeError("Unrecognized operation %s" % op)
 
     # Easy syntax for unary operators, like {"var": "x"} instead of strict
@@ -73,4 +189,272 @@ def evaluate(tests, data: Optional[dict]):
     # Recursion!
     values = map(lambda val: evaluate(val, data), values)
 
+    if op == "var":
+        return _get_var(data, *values)
     return OPERATIONS[op](*values)
+
+
+def _compile_var(values, args):
+    if len(values) == 1 and type(values[0]) != dict:
+        # the path is known, which is the case of almost every rule
+        path = str(values[0])
+        return lambda index: index.get(path)
+    return lambda index: index.get(*[arg(index) for arg in args])
+
+
+def _compile_flag(values, args):
+    if len(values) == 1 and type(values[0]) != dict:
+        name = str(values[0])
+        return lambda index: index.flag(name)
+    return lambda index: index.flag(args[0](index))
+
+
+# operations which read the request instead of only computing on their arguments
+_REQUEST_OPERATIONS = {"var": _compile_var, "flag": _compile_flag}
+
+
+def _has_operations(values) -> bool:
+    return any(type(value) == dict for value in values)
+
+
+def _compile(tests, compile_value: Optional[Callable] = None) -> Callable[[dict], Any]:
+    if tests is None or type(tests) != dict:
+        return lambda data: tests
+
+    op = next(iter(tests))
+    values = tests[op]
+
+    if op not in _REQUEST_OPERATIONS and op not in OPERATIONS:
+
+        def _unrecognized(data):
+            raise RuntimeError("Unrecognized operation %s" % op)
+
+        return _unrecognized
+
+    if type(values) not in [list, tuple]:
+        values = [values]
+
+    args = tuple((compile_value or _compile)(val) for val in values)
+
+    if op in _REQUEST_OPERATIONS:
+        return _REQUEST_OPERATIONS[op](values, args)
+
+    if op in PATTERN_OPERATIONS and len(values) > 1 and not _has_operations(values[1:]):
+        match = PATTERN_OPERATIONS[op][1]
+        a, patterns = args[0], prepare_patterns(op, list(values[1:]))
+        return lambda data: match(a(data), patterns)
+
+    operation = OPERATIONS[op]
+    # the most of operations are unary or binary, calling them directly saves
+    # building the list of arguments on every evaluation
+    if len(args) == 1:
+        (a,) = args
+        return lambda data: operation(a(data))
+    if len(args) == 2:
+        a, b = args
+        return lambda data: operation(a(data), b(data))
+    return lambda data: operation(*[arg(data) for arg in args])
+
+
+def compile_rule(tests) -> Callable[[Optional[dict]], Any]:
+    """Build evaluator of the rule once, to not walk the rule's tree on every evaluation.
+
+    The evaluator takes the context or its ContextIndex, shared by the rules of a request.
+    """
+    evaluator = _compile(tests)
+    return lambda data: evaluator(data if type(data) == ContextIndex else ContextIndex(data))
+
+
+def _memoized(evaluator: Callable[[ContextIndex], Any]) -> Callable[[ContextIndex], Any]:
+    def _evaluator(index: ContextIndex):
+        resolved = index._shared.get(_evaluator)
+        if resolved is None:
+            try:
+                resolved = (True, evaluator(index))
+            except Exception as e:
+                resolved = (False, e)
+            index._shared[_evaluator] = resolved
+
+        found, value = resolved
+        if not found:
+            raise value.with_traceback(None)
+        return value
+
+    return _evaluator
+
+
+class SharedSubexpressions:
+    """Rules compiled into one DAG, where identical subtrees of all the rules are one node.
+
+    Subtrees are hash-consed by their operation and the ids of their arguments, so
+    ``{"var": "a"}`` and ``{"var": ["a"]}`` are the same node. An operation found more than
+    once across the rules is evaluated once per request, its value, or its error, is kept in
+    the ContextIndex shared by the rules. Operations run all their arguments, there is no
+    short-circuit, so a kept value is what a repeated evaluation would give.
+    """
+
+    def __init__(self, rules: Mapping[str, Any]):
+        # the rules are kept, as their nodes are known by id() until they are compiled
+        self._rules = rules
+        self._ids: Dict[Tuple, int] = {}
+        self._node_ids: Dict[int, int] = {}
+        self._rule_nodes: Dict[str, Set[int]] = {}
+        occurrences = Counter()
+        for name, tests in rules.items():
+            nodes = self._rule_nodes[name] = set()
+            self._collect(tests, nodes, occurrences)
+        self.nodes = sum(occurrences.values())
+        self.distinct_nodes = len(occurrences)
+        # values of the paths and of the flags are already kept for the request
+        request_nodes = {
+            node_id for key, node_id in self._ids.items() if key[0] in _REQUEST_OPERATIONS
+        }
+        self._shared = {
+            node_id
+            for node_id, count in occurrences.items()
+            if count > 1 and node_id not in request_nodes
+        }
+        self._compiled: Dict[int, Callable[[ContextIndex], Any]] = {}
+
+    def _collect(self, tests, nodes: Set[int], occurrences: Counter) -> int:
+        if type(tests) != dict or not tests:
+            return self._ids.setdefault(("", json.dumps(tests, sort_keys=True)), len(self._ids))
+
+        op = next(iter(tests))
+        values = tests[op]
+        if type(values) not in [list, tuple]:
+            values = [values]
+        key = (op, tuple(self._collect(val, nodes, occurrences) for val in values))
+        node_id = self._ids.setdefault(key, len(self._ids))
+        self._node_ids[id(tests)] = node_id
+        nodes.add(node_id)
+        occurrences[node_id] += 1
+        return node_id
+
+    def dedup_ratio(self) -> float:
+        """Operations in the rules per distinct one, 1.0 when no subtree is repeated"""
+        return self.nodes / self.distinct_nodes if self.distinct_nodes else 1.0
+
+    def sharing_rules(self) -> Set[str]:
+        return {name for name, nodes in self._rule_nodes.items() if nodes & self._shared}
+
+    def _compile_node(self, tests) -> Callable[[ContextIndex], Any]:
+        if type(tests) != dict or not tests:
+            return _compile(tests)
+        node_id = self._node_ids[id(tests)]
+        compiled = self._compiled.get(node_id)
+        if compiled is None:
+            compiled = _compile(tests, self._compile_node)
+            if node_id in self._shared:
+                compiled = _memoized(compiled)
+            self._compiled[node_id] = compiled
+        return compiled
+
+    def compile(self, name: str) -> Callable[[Optional[dict]], Any]:
+        """Evaluator of the rule, like compile_rule()"""
+        evaluator = self._compile_node(self._rules[name])
+        return lambda data: evaluator(data if type(data) == ContextIndex else ContextIndex(data))
+
+
+def check_patterns(tests) -> None:
+    """Raise ValueError if a literal pattern of the rule is invalid, e.g. a malformed regex"""
+    if type(tests) != dict or not tests:
+        return
+    op = next(iter(tests))
+    values = tests[op]
+    if type(values) not in [list, tuple]:
+        values = [values]
+    if op in PATTERN_OPERATIONS and len(values) > 1 and not _has_operations(values[1:]):
+        try:
+            prepare_patterns(op, list(values[1:]))
+        except TypeError as e:
+            raise ValueError(f"Invalid arguments of {op}: {e}")
+    for value in values:
+        check_patterns(value)
+
+
+def count_nodes(value) -> int:
+    """Size of the rule or of the context, used to estimate the cost of an evaluation"""
+    if isinstance(value, dict):
+        return 1 + sum(count_nodes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return 1 + sum(count_nodes(v) for v in value)
+    return 1
+
+
+def get_var_paths(tests) -> Optional[Set[str]]:
+    """Paths of the data read by the rule, None when some path is computed during evaluation"""
+    paths = set()
+
+    def _collect(_tests) -> bool:
+        if type(_tests) != dict or not _tests:
+            return True
+
+        op = next(iter(_tests))
+        values = _tests[op]
+        if type(values) not in [list, tuple]:
+            values = [values]
+
+        if op == "var" and values:
+            if type(values[0]) == dict:
+                return False
+            paths.add(str(values[0]))
+        return all(_collect(val) for val in values)
+
+    return paths if _collect(tests) else None
+
+
+def get_flag_names(tests) -> Optional[Set[str]]:
+    """Names of the flags read by the rule, None when some name is computed during evaluation"""
+    names = set()
+
+    def _collect(_tests) -> bool:
+        if type(_tests) != dict or not _tests:
+            return True
+
+        op = next(iter(_tests))
+        values = _tests[op]
+        if type(values) not in [list, tuple]:
+            values = [values]
+
+        if op == "flag" and values:
+            if type(values[0]) == dict:
+                return False
+            names.add(str(values[0]))
+        return all(_collect(val) for val in values)
+
+    return names if _collect(tests) else None
+
+
+def project_data(data: Optional[dict], paths: Set[str]) -> list:
+    """Values of the data by the paths, the same projection means the same evaluation result"""
+    index = ContextIndex(data)
+    projection = []
+    for path in sorted(paths):
+        try:
+            projection.append([path, True, index.get(path)])
+        except (ValueError, TypeError):
+            projection.append([path, False, None])
+    return projection
+
+
+def prune_data(data: Optional[dict], paths: Set[str]) -> dict:
+    """Data with only the values of the paths, which evaluates the same as the whole data"""
+    index = ContextIndex(data)
+    pruned = {}
+    kept = set()
+    for path in sorted(paths):
+        *parents, key = path.split(".")
+        # the whole value of a parent is already kept
+        if any(".".join(parents[: i + 1]) in kept for i in range(len(parents))):
+            continue
+        try:
+            value = index.get(path)
+        except (ValueError, TypeError):
+            continue
+        node = pruned
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[key] = value
+        kept.add(path)
+    return pruned
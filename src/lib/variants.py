@@ -0,0 +1,99 @@
+import bisect
+import hashlib
+from typing import Callable, List, Optional, Sequence, Tuple
+
+# contexts are hashed into this many buckets, so weights are precise to 0.01%
+TOTAL_BUCKETS = 10000
+
+# ranges of buckets of the variants: (end of the range, exclusive, index of the variant)
+Allocation = List[Tuple[int, int]]
+
+
+def target_counts(weights: Sequence[int]) -> List[int]:
+    """Number of buckets of every variant, proportional to its weight"""
+    total = sum(weights)
+    exact = [w * TOTAL_BUCKETS / total for w in weights]
+    counts = [int(e) for e in exact]
+    # largest remainders get the buckets left after rounding down
+    by_remainder = sorted(range(len(weights)), key=lambda i: counts[i] - exact[i])
+    for i in by_remainder[: TOTAL_BUCKETS - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+
+def expand(allocation: Allocation) -> List[int]:
+    owners = []
+    for end, variant in allocation:
+        owners.extend([variant] * (end - len(owners)))
+    return owners
+
+
+def compress(owners: Sequence[int]) -> Allocation:
+    allocation = []
+    for bucket, variant in enumerate(owners):
+        if allocation and allocation[-1][1] == variant:
+            allocation[-1] = (bucket + 1, variant)
+        else:
+            allocation.append((bucket + 1, variant))
+    return allocation
+
+
+def allocate(weights: Sequence[int], previous: Optional[Sequence[int]] = None) -> Allocation:
+    """Buckets of the variants, moving as few buckets of the previous allocation as possible.
+
+    ``previous`` is the owner of every bucket by the new indexes of the variants, -1 for the
+    buckets of the removed ones. Only the variants which have more buckets than their new
+    weight gives them release buckets, so when a weight is increased no context moves
+    between the other variants. Without the previous allocation the variants get
+    consecutive ranges in their order, i.e. the ranges of their cumulative weights.
+    """
+    targets = target_counts(weights)
+    owners = list(previous) if previous is not None else [-1] * TOTAL_BUCKETS
+    counts = [0] * len(weights)
+    for variant in owners:
+        if 0 <= variant < len(weights):
+            counts[variant] += 1
+
+    for bucket in reversed(range(TOTAL_BUCKETS)):
+        variant = owners[bucket]
+        if not 0 <= variant < len(weights):
+            owners[bucket] = -1
+        elif counts[variant] > targets[variant]:
+            owners[bucket] = -1
+            counts[variant] -= 1
+
+    variant = 0
+    for bucket in range(TOTAL_BUCKETS):
+        if owners[bucket] != -1:
+            continue
+        while counts[variant] >= targets[variant]:
+            variant += 1
+        owners[bucket] = variant
+        counts[variant] += 1
+    return compress(owners)
+
+
+def is_valid(allocation: Allocation, weights: Sequence[int]) -> bool:
+    ends = [end for end, _ in allocation]
+    if not allocation or ends != sorted(ends) or ends[-1] != TOTAL_BUCKETS:
+        return False
+    counts = [0] * len(weights)
+    start = 0
+    for end, variant in allocation:
+        if not 0 <= variant < len(weights):
+            return False
+        counts[variant] += end - start
+        start = end
+    return counts == target_counts(weights)
+
+
+def bucket_of(salt: str, value) -> int:
+    digest = hashlib.blake2b(f"{salt}:{value}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % TOTAL_BUCKETS
+
+
+def compile_allocation(allocation: Allocation) -> Callable[[int], int]:
+    """Index of the variant of a bucket, by binary search over the ends of the ranges"""
+    ends = [end for end, _ in allocation]
+    variants = [variant for _, variant in allocation]
+    return lambda bucket: variants[bisect.bisect_right(ends, bucket)]
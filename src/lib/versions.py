@@ -0,0 +1,162 @@
+import operator
+import re
+from functools import lru_cache
+from typing import Callable, FrozenSet, List, Optional, Tuple
+
+# major, minor, patch and the prerelease, ordered by the precedence of semantic versioning
+VersionKey = Tuple[int, int, int, tuple]
+# releases follow all their prereleases, and the lowest prerelease is "-0"
+_RELEASE = (1,)
+_MIN_PRERELEASE = (0,)
+
+_VERSION = re.compile(r"v?(\d+)\.(\d+)\.(\d+)(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?")
+_PARTIAL_VERSION = re.compile(
+    r"v?(\d+|[xX*])(?:\.(\d+|[xX*]))?(?:\.(\d+|[xX*]))?"
+    r"(?:-([0-9A-Za-z.-]+))?(?:\+[0-9A-Za-z.-]+)?"
+)
+_COMPARATOR = re.compile(r"(<=|>=|<|>|=|\^|~)?\s*([^\s<>=^~]+)")
+_HYPHEN = re.compile(r"\s*(\S+)\s+-\s+(\S+)\s*")
+
+COMPARISONS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+Comparator = Tuple[Callable[[VersionKey, VersionKey], bool], VersionKey]
+# comparators of an alternative of a range and the versions whose prereleases it admits
+Alternative = Tuple[List[Comparator], FrozenSet[Tuple[int, int, int]]]
+
+
+def _prerelease_key(prerelease: Optional[str]) -> tuple:
+    if prerelease is None:
+        return _RELEASE
+    # numeric identifiers are lower than alphanumeric ones and compared as numbers
+    return (0, *((0, int(i)) if i.isdigit() else (1, i) for i in prerelease.split(".")))
+
+
+@lru_cache(maxsize=4096)
+def parse_version(version: str) -> VersionKey:
+    """Key of a full version, e.g. 1.2.3-beta.1, cached as clients send few distinct versions"""
+    match = _VERSION.fullmatch(version.strip()) if isinstance(version, str) else None
+    if match is None:
+        raise ValueError(f"Invalid version: {version!r}")
+    major, minor, patch, prerelease = match.groups()
+    return int(major), int(minor), int(patch), _prerelease_key(prerelease)
+
+
+def _parse_partial(version: str) -> Tuple[List[Optional[int]], Optional[str]]:
+    match = _PARTIAL_VERSION.fullmatch(version)
+    if match is None:
+        raise ValueError(f"Invalid version in range: {version!r}")
+    *parts, prerelease = match.groups()
+    numbers = []
+    for part in parts:
+        # components after a wildcard are wildcards as well
+        if part is None or not part.isdigit() or (numbers and numbers[-1] is None):
+            numbers.append(None)
+        else:
+            numbers.append(int(part))
+    return numbers, prerelease
+
+
+def _next_key(numbers: List[Optional[int]]) -> VersionKey:
+    """Lowest version above all the versions matching the partial version"""
+    major, minor, _ = numbers
+    if minor is None:
+        return major + 1, 0, 0, _MIN_PRERELEASE
+    return major, minor + 1, 0, _MIN_PRERELEASE
+
+
+def _comparators(op: str, version: str) -> Tuple[List[Comparator], Optional[Tuple[int, int, int]]]:
+    """Comparators of the version, and the version of its prerelease if it has one.
+
+    Bounds like ``<2.0.0-0`` are prereleases as well, but only prereleases written in
+    the range make the prereleases of their version match.
+    """
+    numbers, prerelease = _parse_partial(version)
+    major, minor, patch = numbers
+    if major is None:
+        # "*" matches any version, "<*" and ">*" none
+        if op in ("", "=", ">=", "<=", "^", "~"):
+            return [], None
+        return [(operator.lt, (0, 0, 0, ()))], None
+
+    if patch is None:
+        lower = (major, minor or 0, 0, _RELEASE)
+        upper = _next_key(numbers)
+        if op == "^" and major:
+            upper = (major + 1, 0, 0, _MIN_PRERELEASE)
+        comparators = {
+            ">=": [(operator.ge, lower)],
+            ">": [(operator.ge, upper)],
+            "<": [(operator.lt, lower[:3] + (_MIN_PRERELEASE,))],
+            "<=": [(operator.lt, upper)],
+        }.get(op, [(operator.ge, lower), (operator.lt, upper)])
+        return comparators, None
+
+    key = (major, minor, patch, _prerelease_key(prerelease))
+    explicit = (major, minor, patch) if prerelease is not None else None
+    if op == "^":
+        if major:
+            upper = (major + 1, 0, 0, _MIN_PRERELEASE)
+        elif minor:
+            upper = (0, minor + 1, 0, _MIN_PRERELEASE)
+        else:
+            upper = (0, 0, patch + 1, _MIN_PRERELEASE)
+        return [(operator.ge, key), (operator.lt, upper)], explicit
+    if op == "~":
+        return [(operator.ge, key), (operator.lt, (major, minor + 1, 0, _MIN_PRERELEASE))], explicit
+    if op in ("", "="):
+        return [(operator.eq, key)], explicit
+    return [(COMPARISONS[op], key)], explicit
+
+
+def _alternative(spec: str) -> Alternative:
+    hyphen = _HYPHEN.fullmatch(spec)
+    if hyphen:
+        lower, upper = hyphen.groups()
+        parsed = [_comparators(">=", lower), _comparators("<=", upper)]
+    else:
+        parsed = []
+        position = 0
+        spec = spec.strip()
+        while position < len(spec):
+            match = _COMPARATOR.match(spec, position)
+            if match is None:
+                raise ValueError(f"Invalid version range: {spec!r}")
+            parsed.append(_comparators(match.group(1) or "", match.group(2)))
+            position = match.end()
+            while position < len(spec) and spec[position].isspace():
+                position += 1
+    comparators = [comparator for part, _ in parsed for comparator in part]
+    prereleases = frozenset(explicit for _, explicit in parsed if explicit is not None)
+    return comparators, prereleases
+
+
+def parse_range(spec: str) -> List[Alternative]:
+    """Range of versions like the ranges of npm, e.g. ">=1.2.0 <2.0.0 || ^3.1".
+
+    Alternatives are separated by ``||``, and consist of comparators, caret and tilde
+    ranges, wildcards like ``1.2.x`` and hyphen ranges like ``1.2 - 1.4``. As in npm,
+    a prerelease matches only an alternative with a prerelease of the same version.
+    """
+    if not isinstance(spec, str):
+        raise ValueError(f"Invalid version range: {spec!r}")
+    return [_alternative(alternative) for alternative in spec.split("||")]
+
+
+def satisfies(version, alternatives: List[Alternative]) -> bool:
+    try:
+        key = parse_version(version)
+    except ValueError:
+        return False
+    for comparators, prereleases in alternatives:
+        if (key[3] == _RELEASE or key[:3] in prereleases) and all(
+            compare(key, bound) for compare, bound in comparators
+        ):
+            return True
+    return False
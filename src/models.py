@@ -1,27 +1,195 @@
+import hashlib
+import json
 from datetime import datetime
 from enum import Enum
-from typing import List, Optional, Dict, Union
+from graphlib import CycleError, TopologicalSorter
+from typing import (
+    AbstractSet,
+    Any,
+    Callable,
+    List,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Dict,
+    Tuple,
+    Union,
+)
+from uuid import uuid4
 
 from beanie import Indexed
 from beanie.odm.operators.update.general import Set, Unset
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from pydantic import constr, validator, BaseModel, Field
+from pydantic import (
+    confloat,
+    conint,
+    conlist,
+    constr,
+    root_validator,
+    validator,
+    BaseModel,
+    Field,
+    PrivateAttr,
+)
 
 from src.common.base_model import BaseDocument, Push, BaseNestedDocument
 from src.keys_utils import generate_new_key
-from src.lib.json_logic import evaluate
+from src.lib import variants as variants_lib
+from src.lib.json_logic import (
+    ContextIndex,
+    check_patterns,
+    compile_rule,
+    count_nodes,
+    get_flag_names,
+    get_var_paths,
+)
 
 
 ALLOWED_TYPES = Union[str, int, float, bool]
 
 
+def _raise_on_evaluation(error: Exception):
+    def _evaluator(context):
+        raise error
+
+    return _evaluator
+
+
+class Variant(BaseModel):
+    value: ALLOWED_TYPES
+    weight: conint(ge=0)
+
+
+# fields of the flags with variants, the other flags are stored and served without them
+_VARIANT_FIELDS = ("variants", "bucket_by", "salt", "allocation")
+
+
 class FlagRule(BaseNestedDocument):
     rules: Optional[Union[dict, ALLOWED_TYPES]] = None
     default: Optional[ALLOWED_TYPES] = None
+    # contexts for which the rules are truthy, all if there are no rules, get one of the
+    # variants by the hash of the ``bucket_by`` path of the context
+    variants: Optional[conlist(Variant, min_items=1, max_items=100)] = None
+    bucket_by: Optional[str] = None
+    salt: Optional[str] = None
+    # buckets of the variants as [end of the range, index of the variant], kept on updates
+    allocation: Optional[List[Tuple[int, int]]] = None
+
+    _evaluator: Optional[Callable[[Optional[dict]], Any]] = PrivateAttr(default=None)
+    _complexity: Optional[int] = PrivateAttr(default=None)
+    _var_paths: Optional[AbstractSet[str]] = PrivateAttr(default=None)
+    _var_paths_collected: bool = PrivateAttr(default=False)
+    _prerequisites: Optional[AbstractSet[str]] = PrivateAttr(default=None)
+    _prerequisites_collected: bool = PrivateAttr(default=False)
+
+    @validator("rules")
+    def rules_validator(cls, v):
+        # patterns are prepared on compilation, invalid ones are rejected when saved
+        check_patterns(v)
+        return v
+
+    @validator("variants")
+    def variants_validator(cls, v):
+        if v is None:
+            return v
+        if not sum(variant.weight for variant in v):
+            raise ValueError("at least one of the variants must have a positive weight")
+        if len({json.dumps(variant.value) for variant in v}) != len(v):
+            raise ValueError("values of the variants must be unique")
+        return v
+
+    @root_validator(skip_on_failure=True)
+    def allocation_validator(cls, values):
+        variants = values.get("variants")
+        if variants is None:
+            return values
+        values["bucket_by"] = values.get("bucket_by") or "key"
+        values["salt"] = values.get("salt") or uuid4().hex[:8]
+        weights = [variant.weight for variant in variants]
+        allocation = values.get("allocation")
+        if allocation is None or not variants_lib.is_valid(allocation, weights):
+            values["allocation"] = variants_lib.allocate(weights)
+        return values
+
+    def reallocate(self, previous: Optional["FlagRule"]) -> None:
+        """Keep the buckets of the variants of the previous version of the flag.
+
+        Contexts stay in their variants when the weights are changed, only the contexts
+        of the variants which lost buckets are moved.
+        """
+        if not self.variants or not previous or not previous.variants:
+            return
+        indexes = {json.dumps(variant.value): i for i, variant in enumerate(self.variants)}
+        previous_indexes = [
+            indexes.get(json.dumps(variant.value), -1) for variant in previous.variants
+        ]
+        owners = [previous_indexes[i] for i in variants_lib.expand(previous.allocation)]
+        self.salt = previous.salt
+        self.allocation = variants_lib.allocate(
+            [variant.weight for variant in self.variants], owners
+        )
+        self._evaluator = None
+
+    def _compile_variants(self, targeting: Callable[[Any], Any]) -> Callable[[Any], Any]:
+        values = [variant.value for variant in self.variants]
+        variant_of = variants_lib.compile_allocation(self.allocation)
+        default, path, salt = self.default, self.bucket_by, self.salt
+        targeted = self.rules is not None
+        bucket_by = compile_rule({"var": path})
+
+        def _evaluator(data):
+            index = data if type(data) == ContextIndex else ContextIndex(data)
+            if targeted and not targeting(index):
+                return default
+            value = bucket_by(index)
+            if value is None:
+                raise ValueError(f"The context has no {path} to assign a variant")
+            return values[variant_of(variants_lib.bucket_of(salt, value))]
+
+        return _evaluator
+
+    def build_evaluator(self, rules: Callable[[Any], Any]) -> Callable[[Optional[dict]], Any]:
+        """Evaluator of the flag given the evaluator of its rules"""
+        return self._compile_variants(rules) if self.variants else rules
+
+    def compile(self) -> Callable[[Optional[dict]], Any]:
+        if self._evaluator is None:
+            try:
+                self._evaluator = self.build_evaluator(compile_rule(self.rules))
+            except Exception as e:
+                self._evaluator = _raise_on_evaluation(e)
+        return self._evaluator
+
+    def complexity(self) -> int:
+        if self._complexity is None:
+            self._complexity = count_nodes(self.rules) + len(self.variants or ())
+        return self._complexity
+
+    def var_paths(self) -> Optional[AbstractSet[str]]:
+        if not self._var_paths_collected:
+            self._var_paths = get_var_paths(self.rules)
+            if self.variants and self._var_paths is not None:
+                self._var_paths = {*self._var_paths, self.bucket_by}
+            self._var_paths_collected = True
+        return self._var_paths
+
+    def prerequisites(self) -> Optional[AbstractSet[str]]:
+        """Names of the flags read by the rules, None if they are computed during evaluation"""
+        if not self._prerequisites_collected:
+            self._prerequisites = get_flag_names(self.rules)
+            self._prerequisites_collected = True
+        return self._prerequisites
+
+    def dict(self, **kwargs) -> dict:
+        data = super().dict(**kwargs)
+        if self.variants is None:
+            for f in _VARIANT_FIELDS:
+                data.pop(f, None)
+        return data
 
     def db_representation(self, exclude_none=False) -> dict:
         _fields = self.dict(exclude_none=exclude_none)
-        return {f: _fields[f] for f in FlagRule.__fields__}
+        return {f: _fields[f] for f in FlagRule.__fields__ if f in _fields}
 
 
 class Flag(FlagRule):
@@ -32,6 +200,65 @@ class Flag(FlagRule):
 Flag.init_fields()
 
 
+def order_flags(flags: Mapping[str, FlagRule]) -> List[str]:
+    """Names of the flags, every flag after its prerequisites.
+
+    Raises ValueError if the prerequisites are computed, unknown or form a cycle.
+    """
+    graph = {}
+    for name, flag_rule in flags.items():
+        prerequisites = flag_rule.prerequisites()
+        if prerequisites is None:
+            raise ValueError(f"Prerequisites of flag '{name}' must be names of flags")
+        unknown = prerequisites - flags.keys()
+        if unknown:
+            raise ValueError(f"Flag '{name}' requires unknown flags: {', '.join(sorted(unknown))}")
+        graph[name] = prerequisites
+    try:
+        return list(TopologicalSorter(graph).static_order())
+    except CycleError as e:
+        raise ValueError(f"Prerequisites of flags form a cycle: {' -> '.join(e.args[1])}")
+
+
+def flags_context_paths(
+    flags: Mapping[str, FlagRule], order: Optional[List[str]]
+) -> Dict[str, Optional[AbstractSet[str]]]:
+    """Paths of the context read by every flag along with its prerequisites.
+
+    ``order`` is the one of order_flags, None if the prerequisites can't be ordered,
+    then the paths of the flags with prerequisites can't be known.
+    """
+    flags_paths = {}
+    for name in order or flags:
+        paths = flags[name].var_paths()
+        prerequisites = flags[name].prerequisites()
+        if prerequisites and order is None:
+            paths = None
+        for prerequisite in prerequisites or ():
+            if paths is None or flags_paths[prerequisite] is None:
+                paths = None
+                break
+            paths = paths | flags_paths[prerequisite]
+        flags_paths[name] = paths
+    return flags_paths
+
+
+def _update_flag_operators(
+    flags_field, flag_name: str, expr: dict, previous: Optional[FlagRule]
+) -> list:
+    operators = [Set(expr)]
+    if previous is not None and previous.variants:
+        # the flag may have lost its variants
+        removed = {
+            f"{flags_field}.{flag_name}.{f}": ""
+            for f in _VARIANT_FIELDS
+            if f"{flags_field}.{flag_name}.{f}" not in expr
+        }
+        if removed:
+            operators.append(Unset(removed))
+    return operators
+
+
 class FlagEvaluationStatus(Enum):
     OK = "ok"
     ERROR = "error"
@@ -43,12 +270,27 @@ class FlagEvaluationResult(BaseModel):
     reason: str
 
 
+def results_data(results: Mapping[str, FlagEvaluationResult]) -> Dict[str, dict]:
+    """Results as they are sent, without going through the pydantic encoding"""
+    return {
+        f_name: {"value": res.value, "status": res.status.value, "reason": res.reason}
+        for f_name, res in results.items()
+    }
+
+
+# value of a flag as computed by its rules, with the status and the reason of the evaluation
+FlagEvaluation = Tuple[Any, FlagEvaluationStatus, str]
+
+
 ApiKeyValue = str
 
 
 class ApiKeyDescription(BaseModel):
     name: constr(min_length=4, max_length=20)
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    # requests per second allowed for the key and the burst over it, settings' defaults if None
+    rate_limit: Optional[confloat(gt=0)] = None
+    rate_limit_burst: Optional[conint(ge=1)] = None
 
 
 class ApiKey(ApiKeyDescription):
@@ -61,6 +303,10 @@ class Environment(BaseDocument):
     server_side_keys: Dict[ApiKeyValue, ApiKeyDescription] = Field(default_factory=dict)
     client_side_keys: Dict[ApiKeyValue, ApiKeyDescription] = Field(default_factory=dict)
 
+    _rules_version: Optional[str] = PrivateAttr(default=None)
+    _context_paths: Optional[AbstractSet[str]] = PrivateAttr(default=None)
+    _context_paths_collected: bool = PrivateAttr(default=False)
+
     @classmethod
     async def init_model(cls, database: AsyncIOMotorDatabase, allow_index_dropping: bool) -> None:
         await super().init_model(database, allow_index_dropping)
@@ -93,6 +339,9 @@ class Environment(BaseDocument):
         raise ValueError("the name must be from 3 to 20 characters long")
 
     async def update_flag(self, flag_name: str, flag_updatable: FlagRule):
+        previous = (self.flags or {}).get(flag_name)
+        order_flags({**(self.flags or {}), flag_name: flag_updatable})
+        flag_updatable.reallocate(previous)
         expr = {
             f"{Environment.flags}.{flag_name}.{f}": v
             for f, v in flag_updatable.db_representation().items()
@@ -101,7 +350,37 @@ class Environment(BaseDocument):
         if not expr:
             return
 
-        await self.update(Set(expr))
+        await self.update(*_update_flag_operators(Environment.flags, flag_name, expr, previous))
+
+    def compile(self) -> None:
+        for flag_rule in (self.flags or {}).values():
+            flag_rule.compile()
+
+    def rules_complexity(self) -> int:
+        return sum(flag_rule.complexity() for flag_rule in (self.flags or {}).values())
+
+    def context_paths(self) -> Optional[AbstractSet[str]]:
+        """Paths of the context read by the rules, None if they can't be known before evaluation"""
+        if not self._context_paths_collected:
+            flags_paths = [flag_rule.var_paths() for flag_rule in (self.flags or {}).values()]
+            if any(paths is None for paths in flags_paths):
+                self._context_paths = None
+            else:
+                self._context_paths = set().union(*flags_paths)
+            self._context_paths_collected = True
+        return self._context_paths
+
+    def rules_version(self) -> str:
+        if self._rules_version is None:
+            data = json.dumps(
+                {
+                    f_name: f_rule.db_representation()
+                    for f_name, f_rule in (self.flags or {}).items()
+                },
+                sort_keys=True,
+            )
+            self._rules_version = hashlib.blake2b(data.encode(), digest_size=8).hexdigest()
+        return self._rules_version
 
     async def get_all_rules(self) -> Optional[Dict[str, FlagRule]]:
         return self.flags
@@ -114,30 +393,63 @@ class Environment(BaseDocument):
         if not flag_rule:
             return
 
-        return self._evaluate_flag(flag_rule, context)
+        return self.evaluate_rules({flag_name: flag_rule}, context, self.flags)[flag_name]
 
     async def evaluate_flags(self, context: dict) -> Optional[Dict[str, FlagEvaluationResult]]:
         rules = await self.get_all_rules()
         if not rules:
             return
-        return {f_name: self._evaluate_flag(f_rule, context) for f_name, f_rule in rules.items()}
+        return self.evaluate_rules(rules, context)
+
+    @classmethod
+    def evaluate_rules(
+        cls,
+        rules: Mapping[str, FlagRule],
+        context: dict,
+        flags: Optional[Mapping[str, FlagRule]] = None,
+        evaluated: Optional[MutableMapping[str, FlagEvaluation]] = None,
+    ) -> Dict[str, FlagEvaluationResult]:
+        """Results of the flags of ``rules``.
+
+        Prerequisites are looked up in ``flags``, all the flags of the environment, and every
+        flag is evaluated at most once per request, ``evaluated`` holds the known evaluations.
+        """
+        flags = rules if flags is None else flags
+        evaluated = {} if evaluated is None else evaluated
+        resolving = set()
+
+        def _flag_value(name: str) -> Any:
+            evaluation = evaluated.get(name)
+            if evaluation is None:
+                flag_rule = flags.get(name)
+                if flag_rule is None:
+                    raise ValueError(f"Unknown prerequisite flag '{name}'")
+                if name in resolving:
+                    raise ValueError(f"Prerequisites of flag '{name}' form a cycle")
+                resolving.add(name)
+                try:
+                    evaluation = evaluated[name] = cls._evaluate(flag_rule, index)
+                finally:
+                    resolving.discard(name)
+            return evaluation[0]
+
+        # the context is walked once for all the flags
+        index = ContextIndex(context, _flag_value)
+        results = {}
+        for f_name, f_rule in rules.items():
+            evaluation = evaluated.get(f_name)
+            if evaluation is None:
+                evaluation = evaluated[f_name] = cls._evaluate(f_rule, index)
+            value, status, reason = evaluation
+            results[f_name] = FlagEvaluationResult(value=value, status=status, reason=reason)
+        return results
 
     @staticmethod
-    def _evaluate_flag(flag_rule: FlagRule, context: dict) -> FlagEvaluationResult:
-        status = FlagEvaluationStatus.OK
-        reason = ""
+    def _evaluate(flag_rule: FlagRule, context: Union[dict, ContextIndex]) -> FlagEvaluation:
         try:
-            res = evaluate(flag_rule.rules, context)
+            return flag_rule.compile()(context), FlagEvaluationStatus.OK, ""
         except Exception as e:
-            res = flag_rule.default
-            status = FlagEvaluationStatus.ERROR
-            reason = str(e)
-
-        return FlagEvaluationResult(
-            value=res,
-            status=status,
-            reason=reason,
-        )
+            return flag_rule.default, FlagEvaluationStatus.ERROR, str(e)
 
     async def create_api_key(self, api_key: ApiKey, server_side=False) -> ApiKey:
         _key_type_field = (
@@ -217,6 +529,7 @@ class Project(BaseDocument):
         await self.update(Push({"environment_ids": environment.id}))
 
     async def add_flag(self, flag: Flag) -> Flag:
+        order_flags({**(self.flags or {}), flag.name: flag})
         db_representation = flag.db_representation()
 
         await self.update(Set({f"{Project.flags}.{flag.name}": db_representation}))
@@ -232,6 +545,9 @@ class Project(BaseDocument):
     async def update_flag(self, flag_name: str, flag_updatable: FlagRule):
         # db.Project.updateOne({name:"name"}, {$set:{"flags.flag1.default": true}})
 
+        previous = (self.flags or {}).get(flag_name)
+        order_flags({**(self.flags or {}), flag_name: flag_updatable})
+        flag_updatable.reallocate(previous)
         expr = {
             f"{Project.flags}.{flag_name}.{f}": v
             for f, v in flag_updatable.db_representation().items()
@@ -240,9 +556,11 @@ class Project(BaseDocument):
         if not expr:
             return
 
-        await self.update(Set(expr))
+        await self.update(*_update_flag_operators(Project.flags, flag_name, expr, previous))
 
     async def remove_flag(self, flag_name: str) -> None:
+        # the flag can't be removed while other flags require it
+        order_flags({f: r for f, r in (self.flags or {}).items() if f != flag_name})
         await self.update(Unset({f"{Project.flags}.{flag_name}": ""}))
 
         if self.environment_ids:
@@ -1,11 +1,18 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 
-from src.routes import health
-from src.routes.admin import admin_router
+from src.routes import health, metrics
+from src.routes.admission import RouteClass, admission
 from src.routes.evaluation import router as evaluation_router
 
 
-def init_routes(app: FastAPI):
+def init_routes(app: FastAPI, evaluation_only: bool = False):
     app.include_router(health.router, prefix="/health_check")
-    app.include_router(admin_router, prefix="/admin")
+    app.include_router(metrics.router, prefix="/metrics")
+    if not evaluation_only:
+        # admin routes and their dependencies aren't even imported on evaluation nodes
+        from src.routes.admin import admin_router
+
+        app.include_router(
+            admin_router, prefix="/admin", dependencies=[Depends(admission(RouteClass.ADMIN))]
+        )
     app.include_router(evaluation_router, prefix="")
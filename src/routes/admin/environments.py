@@ -6,6 +6,7 @@ from pymongo.errors import WriteError
 
 from src.common.logger import get_logger
 from src.models import Environment, FlagRule, Flag, ApiKey, ApiKeyValue
+from src.unique_contexts import count_unique_contexts
 
 router = APIRouter()
 logger = get_logger(__name__)
@@ -67,12 +68,20 @@ async def update_environment(
     raise HTTPException(status_code=400, detail="Name for update is missing")
 
 
+@router.get("/{environment_id}/unique_contexts")
+async def get_unique_contexts(environment: Environment = Depends(_get_environment)):
+    """Approximate number of distinct contexts every value of every flag was served to"""
+    return await count_unique_contexts(environment.id)
+
+
 @router.patch("/{environment_id}/flags/{flag_name}", response_model=Flag, status_code=201)
 async def patch_flag(
     flag_name: str, flag: FlagRule, environment: Environment = Depends(_get_environment)
 ):
     try:
         return await environment.update_flag(flag_name, flag)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except WriteError as e:
         logger.info(f"Fail to patch flag: {e}")
         raise HTTPException(status_code=400)
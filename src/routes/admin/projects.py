@@ -73,6 +73,8 @@ async def create_environment(environment: Environment, project: Project = Depend
 async def add_flag(flag: Flag, project: Project = Depends(_get_project)):
     try:
         return await project.add_flag(flag)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except WriteError as e:
         logger.info(f"Fail to add flag: {e}")
         raise HTTPException(status_code=400, detail="Flag name already exists")
@@ -84,6 +86,8 @@ async def patch_flag(
 ):
     try:
         return await project.update_flag(flag_name, flag_updatable)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except WriteError as e:
         logger.info(f"Fail to patch flag: {e}")
         raise HTTPException(status_code=400)
@@ -93,6 +97,8 @@ async def patch_flag(
 async def remove_flag(flag_name: str, project: Project = Depends(_get_project)):
     try:
         await project.remove_flag(flag_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except WriteError as e:
         logger.info(f"Fail to remove flag: {e}")
         raise HTTPException(status_code=400)
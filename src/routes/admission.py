@@ -0,0 +1,68 @@
+from enum import Enum
+from typing import Optional
+
+from fastapi import HTTPException
+
+from src.common.admission import AdmissionClass, AdmissionController, AdmissionRejected
+from src.settings import settings
+
+
+class RouteClass(Enum):
+    # in the order of priority
+    EVALUATION = "evaluation"
+    GET_RULES = "get_rules"
+    ADMIN = "admin"
+
+
+_admission_controller = None
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    global _admission_controller
+    if not settings.ADMISSION_ENABLED:
+        return None
+    if not _admission_controller:
+        _admission_controller = AdmissionController(
+            settings.ADMISSION_MAX_CONCURRENCY,
+            [
+                AdmissionClass(
+                    RouteClass.EVALUATION.value,
+                    settings.ADMISSION_EVALUATION_CONCURRENCY,
+                    settings.ADMISSION_EVALUATION_QUEUE_SIZE,
+                ),
+                AdmissionClass(
+                    RouteClass.GET_RULES.value,
+                    settings.ADMISSION_GET_RULES_CONCURRENCY,
+                    settings.ADMISSION_GET_RULES_QUEUE_SIZE,
+                ),
+                AdmissionClass(
+                    RouteClass.ADMIN.value,
+                    settings.ADMISSION_ADMIN_CONCURRENCY,
+                    settings.ADMISSION_ADMIN_QUEUE_SIZE,
+                ),
+            ],
+            settings.ADMISSION_QUEUE_TIMEOUT,
+        )
+
+    return _admission_controller
+
+
+def admission(route_class: RouteClass):
+    """Dependency holding a slot of the route class until the response is sent"""
+
+    async def _admission():
+        controller = get_admission_controller()
+        if not controller:
+            yield
+            return
+
+        try:
+            await controller.acquire(route_class.value)
+        except AdmissionRejected:
+            raise HTTPException(status_code=503, headers={"Retry-After": "1"})
+        try:
+            yield
+        finally:
+            controller.release(route_class.value)
+
+    return _admission
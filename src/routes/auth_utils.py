@@ -1,15 +1,66 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
 from enum import Enum
+from typing import Optional
 
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPAuthorizationCredentials
 from starlette.requests import Request
 
+from src.settings import settings
+
 
 class TokenTypes(Enum):
     BEARER = "bearer"
     BASIC = "basic"
 
 
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _token_signature(payload: bytes) -> bytes:
+    return hmac.new(settings.EVALUATION_TOKEN_SECRET.encode(), payload, hashlib.sha256).digest()
+
+
+def sign_evaluation_token(environment_id: str, api_key: str) -> str:
+    """Token carrying a client side key in URLs, valid only for the environment until it expires.
+
+    The key is checked against the environment on every request, so revoking it revokes
+    its tokens as well.
+    """
+    payload = {
+        "environment_id": environment_id,
+        "api_key": api_key,
+        "exp": int(time.time()) + settings.EVALUATION_TOKEN_TTL,
+    }
+    payload = json.dumps(payload, separators=(",", ":")).encode()
+    return f"{_b64encode(payload)}.{_b64encode(_token_signature(payload))}"
+
+
+def read_evaluation_token(token: str, environment_id: str) -> Optional[str]:
+    """API key of the token, None if it isn't signed for the environment or has expired"""
+    if not settings.EVALUATION_TOKEN_SECRET:
+        return None
+    try:
+        payload, signature = (_b64decode(part) for part in token.split("."))
+        if not hmac.compare_digest(signature, _token_signature(payload)):
+            return None
+        payload = json.loads(payload)
+        if payload["environment_id"] != environment_id or payload["exp"] <= time.time():
+            return None
+        return payload["api_key"]
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
 def get_auth_credentials(request: Request):
     auth_header = request.headers.get("Authorization")
     if not auth_header:
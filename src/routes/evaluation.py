@@ -1,16 +1,118 @@
+import base64
+import hashlib
+import json
+import math
 from enum import Enum
-from typing import Dict, Set
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlencode
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Body, Depends, HTTPException
+from fastapi.responses import JSONResponse, Response
+from starlette.requests import Request
+from starlette.websockets import WebSocket, WebSocketDisconnect
 
-from src.models import Environment, FlagEvaluationResult, FlagRule
-from src.routes.auth_utils import get_environment_api_key
+from src.client_bootstrap import ContentEncoding, choose_encoding, get_client_bootstrap_cache
+from src.common.admission import AdmissionRejected
+from src.common.batch_loader import BatchLoader
+from src.common.content_types import MsgPackResponse, accepts_msgpack, is_msgpack, msgpack
+from src.common.db import MongoClientRole
+from src.common.metrics import metrics
+from src.common.ndjson import LineTooLong, NDJSONStreamingResponse, iter_lines
+from src.common.rate_limit import RateLimiter
+from src.compact_environment import CompactEnvironment
+from src.evaluation_cache import get_evaluation_cache
+from src.evaluation_pool import get_evaluation_pool
+from src.evaluation_sessions import SessionsLimitReached, get_evaluation_sessions
+from src.exposures import is_tracking, track_results
+from src.lib.json_logic import prune_data
+from src.models import (
+    ALLOWED_TYPES,
+    ApiKeyDescription,
+    ApiKeyValue,
+    Environment,
+    FlagEvaluationResult,
+    FlagRule,
+    results_data,
+)
+from src.routes.admission import RouteClass, admission, get_admission_controller
+from src.routes.auth_utils import (
+    get_auth_credentials,
+    get_environment_api_key,
+    read_evaluation_token,
+    sign_evaluation_token,
+)
+from src.settings import settings
+from src.sharding import get_shard
 
 router = APIRouter()
 
 
-async def _get_environment(environment_id: str) -> Environment:
-    env = await Environment.find_one(Environment.id == environment_id)
+async def _load_environments(environment_ids: List[str]) -> Dict[str, Environment]:
+    environments = await Environment.find_many_for_role(
+        {"_id": {"$in": environment_ids}}, MongoClientRole.EVALUATION
+    )
+    return {env.id: env for env in environments}
+
+
+_environment_loader = BatchLoader(
+    "environment_loads",
+    _load_environments,
+    window=settings.ENVIRONMENT_LOADER_WINDOW,
+    max_batch_size=settings.ENVIRONMENT_LOADER_MAX_BATCH_SIZE,
+)
+
+
+_rate_limiter = RateLimiter(settings.RATE_LIMIT_MAX_BUCKETS)
+
+
+def _check_rate_limits(environment_id: str, api_key: ApiKeyValue, description: ApiKeyDescription):
+    """Take tokens of a key validated for the environment, so invalid keys cost nothing"""
+    # buckets don't keep the keys themselves
+    key_id = hashlib.blake2b(api_key.encode(), digest_size=16).hexdigest()
+    scope = "api_key"
+    retry_after = _rate_limiter.take(
+        f"api_key:{key_id}",
+        description.rate_limit or settings.RATE_LIMIT_KEY_RATE,
+        description.rate_limit_burst,
+    )
+    if not retry_after:
+        scope = "environment"
+        retry_after = _rate_limiter.take(
+            f"environment:{environment_id}",
+            settings.RATE_LIMIT_ENVIRONMENT_RATE,
+            settings.RATE_LIMIT_ENVIRONMENT_BURST,
+        )
+    if retry_after:
+        metrics.inc("rate_limited_requests_total", scope=scope)
+        raise HTTPException(status_code=429, headers={"Retry-After": str(math.ceil(retry_after))})
+
+
+def _check_owner(request: Request, environment_id: str):
+    """Redirect requests of the environments owned by other nodes to their owners"""
+    shard = get_shard()
+    if not shard or shard.owns(environment_id):
+        return
+
+    owner = shard.owner(environment_id)
+    location = f"{owner.rstrip('/')}{request.url.path}"
+    if request.url.query:
+        location = f"{location}?{request.url.query}"
+    metrics.inc("environment_redirects_total")
+    raise HTTPException(
+        status_code=307, headers={"Location": location, "X-Environment-Owner": owner}
+    )
+
+
+async def _find_environment(environment_id: str) -> Optional[Environment]:
+    cache = get_evaluation_cache()
+    env = cache.get(environment_id) if cache else None
+    if env is None:
+        env = await _environment_loader.load(environment_id)
+    return env
+
+
+async def _get_environment(environment_id: str, _owner=Depends(_check_owner)) -> Environment:
+    env = await _find_environment(environment_id)
     if env is None:
         raise HTTPException(status_code=404)
     return env
@@ -25,55 +127,490 @@ class _PermissionsValidator:
     def __init__(self, scopes: Set[Scopes]):
         self.scopes = scopes
 
+    def key_description(
+        self, environment: Environment, api_key: Optional[ApiKeyValue]
+    ) -> Optional[ApiKeyDescription]:
+        description = None
+        if Scopes.SERVER_SIDE in self.scopes:
+            description = environment.server_side_keys.get(api_key)
+        if Scopes.CLIENT_SIDE in self.scopes and description is None:
+            description = environment.client_side_keys.get(api_key)
+        return description
+
     def __call__(
         self,
         environment: Environment = Depends(_get_environment),
         api_key=Depends(get_environment_api_key),
     ):
-        if Scopes.SERVER_SIDE in self.scopes and api_key in environment.server_side_keys:
-            return
-        if Scopes.CLIENT_SIDE in self.scopes and api_key in environment.client_side_keys:
-            return
-        raise HTTPException(status_code=401)
+        description = self.key_description(environment, api_key)
+        if description is None:
+            raise HTTPException(status_code=401)
+
+        _check_rate_limits(environment.id, api_key, description)
 
 
 server_side_only = _PermissionsValidator({Scopes.SERVER_SIDE})
 server_or_client_side = _PermissionsValidator({Scopes.SERVER_SIDE, Scopes.CLIENT_SIDE})
 
 
+def _get_url_api_key(
+    request: Request, environment: Environment = Depends(_get_environment)
+) -> Optional[ApiKeyValue]:
+    """Key of the Authorization header, or of the token in the URL of requests cached by CDNs"""
+    token = request.query_params.get("token")
+    if "Authorization" in request.headers or token is None:
+        return get_environment_api_key(get_auth_credentials(request))
+    api_key = read_evaluation_token(token, environment.id)
+    if api_key is None:
+        raise HTTPException(status_code=401)
+    return api_key
+
+
+class _UrlPermissionsValidator(_PermissionsValidator):
+    """Validator of the routes accepting the key as a token parameter as well"""
+
+    def __call__(
+        self,
+        environment: Environment = Depends(_get_environment),
+        api_key=Depends(_get_url_api_key),
+    ):
+        super().__call__(environment, api_key)
+
+
+async def _get_context(request: Request, body: Any = Body(None)) -> Optional[dict]:
+    """Context of the request, sent as JSON or as MessagePack"""
+    # bodies which aren't JSON are given as they are
+    if isinstance(body, bytes) and is_msgpack(request):
+        if msgpack is None:
+            raise HTTPException(status_code=415, detail="MessagePack isn't supported")
+        try:
+            body = msgpack.unpackb(body)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid MessagePack: {e}")
+    if body is not None and not isinstance(body, dict):
+        raise HTTPException(status_code=422, detail="Context must be an object")
+    return body
+
+
 @router.get(
     "/{environment_id}/get_rules",
     response_model=Dict[str, FlagRule],
-    dependencies=[Depends(server_side_only)],
+    dependencies=[Depends(admission(RouteClass.GET_RULES)), Depends(server_side_only)],
 )
-async def get_rules(environment: Environment = Depends(_get_environment)):
-    return await environment.get_all_rules()
+async def get_rules(request: Request, environment: Environment = Depends(_get_environment)):
+    if accepts_msgpack(request) and isinstance(environment, CompactEnvironment):
+        return MsgPackResponse(environment.dump_rules_msgpack())
+
+    rules = await environment.get_all_rules()
+    if rules is None:
+        return MsgPackResponse(None) if accepts_msgpack(request) else None
+    rules = {f_name: f_rule.db_representation() for f_name, f_rule in rules.items()}
+    return MsgPackResponse(rules) if accepts_msgpack(request) else rules
+
+
+async def _evaluate_flags_response(
+    request: Request, environment: Environment, body: Optional[dict]
+) -> Response:
+    pool = get_evaluation_pool()
+    if pool and pool.is_expensive(environment, body):
+        results = await pool.evaluate_flags(environment, body)
+    elif isinstance(environment, CompactEnvironment) and environment.flags:
+        # only the dynamic flags are evaluated and serialized, the encoded static
+        # ones are spliced in as they are
+        dynamic_results = environment.evaluate_dynamic_flags(body)
+        if is_tracking():
+            track_results(environment.id, {**environment.static_results, **dynamic_results}, body)
+        if accepts_msgpack(request):
+            return MsgPackResponse(environment.dump_results_msgpack(dynamic_results))
+        return Response(environment.dump_results(dynamic_results), media_type="application/json")
+    else:
+        results = await environment.evaluate_flags(body)
+    track_results(environment.id, results, body)
+    data = None if results is None else results_data(results)
+    return MsgPackResponse(data) if accepts_msgpack(request) else JSONResponse(data)
 
 
 @router.post(
     "/{environment_id}",
     response_model=Dict[str, FlagEvaluationResult],
-    dependencies=[Depends(server_or_client_side)],
+    dependencies=[Depends(admission(RouteClass.EVALUATION)), Depends(server_or_client_side)],
 )
 async def evaluate_flags(
+    request: Request,
+    environment: Environment = Depends(_get_environment),
+    body: Optional[dict] = Depends(_get_context),
+):
+    return await _evaluate_flags_response(request, environment, body)
+
+
+def _encode_context(context: dict) -> str:
+    data = json.dumps(context, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def _decode_context(context: str) -> dict:
+    try:
+        body = json.loads(base64.urlsafe_b64decode(context + "=" * (-len(context) % 4)))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Context must be base64url encoded JSON")
+    if not isinstance(body, dict):
+        raise HTTPException(status_code=422, detail="Context must be an object")
+    return body
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    tags = {tag.strip() for tag in header.split(",")}
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+@router.post(
+    "/token/{environment_id}",
+    dependencies=[
+        Depends(admission(RouteClass.EVALUATION)),
+        Depends(_PermissionsValidator({Scopes.CLIENT_SIDE})),
+    ],
+)
+async def create_evaluation_token(
+    environment: Environment = Depends(_get_environment),
+    api_key: ApiKeyValue = Depends(get_environment_api_key),
+):
+    """Token of a client side key for the URLs of GET evaluation"""
+    if not settings.EVALUATION_TOKEN_SECRET:
+        raise HTTPException(status_code=404, detail="Evaluation tokens aren't enabled")
+    token = sign_evaluation_token(environment.id, api_key)
+    return {"token": token, "expires_in": settings.EVALUATION_TOKEN_TTL}
+
+
+@router.get(
+    "/{environment_id}/evaluate",
+    response_model=Dict[str, FlagEvaluationResult],
+    dependencies=[
+        Depends(admission(RouteClass.EVALUATION)),
+        Depends(_UrlPermissionsValidator({Scopes.SERVER_SIDE, Scopes.CLIENT_SIDE})),
+    ],
+)
+async def evaluate_flags_get(
+    request: Request, context: str = "", environment: Environment = Depends(_get_environment)
+):
+    """Evaluation cacheable by CDNs, the context is base64url encoded JSON in the URL.
+
+    The context is canonicalized, i.e. pruned to the paths read by the flags and encoded
+    with sorted keys, and other URLs are redirected to the canonical one, so all the
+    contexts getting the same results share a single cache entry. With a token from
+    /token/{environment_id} in place of the Authorization header the results are public
+    and shared caches keep them. Responses served by caches aren't tracked.
+    """
+    body = _decode_context(context) if context else {}
+    paths = environment.context_paths()
+    canonical = _encode_context(body if paths is None else prune_data(body, paths))
+    visibility = "private" if "Authorization" in request.headers else "public"
+    headers = {
+        "Cache-Control": f"{visibility}, max-age={settings.EVALUATION_GET_MAX_AGE}",
+        "Vary": "Accept, Authorization",
+    }
+    # the order of the parameters is fixed as well, as it's part of the cache key
+    query = urlencode(
+        [("context", canonical)]
+        + [("token", token) for token in request.query_params.getlist("token")[:1]]
+    )
+    if request.url.query != query:
+        return Response(
+            status_code=307, headers={**headers, "Location": f"{request.url.path}?{query}"}
+        )
+
+    context_hash = hashlib.blake2b(canonical.encode(), digest_size=8).hexdigest()
+    encoding = "msgpack" if accepts_msgpack(request) else "json"
+    # results change only with the rules, as the context is part of the URL
+    headers["ETag"] = f'"{environment.rules_version()}.{context_hash}.{encoding}"'
+    if _etag_matches(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    # the context is canonical, so it's already pruned
+    response = await _evaluate_flags_response(request, environment, body)
+    response.headers.update(headers)
+    return response
+
+
+@router.post(
+    "/bootstrap/{environment_id}",
+    response_model=Dict[str, ALLOWED_TYPES],
+    dependencies=[Depends(admission(RouteClass.EVALUATION)), Depends(server_or_client_side)],
+)
+async def client_bootstrap(
+    request: Request,
+    short_ids: bool = False,
     environment: Environment = Depends(_get_environment),
     body: dict = None,
 ):
-    return await environment.evaluate_flags(body)
+    encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+    payload, results = await get_client_bootstrap_cache().get_payload(
+        environment, body, short_ids, encoding
+    )
+    # cached payloads are served to new contexts, so their values are recorded every time
+    track_results(environment.id, results, body)
+
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding != ContentEncoding.IDENTITY:
+        headers["Content-Encoding"] = encoding.value
+    return Response(payload, media_type="application/json", headers=headers)
+
+
+def _dump_line(data: dict) -> bytes:
+    return json.dumps(data, separators=(",", ":")).encode() + b"\n"
+
+
+def _evaluate_context(
+    environment: Environment, rules: Dict[str, FlagRule], context: Optional[dict], packed: bool
+) -> bytes:
+    """Encoded results of a context of a bulk evaluation"""
+    if isinstance(environment, CompactEnvironment):
+        results = environment.evaluate_dynamic_flags(context)
+        if is_tracking():
+            track_results(environment.id, {**environment.static_results, **results}, context)
+        if packed:
+            return environment.dump_results_msgpack(results)
+        return environment.dump_results(results) + b"\n"
+
+    results = Environment.evaluate_rules(rules, context)
+    track_results(environment.id, results, context)
+    data = results_data(results)
+    return msgpack.packb(data) if packed else _dump_line(data)
+
+
+async def _evaluate_stream(
+    environment: Environment, chunks: AsyncIterator[bytes]
+) -> AsyncIterator[bytes]:
+    rules = await environment.get_all_rules() or {}
+    try:
+        async for line in iter_lines(chunks, settings.BULK_EVALUATION_MAX_LINE_SIZE):
+            if not line.strip():
+                continue
+
+            try:
+                context = json.loads(line)
+                if context is not None and not isinstance(context, dict):
+                    raise ValueError("context must be an object")
+            except ValueError as e:
+                yield _dump_line({"error": f"Invalid context: {e}"})
+                continue
+
+            yield _evaluate_context(environment, rules, context, packed=False)
+    except LineTooLong as e:
+        yield _dump_line({"error": str(e)})
+
+
+async def _evaluate_msgpack_stream(
+    environment: Environment, chunks: AsyncIterator[bytes]
+) -> AsyncIterator[bytes]:
+    rules = await environment.get_all_rules() or {}
+    max_size = settings.BULK_EVALUATION_MAX_LINE_SIZE
+    unpacker = msgpack.Unpacker(max_buffer_size=max_size)
+    try:
+        async for chunk in chunks:
+            unpacker.feed(chunk)
+            for context in unpacker:
+                if context is not None and not isinstance(context, dict):
+                    yield msgpack.packb({"error": "Invalid context: context must be an object"})
+                    continue
+                yield _evaluate_context(environment, rules, context, packed=True)
+    except msgpack.BufferFull:
+        yield msgpack.packb({"error": f"Context is longer than {max_size} bytes"})
+    except ValueError as e:
+        # the rest of the stream can't be split into contexts
+        yield msgpack.packb({"error": f"Invalid MessagePack: {e}"})
+
+
+@router.post(
+    "/bulk/{environment_id}",
+    response_class=NDJSONStreamingResponse,
+    dependencies=[Depends(admission(RouteClass.EVALUATION)), Depends(server_side_only)],
+)
+async def evaluate_flags_stream(
+    request: Request, environment: Environment = Depends(_get_environment)
+):
+    """Evaluate flags for every context of NDJSON body, results are streamed back line by line.
+
+    A body of concatenated MessagePack contexts gets concatenated MessagePack results.
+    """
+    if is_msgpack(request):
+        if msgpack is None:
+            raise HTTPException(status_code=415, detail="MessagePack isn't supported")
+        return NDJSONStreamingResponse(
+            _evaluate_msgpack_stream(environment, request.stream()),
+            media_type=MsgPackResponse.media_type,
+        )
+    return NDJSONStreamingResponse(_evaluate_stream(environment, request.stream()))
+
+
+def _session_request(message) -> Tuple[Optional[dict], Optional[List[str]]]:
+    if not isinstance(message, dict):
+        raise ValueError("message must be an object")
+    context, flags = message.get("context"), message.get("flags")
+    if context is not None and not isinstance(context, dict):
+        raise ValueError("context must be an object")
+    if flags is not None and not (
+        isinstance(flags, list) and all(isinstance(f_name, str) for f_name in flags)
+    ):
+        raise ValueError("flags must be a list of names")
+    return context, flags
+
+
+def _check_session_key(environment: Environment, api_key: Optional[ApiKeyValue]):
+    """Validate the key of a session request and take its rate limits, like HTTP requests"""
+    description = server_or_client_side.key_description(environment, api_key)
+    if description is None:
+        raise HTTPException(status_code=401)
+    _check_rate_limits(environment.id, api_key, description)
+
+
+def _rate_limited(e: HTTPException) -> dict:
+    return {"error": "Rate limit exceeded", "retry_after": int(e.headers["Retry-After"])}
+
+
+def _session_api_key(websocket: WebSocket) -> Optional[ApiKeyValue]:
+    scheme, _, credentials = websocket.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() == "bearer":
+        return credentials
+    return websocket.query_params.get("api_key")
+
+
+async def _connect_session(
+    websocket: WebSocket, environment_id: str, api_key: Optional[ApiKeyValue]
+) -> Optional[Environment]:
+    """Environment of an accepted session, None if the connection was closed instead"""
+    shard = get_shard()
+    if shard and not shard.owns(environment_id):
+        # websocket clients don't follow redirects, the owner is sent to reconnect to it
+        metrics.inc("environment_redirects_total")
+        await websocket.accept()
+        await websocket.send_json(
+            {"error": "Environment is served by another node", "owner": shard.owner(environment_id)}
+        )
+        await websocket.close(code=1008)
+        return None
+
+    controller = get_admission_controller()
+    try:
+        if controller:
+            await controller.acquire(RouteClass.EVALUATION.value)
+    except AdmissionRejected:
+        await websocket.close(code=1013)
+        return None
+    # the slot is held while the session is set up, not for the life of the connection
+    try:
+        environment = await _find_environment(environment_id)
+        if environment is None:
+            raise HTTPException(status_code=404)
+        _check_session_key(environment, api_key)
+    except HTTPException as e:
+        if e.status_code != 429:
+            await websocket.close(code=1008)
+        else:
+            await websocket.accept()
+            await websocket.send_json(_rate_limited(e))
+            await websocket.close(code=1013)
+        return None
+    finally:
+        if controller:
+            controller.release(RouteClass.EVALUATION.value)
+
+    await websocket.accept()
+    return environment
+
+
+async def _receive_session_request(
+    websocket: WebSocket,
+) -> Tuple[Optional[dict], Optional[List[str]]]:
+    """Context and flags of the next valid message, binary messages close the session"""
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        if message.get("text") is None:
+            await websocket.close(code=1003)
+            raise WebSocketDisconnect(1003)
+        try:
+            return _session_request(json.loads(message["text"]))
+        except ValueError as e:
+            await websocket.send_json({"error": f"Invalid session request: {e}"})
+
+
+async def _check_session_update(
+    websocket: WebSocket, environment: Environment, api_key: Optional[ApiKeyValue]
+) -> bool:
+    """Whether a context update is allowed, the session is closed if the key isn't valid anymore"""
+    try:
+        _check_session_key(environment, api_key)
+    except HTTPException as e:
+        if e.status_code != 429:
+            await websocket.close(code=1008)
+            raise WebSocketDisconnect(1008)
+        await websocket.send_json(_rate_limited(e))
+        return False
+    return True
+
+
+@router.websocket("/{environment_id}/session")
+async def evaluation_session(websocket: WebSocket, environment_id: str):
+    """Values of the flags for a context, pushed again whenever they change.
+
+    The client sends {"context": {...}, "flags": [...]}, flags are optional, and gets
+    {"results": {...}} with the values of all the flags, and later with the changed ones
+    along with the "removed" flags. Sending a new context replaces the registered one.
+    The API key is given as a bearer token or as the api_key query parameter.
+
+    Connections and context updates are rate limited as requests of the key, and clients
+    connecting to environments of other nodes get the "owner" node to reconnect to.
+    """
+    sessions = get_evaluation_sessions()
+    if not sessions:
+        await websocket.close(code=1008)
+        return
+    api_key = _session_api_key(websocket)
+    environment = await _connect_session(websocket, environment_id, api_key)
+    if environment is None:
+        return
+
+    session = None
+    try:
+        while True:
+            context, flags = await _receive_session_request(websocket)
+            environment = await _find_environment(environment_id) or environment
+            if not await _check_session_update(websocket, environment, api_key):
+                continue
+            if session is None:
+                session = await sessions.open(environment, context, flags, websocket)
+            else:
+                await sessions.update(session, environment, context, flags)
+    except SessionsLimitReached as e:
+        await websocket.send_json({"error": str(e)})
+        await websocket.close(code=1013)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if session is not None:
+            sessions.close(session)
 
 
 @router.post(
     "/{environment_id}/{flag_name}",
     response_model=FlagEvaluationResult,
-    dependencies=[Depends(server_or_client_side)],
+    dependencies=[Depends(admission(RouteClass.EVALUATION)), Depends(server_or_client_side)],
 )
 async def evaluate_flag(
+    request: Request,
     flag_name: str,
     environment: Environment = Depends(_get_environment),
-    body: dict = None,
+    body: Optional[dict] = Depends(_get_context),
 ):
     res = await environment.evaluate_flag(flag_name, body)
     if not res:
         raise HTTPException(status_code=404, detail="Flag not found")
 
+    track_results(environment.id, {flag_name: res}, body)
+    if accepts_msgpack(request):
+        return MsgPackResponse(results_data({flag_name: res})[flag_name])
     return res
@@ -1,5 +1,7 @@
 from fastapi import APIRouter
-from fastapi.responses import Response
+from fastapi.responses import Response, JSONResponse
+
+from src.evaluation_cache import get_readiness
 
 router = APIRouter()
 
@@ -7,3 +9,9 @@ router = APIRouter()
 @router.get("")
 async def health():
     return Response("Healthy")
+
+
+@router.get("/readiness")
+async def readiness():
+    status = get_readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
@@ -1,15 +1,93 @@
+from typing import List, Optional
+
 from pydantic import BaseSettings
 
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = "test_project"
     ENV: str = "local"
+    EVALUATION_ONLY: bool = False
 
     MONGODB_CONNECTION_URL: str
+    MONGODB_ADMIN_POOL_SIZE: int = 20
+    MONGODB_EVALUATION_POOL_SIZE: int = 100
+    MONGODB_EVALUATION_READ_PREFERENCE: str = "secondaryPreferred"
+    # Mongo doesn't accept values less than 90
+    MONGODB_EVALUATION_MAX_STALENESS_SECONDS: int = 90
 
     RUN_TESTCONTAINERS: bool = False
     STOP_TESTCONTAINERS: bool = True
 
+    EVALUATION_CACHE_ENABLED: bool = False
+    EVALUATION_CACHE_REFRESH_INTERVAL: float = 5.0
+    EVALUATION_CACHE_SHM_NAME: str = "feature_flags_environments"
+    EVALUATION_CACHE_SHM_SIZE: int = 64 * 1024 * 1024
+    EVALUATION_CACHE_LOCK_FILE: str = "/tmp/feature_flags_environments.lock"
+    EVALUATION_CACHE_LOAD_CONCURRENCY: int = 4
+    EVALUATION_CACHE_LOAD_BATCH_SIZE: int = 500
+    EVALUATION_CACHE_MAX_STALENESS: float = 60.0
+    EVALUATION_CACHE_SNAPSHOT_PATH: Optional[str] = None
+    EVALUATION_CACHE_PERSIST_INTERVAL: float = 60.0
+
+    # base URLs of all the evaluation nodes and of this one, every node serves only
+    # its consistent-hash shard of the environments and redirects the other requests
+    SHARDING_NODES: List[str] = []
+    SHARDING_NODE: Optional[str] = None
+    SHARDING_VNODES: int = 100
+
+    ENVIRONMENT_LOADER_WINDOW: float = 0.002
+    ENVIRONMENT_LOADER_MAX_BATCH_SIZE: int = 100
+
+    EVALUATION_POOL_WORKERS: int = 0
+    EVALUATION_POOL_COST_THRESHOLD: int = 20000
+
+    CLIENT_BOOTSTRAP_CACHE_SIZE: int = 10000
+
+    BULK_EVALUATION_MAX_LINE_SIZE: int = 1024 * 1024
+
+    ADMISSION_ENABLED: bool = False
+    ADMISSION_MAX_CONCURRENCY: int = 500
+    ADMISSION_QUEUE_TIMEOUT: float = 5.0
+    ADMISSION_EVALUATION_CONCURRENCY: int = 500
+    ADMISSION_EVALUATION_QUEUE_SIZE: int = 2000
+    ADMISSION_GET_RULES_CONCURRENCY: int = 50
+    ADMISSION_GET_RULES_QUEUE_SIZE: int = 200
+    ADMISSION_ADMIN_CONCURRENCY: int = 10
+    ADMISSION_ADMIN_QUEUE_SIZE: int = 50
+
+    # requests per second, 0 disables the limit
+    RATE_LIMIT_KEY_RATE: float = 0
+    RATE_LIMIT_ENVIRONMENT_RATE: float = 0
+    RATE_LIMIT_ENVIRONMENT_BURST: Optional[int] = None
+    RATE_LIMIT_MAX_BUCKETS: int = 100000
+
+    EXPOSURES_ENABLED: bool = False
+    EXPOSURES_BUFFER_SIZE: int = 100000
+    EXPOSURES_FLUSH_SIZE: int = 1000
+    EXPOSURES_FLUSH_INTERVAL: float = 5.0
+    # path of the context field identifying who the flags were evaluated for
+    EXPOSURES_CONTEXT_KEY: str = "key"
+
+    UNIQUE_CONTEXTS_ENABLED: bool = False
+    # a sketch takes 2 ** precision bytes, the standard error is 1.04 / sqrt(2 ** precision)
+    UNIQUE_CONTEXTS_PRECISION: int = 12
+    UNIQUE_CONTEXTS_MAX_SKETCHES: int = 2000
+    UNIQUE_CONTEXTS_PERSIST_INTERVAL: float = 30.0
+    UNIQUE_CONTEXTS_KEY: str = "key"
+
+    # signs the tokens of GET evaluation, which is disabled without it
+    EVALUATION_TOKEN_SECRET: Optional[str] = None
+    # seconds the tokens of GET evaluation are valid for
+    EVALUATION_TOKEN_TTL: int = 86400
+    # seconds CDNs and browsers keep the results of GET evaluation
+    EVALUATION_GET_MAX_AGE: int = 30
+
+    EVALUATION_SESSIONS_ENABLED: bool = False
+    # how often the rules of the environments with open sessions are checked for changes
+    EVALUATION_SESSIONS_POLL_INTERVAL: float = 1.0
+    EVALUATION_SESSIONS_MAX_SESSIONS: int = 50000
+    EVALUATION_SESSIONS_SEND_TIMEOUT: float = 5.0
+
     class Config:
         case_sensitive = True
         env_file = ".env"
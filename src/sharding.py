@@ -0,0 +1,34 @@
+from typing import Optional
+
+from src.common.hash_ring import HashRing
+from src.settings import settings
+
+
+class Shard:
+    """Environments owned by this evaluation node, out of all the nodes of the ring"""
+
+    def __init__(self, ring: HashRing, node: str):
+        self._ring = ring
+        self.node = node
+
+    def owner(self, environment_id: str) -> str:
+        return self._ring.node_for(environment_id)
+
+    def owns(self, environment_id: str) -> bool:
+        return self.owner(environment_id) == self.node
+
+
+_shard = None
+
+
+def get_shard() -> Optional[Shard]:
+    """Shard of this node, None when every node serves all the environments"""
+    global _shard
+    if not settings.SHARDING_NODE or not settings.SHARDING_NODES:
+        return None
+    if not _shard:
+        _shard = Shard(
+            HashRing(settings.SHARDING_NODES, settings.SHARDING_VNODES), settings.SHARDING_NODE
+        )
+
+    return _shard
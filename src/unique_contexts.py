@@ -0,0 +1,197 @@
+import asyncio
+import json
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+
+from pymongo import UpdateOne
+
+from src.common.db import get_mongo_client
+from src.common.logger import get_logger
+from src.common.metrics import metrics
+from src.lib.hyperloglog import HyperLogLog, hash_value
+from src.lib.json_logic import project_data
+from src.models import ALLOWED_TYPES, FlagEvaluationResult
+from src.settings import settings
+
+logger = get_logger(__name__)
+
+UNIQUE_CONTEXTS_COLLECTION = "unique_contexts"
+
+# environment id, flag name, JSON of the value
+SketchKey = Tuple[str, str, str]
+
+
+def _collection():
+    return get_mongo_client().get_default_database()[UNIQUE_CONTEXTS_COLLECTION]
+
+
+def _sketch_id(key: SketchKey, precision: int) -> str:
+    # sketches of different precisions can't be merged with $max, so they are stored apart
+    return json.dumps([*key, precision], separators=(",", ":"))
+
+
+class UniqueContextsCounter:
+    """Approximate number of distinct contexts every value of a flag was served to.
+
+    Every worker keeps a HyperLogLog sketch per (environment, flag, value) and periodically
+    merges the sketches changed since the last time into Mongo with ``$max`` of the
+    registers, which combines the counts of all the workers without coordination.
+    As ``$max`` never lowers a register, persisted sketches can be dropped at any time,
+    so the least recently used of them make room for new keys.
+    """
+
+    def __init__(
+        self, precision: int, max_sketches: int, persist_interval: float, context_key: str
+    ):
+        self._precision = precision
+        self._max_sketches = max_sketches
+        self._persist_interval = persist_interval
+        self._context_key_paths = {context_key}
+        self._sketches: Dict[SketchKey, HyperLogLog] = {}
+        self._changed: Set[SketchKey] = set()
+        # sketches with nothing to persist, the least recently used first
+        self._persisted: "OrderedDict[SketchKey, None]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+    def _context_hash(self, context: Optional[dict]) -> int:
+        [(_, found, value)] = project_data(context, self._context_key_paths)
+        # without the key the whole context identifies who the flags are evaluated for
+        key = value if found else context
+        return hash_value(json.dumps(key, sort_keys=True, default=str).encode())
+
+    def record(
+        self,
+        environment_id: str,
+        results: Optional[Dict[str, FlagEvaluationResult]],
+        context: Optional[dict],
+    ):
+        if not results:
+            return
+
+        context_hash = self._context_hash(context)
+        for flag_name, result in results.items():
+            key = (environment_id, flag_name, json.dumps(result.value))
+            sketch = self._sketches.get(key)
+            if sketch is None:
+                if len(self._sketches) >= self._max_sketches:
+                    if not self._persisted:
+                        # all the sketches are to be persisted yet, there is room after that
+                        metrics.inc("unique_contexts_sketches_dropped_total")
+                        continue
+                    evicted, _ = self._persisted.popitem(last=False)
+                    del self._sketches[evicted]
+                sketch = self._sketches[key] = HyperLogLog(self._precision)
+            if sketch.add_hash(context_hash):
+                self._changed.add(key)
+                self._persisted.pop(key, None)
+            elif key in self._persisted:
+                self._persisted.move_to_end(key)
+
+    async def persist(self):
+        changed, self._changed = self._changed, set()
+        if not changed:
+            return
+
+        operations = [
+            UpdateOne(
+                {"_id": _sketch_id(key, self._precision)},
+                {
+                    "$max": {f"registers.{i}": r for i, r in self._sketches[key].to_dict().items()},
+                    "$setOnInsert": {
+                        "environment_id": key[0],
+                        "flag": key[1],
+                        "value": json.loads(key[2]),
+                        "precision": self._precision,
+                    },
+                },
+                upsert=True,
+            )
+            for key in changed
+        ]
+        try:
+            await _collection().bulk_write(operations, ordered=False)
+        except Exception as e:
+            self._changed |= changed
+            logger.warning(f"Fail to persist unique contexts: {e}")
+            return
+        for key in changed - self._changed:
+            self._persisted[key] = None
+
+    async def _run(self):
+        try:
+            await _collection().create_index("environment_id")
+        except Exception as e:
+            logger.warning(f"Fail to create {UNIQUE_CONTEXTS_COLLECTION} index: {e}")
+
+        while True:
+            await asyncio.sleep(self._persist_interval)
+            await self.persist()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.persist()
+
+
+async def count_unique_contexts(environment_id: str) -> List[Dict[str, ALLOWED_TYPES]]:
+    """Persisted counts of the environment, merged from all the workers.
+
+    Sketches of a value persisted with different precisions are reduced to the lowest of them.
+    """
+    sketches: Dict[str, List[HyperLogLog]] = {}
+    values = {}
+    async for doc in _collection().find({"environment_id": environment_id}):
+        # sketches persisted before the precision was stored have the configured one
+        precision = doc.get("precision", settings.UNIQUE_CONTEXTS_PRECISION)
+        try:
+            sketch = HyperLogLog.from_dict(doc["registers"], precision)
+        except ValueError as e:
+            logger.warning(f"Skip unique contexts sketch {doc['_id']}: {e}")
+            continue
+        value_id = json.dumps([doc["flag"], doc["value"]], sort_keys=True)
+        values[value_id] = doc["flag"], doc["value"]
+        sketches.setdefault(value_id, []).append(sketch)
+
+    counts = []
+    for value_id, (flag_name, value) in values.items():
+        precision = min(sketch.precision for sketch in sketches[value_id])
+        merged = HyperLogLog(precision)
+        for sketch in sketches[value_id]:
+            merged.merge(sketch.reduce(precision))
+        counts.append({"flag": flag_name, "value": value, "unique_contexts": merged.count()})
+    return counts
+
+
+_unique_contexts_counter = None
+
+
+def get_unique_contexts_counter() -> Optional[UniqueContextsCounter]:
+    global _unique_contexts_counter
+    if not settings.UNIQUE_CONTEXTS_ENABLED:
+        return None
+    if not _unique_contexts_counter:
+        _unique_contexts_counter = UniqueContextsCounter(
+            settings.UNIQUE_CONTEXTS_PRECISION,
+            settings.UNIQUE_CONTEXTS_MAX_SKETCHES,
+            settings.UNIQUE_CONTEXTS_PERSIST_INTERVAL,
+            settings.UNIQUE_CONTEXTS_KEY,
+        )
+
+    return _unique_contexts_counter
+
+
+async def start_unique_contexts_counter():
+    counter = get_unique_contexts_counter()
+    if counter:
+        await counter.start()
+
+
+async def stop_unique_contexts_counter():
+    global _unique_contexts_counter
+    if _unique_contexts_counter:
+        await _unique_contexts_counter.stop()
+        _unique_contexts_counter = None
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from src.common.admission import AdmissionClass, AdmissionController, AdmissionRejected
+from src.common.metrics import metrics
+
+
+def _controller(queue_timeout=1.0):
+    return AdmissionController(
+        max_concurrency=2,
+        classes=[AdmissionClass("evaluation", 2, 10), AdmissionClass("admin", 1, 1)],
+        queue_timeout=queue_timeout,
+    )
+
+
+@pytest.mark.asyncio
+async def test_higher_priority_requests_are_started_first():
+    controller = _controller()
+    started = []
+
+    async def _request(class_name, tag):
+        await controller.acquire(class_name)
+        started.append(tag)
+
+    await controller.acquire("evaluation")
+    await controller.acquire("admin")
+
+    admin = asyncio.create_task(_request("admin", "admin"))
+    evaluation = asyncio.create_task(_request("evaluation", "evaluation"))
+    await asyncio.sleep(0)
+    assert metrics.get("admission_queue_depth", route_class="admin") == 1
+
+    # the slot of admin is given to evaluation, which was queued later
+    controller.release("admin")
+    await evaluation
+    assert started == ["evaluation"]
+
+    controller.release("evaluation")
+    await admin
+    assert started == ["evaluation", "admin"]
+    assert metrics.get("admission_queue_depth", route_class="admin") == 0
+
+
+@pytest.mark.asyncio
+async def test_requests_over_queue_are_rejected():
+    controller = _controller(queue_timeout=0.01)
+    await controller.acquire("admin")
+    queued = asyncio.create_task(controller.acquire("admin"))
+    await asyncio.sleep(0)
+
+    with pytest.raises(AdmissionRejected) as e:
+        await controller.acquire("admin")
+    assert e.value.reason == "queue_full"
+
+    with pytest.raises(AdmissionRejected) as e:
+        await queued
+    assert e.value.reason == "timeout"
+
+    # evaluation isn't affected by the admin queue
+    await controller.acquire("evaluation")
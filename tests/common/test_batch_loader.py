@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from src.common.batch_loader import BatchLoader
+
+
+@pytest.mark.asyncio
+async def test_concurrent_loads_are_coalesced_and_batched():
+    calls = []
+
+    async def load_many(keys):
+        calls.append(sorted(keys))
+        await asyncio.sleep(0.01)
+        return {k: k.upper() for k in keys if k != "missing"}
+
+    loader = BatchLoader("test_loads", load_many, window=0.01, max_batch_size=10)
+
+    results = await asyncio.gather(*[loader.load(k) for k in ("a", "b", "a", "missing", "a", "b")])
+    assert results == ["A", "B", "A", None, "A", "B"]
+    assert calls == [["a", "b", "missing"]]
+
+    assert await loader.load("a") == "A"
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_full_batch_is_dispatched_immediately():
+    calls = []
+
+    async def load_many(keys):
+        calls.append(sorted(keys))
+        return {k: k for k in keys}
+
+    loader = BatchLoader("test_loads", load_many, window=10, max_batch_size=2)
+    assert await asyncio.gather(loader.load("a"), loader.load("b")) == ["a", "b"]
+    assert calls == [["a", "b"]]
+
+
+@pytest.mark.asyncio
+async def test_errors_are_shared():
+    async def load_many(keys):
+        raise ConnectionError("unavailable")
+
+    loader = BatchLoader("test_loads", load_many, window=0, max_batch_size=10)
+    results = await asyncio.gather(loader.load("a"), loader.load("a"), return_exceptions=True)
+    assert [str(r) for r in results] == ["unavailable", "unavailable"]
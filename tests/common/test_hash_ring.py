@@ -0,0 +1,23 @@
+from src.common.hash_ring import HashRing
+
+
+def test_keys_are_spread_and_move_minimally():
+    keys = [f"environment{i}" for i in range(10000)]
+    nodes = ["http://node1", "http://node2", "http://node3", "http://node4"]
+    ring = HashRing(nodes)
+    owners = {key: ring.node_for(key) for key in keys}
+
+    counts = [list(owners.values()).count(node) for node in nodes]
+    assert all(1500 < count < 3500 for count in counts)
+
+    # only the keys of the new node move when it joins
+    joined = HashRing(nodes + ["http://node5"])
+    moved = [key for key in keys if joined.node_for(key) != owners[key]]
+    assert all(joined.node_for(key) == "http://node5" for key in moved)
+    assert 1000 < len(moved) < 3000
+
+    # and only the keys of the node which leaves move to the others
+    left = HashRing(nodes[1:])
+    assert all(left.node_for(key) == owners[key] for key in keys if owners[key] != nodes[0])
+
+    assert HashRing([]).node_for("environment") is None
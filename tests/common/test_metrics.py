@@ -0,0 +1,52 @@
+import threading
+
+from src.common import db
+from src.common.db import MongoClientRole, _PoolMetricsListener
+from src.common.metrics import Metrics
+
+
+def test_expose():
+    metrics = Metrics()
+    metrics.inc("requests_total", route="evaluation")
+    metrics.inc("requests_total", 2, route="evaluation")
+    metrics.set("cache_size", 10)
+    metrics.add_collector(lambda: metrics.set("cache_stale", 1))
+
+    assert metrics.get("requests_total", route="evaluation") == 3
+    assert metrics.expose() == (
+        "# TYPE requests_total counter\n"
+        'requests_total{route="evaluation"} 3\n'
+        "# TYPE cache_size gauge\n"
+        "cache_size 10\n"
+        "# TYPE cache_stale gauge\n"
+        "cache_stale 1\n"
+    )
+
+
+def test_expose_while_series_are_added():
+    metrics = Metrics()
+    thread = threading.Thread(
+        target=lambda: [metrics.inc("events_total", thread=i) for i in range(20000)]
+    )
+    thread.start()
+    while thread.is_alive():
+        metrics.expose()
+    thread.join()
+    assert metrics.expose().count("\n") == 20001
+
+
+def test_pool_metrics_are_gauges(monkeypatch):
+    monkeypatch.setattr("src.common.db.metrics", Metrics())
+    listener = _PoolMetricsListener(MongoClientRole.EVALUATION)
+    for _ in range(2):
+        listener.connection_created(None)
+        listener.connection_check_out_started(None)
+        listener.connection_checked_out(None)
+    listener.connection_checked_in(None)
+    listener.connection_closed(None)
+
+    exposed = db.metrics.expose()
+    assert "# TYPE mongo_pool_connections gauge\n" in exposed
+    assert 'mongo_pool_connections{role="evaluation"} 1\n' in exposed
+    assert 'mongo_pool_checked_out{role="evaluation"} 1\n' in exposed
+    assert 'mongo_pool_checkouts_total{role="evaluation"} 2\n' in exposed
@@ -0,0 +1,21 @@
+import pytest
+
+from src.common.ndjson import iter_lines, LineTooLong
+
+
+async def _stream(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+@pytest.mark.asyncio
+async def test_iter_lines():
+    lines = [line async for line in iter_lines(_stream(b'{"a"', b': 1}\n{}\n\n{"b', b'": 2}'), 100)]
+    assert lines == [b'{"a": 1}', b"{}", b"", b'{"b": 2}']
+
+
+@pytest.mark.asyncio
+async def test_line_too_long():
+    with pytest.raises(LineTooLong):
+        async for _ in iter_lines(_stream(b"{}\n", b"a" * 5, b"a" * 6), 10):
+            pass
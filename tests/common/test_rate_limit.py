@@ -0,0 +1,20 @@
+from src.common.rate_limit import RateLimiter
+
+
+def test_token_buckets(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("src.common.rate_limit.time.monotonic", lambda: now[0])
+    limiter = RateLimiter(max_buckets=2)
+
+    assert [limiter.take("a", rate=2, burst=3) for _ in range(4)] == [0, 0, 0, 0.5]
+    now[0] += 0.5
+    assert limiter.take("a", rate=2, burst=3) == 0
+    assert limiter.take("a", rate=2, burst=3) == 0.5
+
+    # no limit
+    assert all(limiter.take("b", rate=0) == 0 for _ in range(10))
+
+    # the least recently used bucket is evicted and starts full again
+    limiter.take("c", rate=1)
+    limiter.take("d", rate=1)
+    assert limiter.take("a", rate=2, burst=3) == 0
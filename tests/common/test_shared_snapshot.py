@@ -0,0 +1,100 @@
+import multiprocessing
+from uuid import uuid4
+
+import pytest
+
+from src.common.shared_snapshot import SharedSnapshot, SnapshotTooLarge
+
+
+@pytest.fixture
+def snapshot_factory(tmp_path):
+    name = f"test_{uuid4().hex[:8]}"
+    opened = []
+
+    def _factory() -> SharedSnapshot:
+        snapshot = SharedSnapshot(name, 64 * 1024, str(tmp_path / "snapshot.lock"))
+        opened.append(snapshot)
+        return snapshot
+
+    yield _factory
+
+    for snapshot in opened:
+        snapshot.close()
+    opened[0].unlink()
+
+
+def _read_in_process(snapshot, queue):
+    queue.put(snapshot.read("env1"))
+
+
+def test_publish_and_read(snapshot_factory):
+    writer = snapshot_factory()
+    reader = snapshot_factory()
+
+    assert writer.acquire_leadership()
+    assert not reader.acquire_leadership()
+
+    assert reader.generation == 0
+    assert reader.read("env1") is None
+
+    assert writer.publish({"env1": ("v1", b'{"a": 1}'), "env2": ("v1", b'{"b": 2}')}) == 1
+    assert reader.version("env1") == "v1"
+    assert reader.read("env1") == ("v1", b'{"a": 1}')
+    assert reader.read("env2") == ("v1", b'{"b": 2}')
+
+    writer.publish({"env1": ("v2", b'{"a": 3}')})
+    assert reader.generation == 2
+    assert reader.read("env1") == ("v2", b'{"a": 3}')
+    assert reader.read("env2") is None
+    assert set(reader.record_ids()) == {"env1"}
+
+    queue = multiprocessing.get_context("fork").Queue()
+    process = multiprocessing.get_context("fork").Process(
+        target=_read_in_process, args=(snapshot_factory(), queue)
+    )
+    process.start()
+    process.join()
+    assert queue.get() == ("v2", b'{"a": 3}')
+
+
+def test_snapshot_too_large(snapshot_factory):
+    writer = snapshot_factory()
+
+    with pytest.raises(SnapshotTooLarge):
+        writer.publish({"env1": ("v1", b"a" * 64 * 1024)})
+
+    assert writer.generation == 0
+
+
+def test_torn_index_is_read_again(snapshot_factory, monkeypatch):
+    writer = snapshot_factory()
+    reader = snapshot_factory()
+    writer.acquire_leadership()
+    writer.publish({"env1": ("v1", b'{"a": 1}')})
+
+    headers = []
+    read_header = reader._read_header
+
+    def _read_header():
+        generation, writing, published_at, restored = read_header()
+        headers.append(generation)
+        # the writer starts rewriting the buffer while its index is copied the first time
+        if len(headers) == 2:
+            writing = generation + 2
+        return generation, writing, published_at, restored
+
+    monkeypatch.setattr(reader, "_read_header", _read_header)
+    assert reader.version("env1") == "v1"
+    assert len(headers) == 4
+
+
+def test_touch_keeps_generation(snapshot_factory):
+    writer = snapshot_factory()
+    writer.acquire_leadership()
+    writer.publish({"env1": ("v1", b"{}")}, published_at=1.0, restored=True)
+
+    writer.touch(published_at=2.0)
+    assert writer.generation == 1
+    assert writer.published_at == 2.0
+    assert not writer.restored
+    assert writer.read("env1") == ("v1", b"{}")
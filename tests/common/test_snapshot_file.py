@@ -0,0 +1,14 @@
+from src.common.snapshot_file import dump_records, load_records
+
+
+def test_dump_and_load_records(tmp_path):
+    path = str(tmp_path / "environments.snapshot")
+    assert load_records(path) is None
+
+    records = {"env1": ("v1", b'{"name": "a b"}'), "env2": ("v2", b'{"flags": {}}')}
+    dump_records(path, records, 100.5)
+    assert load_records(path) == (records, 100.5)
+
+    dump_records(path, {}, 200.0)
+    assert load_records(path) == ({}, 200.0)
+    assert not (tmp_path / "environments.snapshot.tmp").exists()
@@ -1,5 +1,6 @@
 import asyncio
 from datetime import datetime
+from uuid import uuid4
 
 import pytest
 from asgi_lifespan import LifespanManager
@@ -9,6 +10,8 @@ from testcontainers.core.waiting_utils import wait_container_is_ready
 
 from src.app import app
 from src.common.db import get_mongo_client
+from src.common.shared_snapshot import SharedSnapshot
+from src.evaluation_cache import EvaluationCache
 from src.models import Project, Environment, ApiKey
 from src.settings import settings
 
@@ -66,6 +69,34 @@ def event_loop():
     yield asyncio.get_event_loop()
 
 
+@pytest.fixture
+def cache_factory(tmp_path):
+    snapshots = []
+
+    def _factory(**kwargs) -> EvaluationCache:
+        snapshot = SharedSnapshot(
+            f"test_{uuid4().hex[:8]}", 256 * 1024, str(tmp_path / "snapshot.lock")
+        )
+        snapshots.append(snapshot)
+        return EvaluationCache(snapshot, 60.0, 2, 10, **kwargs)
+
+    yield _factory
+
+    for snapshot in snapshots:
+        snapshot.close()
+        snapshot.unlink()
+
+
+@pytest.fixture
+async def evaluation_cache(client, cache_factory, monkeypatch):
+    """Evaluation cache used by the routes, refresh it after changing the environments"""
+    cache = cache_factory()
+    cache._shared.acquire_leadership()
+    monkeypatch.setattr(settings, "EVALUATION_CACHE_ENABLED", True)
+    monkeypatch.setattr("src.evaluation_cache._evaluation_cache", cache)
+    return cache
+
+
 @pytest.fixture
 def environment_factory():
     async def _factory(**kwargs) -> Environment:
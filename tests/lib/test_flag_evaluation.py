@@ -1,6 +1,22 @@
+import re
+
 import pytest
 
-from src.lib.json_logic import evaluate
+from src.lib import json_logic
+from src.lib.json_logic import (
+    OPERATIONS,
+    PATTERN_OPERATIONS,
+    ContextIndex,
+    SharedSubexpressions,
+    check_patterns,
+    evaluate,
+    compile_rule,
+    count_nodes,
+    get_flag_names,
+    get_var_paths,
+    project_data,
+    prune_data,
+)
 
 
 def test_context_validation():
@@ -46,3 +62,222 @@ def test_context_validation():
         )
 
     assert str(e.value) == "Invalid context: key '0': list index out of range"
+
+
+@pytest.mark.parametrize(
+    "rule, context",
+    [
+        (True, None),
+        ("some", {}),
+        ({"==": [{"var": "a"}, 1]}, {"a": 1}),
+        ({"!": {"var": "a"}}, {"a": 0}),
+        ({"and": [{"<": [{"var": "temp"}, 110]}, {">=": [2, 1]}]}, {"temp": 100}),
+        ({"in": [{"var": "user.country"}, ["RU", "US"]]}, {"user": {"country": "US"}}),
+        ({"?:": [{"var": "a.0"}, "yes", "no"]}, {"a": [0]}),
+        ({"cat": ["a", {"var": "b"}]}, {"b": "c"}),
+    ],
+)
+def test_compiled_rule(rule, context):
+    assert compile_rule(rule)(context) == evaluate(rule, context)
+
+
+@pytest.mark.parametrize(
+    "rule, context, expected",
+    [
+        ({"regex": [{"var": "email"}, "@example\\.com$"]}, {"email": "a@example.com"}, True),
+        ({"regex": [{"var": "email"}, "@example\\.com$"]}, {"email": "a@example.co"}, False),
+        ({"regex": [{"var": "email"}, "(?i)^A@"]}, {"email": "a@example.com"}, True),
+        (
+            {"regex": [{"var": "email"}, {"cat": ["^", {"var": "p"}]}]},
+            {"email": "ab", "p": "a"},
+            True,
+        ),
+        ({"regex": [{"var": "n"}, "1"]}, {"n": 1}, False),
+        ({"starts_with": [{"var": "email"}, "admin@"]}, {"email": "admin@a.com"}, True),
+        ({"starts_with": [{"var": "email"}, ["root@", "admin@"]]}, {"email": "admin@a.com"}, True),
+        ({"ends_with": [{"var": "email"}, ["@a.com", "@b.com"]]}, {"email": "x@c.com"}, False),
+        ({"ends_with": [{"var": "email"}, "@a.com"]}, {"email": None}, False),
+        ({"semver": [{"var": "app"}, ">=", "1.10.0"]}, {"app": "1.9.0"}, False),
+        ({"semver": [{"var": "app"}, "<", "1.0.0"]}, {"app": "1.0.0-rc.1"}, True),
+        ({"version_in": [{"var": "app"}, ">=1.2.0 <2.0.0 || ^3.1"]}, {"app": "3.4.0"}, True),
+        ({"version_in": [{"var": "app"}, "~1.2"]}, {"app": "unknown"}, False),
+        (
+            {"ip_in_ranges": [{"var": "ip"}, ["10.0.0.0/8", "2001:db8::/32"]]},
+            {"ip": "10.1.1.1"},
+            True,
+        ),
+        ({"ip_in_ranges": [{"var": "ip"}, "10.0.0.0/8"]}, {"ip": "2001:db8::1"}, False),
+    ],
+)
+def test_pattern_operations(rule, context, expected):
+    assert compile_rule(rule)(context) is expected
+    assert evaluate(rule, context) is expected
+
+
+@pytest.mark.parametrize(
+    "value, substring",
+    [("apple pie", "pie"), ("apple pie", "cherry"), ("pie", "apple pie"), ("", "")],
+)
+def test_pattern_operations_agree_with_in(value, substring):
+    # "in" of strings is the substring test of json-logic-js
+    expected = evaluate({"in": [substring, value]}, {})
+    assert compile_rule({"regex": [value, re.escape(substring)]})({}) is expected
+    prefix_or_suffix = value.startswith(substring) or value.endswith(substring)
+    assert compile_rule(
+        {"or": [{"starts_with": [value, substring]}, {"ends_with": [value, substring]}]}
+    )({}) is (expected and prefix_or_suffix)
+
+
+def test_patterns_are_prepared_once(monkeypatch):
+    prepared = []
+    prepare, match = PATTERN_OPERATIONS["regex"]
+
+    def _prepare(pattern):
+        prepared.append(pattern)
+        return prepare(pattern)
+
+    monkeypatch.setitem(PATTERN_OPERATIONS, "regex", (_prepare, match))
+    json_logic._prepare_literal.cache_clear()
+    evaluator = compile_rule({"regex": [{"var": "email"}, "@example\\.com$"]})
+    assert [evaluator({"email": email}) for email in ("a@example.com", "b@example.org")] == [
+        True,
+        False,
+    ]
+    assert prepared == ["@example\\.com$"]
+
+
+def test_check_patterns():
+    check_patterns({"and": [{"regex": [{"var": "a"}, "^a+$"]}, {"version_in": ["1.0.0", "^1"]}]})
+    check_patterns({"regex": [{"var": "a"}, {"var": "pattern"}]})
+    for rule in (
+        {"!": {"regex": [{"var": "a"}, "("]}},
+        {"semver": [{"var": "a"}, "~>", "1.0.0"]},
+        {"semver": [{"var": "a"}, ">=", "1.0"]},
+        {"version_in": [{"var": "a"}, ">=1.0.0 <abc"]},
+        {"starts_with": [{"var": "a"}, [1]]},
+        {"regex": [{"var": "a"}, "a", "b"]},
+        {"ip_in_ranges": [{"var": "a"}, ["10.0.0.0/8", "10.0.0.0/40"]]},
+    ):
+        with pytest.raises(ValueError):
+            check_patterns(rule)
+    # the flag fails on evaluation instead
+    with pytest.raises(ValueError):
+        compile_rule({"regex": [{"var": "a"}, "("]})
+
+
+def test_literal_patterns_are_prepared_once():
+    json_logic._prepare_literal.cache_clear()
+    networks = [f"10.{i}.0.0/16" for i in range(100)]
+    for _ in range(3):
+        rule = {
+            "or": [{"ip_in_ranges": [{"var": "ip"}, networks]}, {"regex": [{"var": "a"}, "^b"]}]
+        }
+        # as the validation of a loaded flag and its compilation do
+        check_patterns(rule)
+        assert compile_rule(rule)({"ip": "10.42.1.1", "a": "c"}) is True
+    assert json_logic._prepare_literal.cache_info().misses == 2
+
+
+def test_shared_subexpressions():
+    rules = {
+        "a": {"and": [{">": [{"var": "age"}, 18]}, {"==": [{"var": "plan"}, "pro"]}]},
+        "b": {"or": [{">": [{"var": ["age"]}, 18]}, {"/": [1, {"var": "zero"}]}]},
+        "c": {"/": [1, {"var": "zero"}]},
+        "d": True,
+    }
+    shared = SharedSubexpressions(rules)
+    assert shared.sharing_rules() == {"a", "b", "c"}
+    assert shared.dedup_ratio() == 12 / 8
+
+    index = ContextIndex({"age": 20, "plan": "pro", "zero": 0})
+    assert shared.compile("a")(index) is True
+    # the error of a shared subexpression is kept for the request as well
+    for name in ("b", "c"):
+        with pytest.raises(ZeroDivisionError):
+            shared.compile(name)(index)
+    assert shared.compile("d")({}) is True
+
+
+def test_compiled_rule_errors():
+    with pytest.raises(ValueError) as e:
+        compile_rule({"==": [{"var": "pie.filling"}, "apple"]})({"pie": {}})
+    assert str(e.value) == "Invalid context: key 'filling' not found"
+
+    evaluator = compile_rule({"unknown": [1, 2]})
+    with pytest.raises(RuntimeError) as e:
+        evaluator({})
+    assert str(e.value) == "Unrecognized operation unknown"
+
+
+def test_context_index_is_shared_by_rules(monkeypatch):
+    lookups = []
+    get_value = json_logic._get_value
+
+    def _get_value(data, key):
+        lookups.append(key)
+        return get_value(data, key)
+
+    monkeypatch.setattr(json_logic, "_get_value", _get_value)
+
+    index = ContextIndex({"user": {"country": "US", "age": 30}})
+    rules = [
+        {"==": [{"var": "user.country"}, "US"]},
+        {">": [{"var": "user.age"}, 18]},
+        {"==": [{"var": "user.country"}, "RU"]},
+        {"==": [{"var": "user.name"}, "Bob"]},
+    ]
+    assert [compile_rule(rule)(index) for rule in rules[:3]] == [True, True, False]
+    for _ in range(2):
+        with pytest.raises(ValueError) as e:
+            compile_rule(rules[3])(index)
+        assert str(e.value) == "Invalid context: key 'name' not found"
+    # every path is looked up once
+    assert lookups == ["user", "country", "age", "name"]
+
+
+def test_evaluation_doesnt_change_operations():
+    evaluate({"==": [{"var": "a"}, 1]}, {"a": 1})
+    assert "var" not in OPERATIONS
+
+
+def test_count_nodes():
+    assert count_nodes(True) == 1
+    assert count_nodes({"==": [{"var": "a"}, 1]}) == 5
+    assert count_nodes({"user": {"id": 1, "tags": ["a", "b"]}}) == 6
+
+
+def test_var_paths():
+    assert get_var_paths(True) == set()
+    assert get_var_paths(
+        {"and": [{"<": [{"var": "temp"}, 110]}, {"==": [{"var": "pie.filling"}, "apple"]}]}
+    ) == {"temp", "pie.filling"}
+    assert get_var_paths({"var": {"cat": ["a", "b"]}}) is None
+
+    paths = {"temp", "pie.filling"}
+    assert project_data({"temp": 1, "pie": {"filling": "apple"}, "other": 1}, paths) == (
+        project_data({"temp": 1, "pie": {"filling": "apple"}}, paths)
+    )
+    assert project_data({"temp": 1}, paths) == [["pie.filling", False, None], ["temp", True, 1]]
+
+    assert prune_data({"temp": 1, "pie": {"filling": "apple", "crust": 1}, "other": 1}, paths) == {
+        "temp": 1,
+        "pie": {"filling": "apple"},
+    }
+    assert prune_data({"pie": {"filling": "apple"}}, {"pie", "pie.filling"}) == {
+        "pie": {"filling": "apple"}
+    }
+    assert prune_data(None, paths) == {}
+
+
+def test_flag_names():
+    assert get_flag_names({"and": [{"flag": "payments"}, {"!": {"flag": "legacy"}}]}) == {
+        "payments",
+        "legacy",
+    }
+    assert get_flag_names({"flag": {"var": "name"}}) is None
+    assert get_var_paths({"flag": "payments"}) == set()
+    assert (
+        compile_rule({"!": {"flag": "payments"}})(ContextIndex({}, {"payments": True}.get)) is False
+    )
+    with pytest.raises(ValueError):
+        compile_rule({"flag": "payments"})({})
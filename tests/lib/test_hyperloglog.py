@@ -0,0 +1,43 @@
+import pytest
+
+from src.lib.hyperloglog import HyperLogLog
+
+
+@pytest.mark.parametrize("cardinality", [0, 10, 1000, 50000])
+def test_count_is_within_error(cardinality):
+    sketch = HyperLogLog(precision=12)
+    for i in range(cardinality):
+        sketch.add(str(i).encode())
+        sketch.add(str(i).encode())
+
+    # 3 standard errors
+    assert abs(sketch.count() - cardinality) <= 0.05 * cardinality
+
+
+def test_merge_and_round_trip():
+    first, second = HyperLogLog(), HyperLogLog()
+    for i in range(3000):
+        first.add(str(i).encode())
+    for i in range(2000, 5000):
+        second.add(str(i).encode())
+
+    first.merge(HyperLogLog.from_dict(second.to_dict()))
+    assert abs(first.count() - 5000) <= 250
+    assert len(first.registers) == 4096
+
+    with pytest.raises(ValueError):
+        first.merge(HyperLogLog(precision=10))
+
+
+def test_reduce_precision():
+    high, low = HyperLogLog(precision=14), HyperLogLog(precision=10)
+    for i in range(20000):
+        high.add(str(i).encode())
+        low.add(str(i).encode())
+
+    assert high.reduce(10).registers == low.registers
+    assert high.reduce(14).registers == high.registers
+    with pytest.raises(ValueError):
+        low.reduce(12)
+    with pytest.raises(ValueError):
+        HyperLogLog.from_dict(high.to_dict(), precision=10)
@@ -0,0 +1,64 @@
+import ipaddress
+import random
+
+import pytest
+
+from src.lib.ip_ranges import IPRanges, parse_ranges
+
+
+@pytest.mark.parametrize(
+    "address, expected",
+    [
+        ("10.1.2.3", True),
+        ("11.0.0.1", False),
+        ("192.168.1.200", True),
+        ("192.168.2.1", False),
+        ("172.16.0.1", True),
+        ("172.31.255.255", True),
+        ("172.32.0.0", False),
+        ("100.64.0.1", True),
+        ("100.64.0.2", False),
+        ("2001:db8::1", True),
+        ("2001:db9::1", False),
+        ("::ffff:10.0.0.1", True),
+        ("not an address", False),
+        (167772161, False),
+        (None, False),
+    ],
+)
+def test_contains(address, expected):
+    ranges = IPRanges(
+        ["10.0.0.0/8", "192.168.1.0/24", "172.16.0.0/12", "100.64.0.1/32", "2001:db8::/32"]
+    )
+    assert (address in ranges) is expected
+
+
+def test_networks_inside_others():
+    ranges = IPRanges(["10.1.0.0/16", "10.0.0.0/8", "10.2.3.0/24"])
+    assert "10.200.0.1" in ranges
+    everything = IPRanges(["0.0.0.0/0"])
+    assert "8.8.8.8" in everything
+    assert "::1" not in everything
+
+
+def test_matches_ipaddress():
+    rng = random.Random(1)
+    networks = [
+        ipaddress.ip_network((rng.getrandbits(32), rng.randint(8, 32)), strict=False)
+        for _ in range(500)
+    ]
+    ranges = IPRanges([str(network) for network in networks])
+    for _ in range(2000):
+        address = ipaddress.ip_address(rng.getrandbits(32))
+        # a share of the addresses is taken from the networks
+        if rng.random() < 0.5:
+            network = rng.choice(networks)
+            address = network[rng.randrange(network.num_addresses)]
+        expected = any(address in network for network in networks)
+        assert (str(address) in ranges) is expected
+
+
+def test_invalid_networks():
+    for networks in (["10.0.0.0/33"], ["example.com"], [10], {"10.0.0.0/8": 1}):
+        with pytest.raises(ValueError):
+            parse_ranges(networks)
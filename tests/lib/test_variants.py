@@ -0,0 +1,73 @@
+from collections import Counter
+
+import pytest
+
+from src.lib import variants
+from src.models import FlagRule
+
+
+def _assignments(flag_rule: FlagRule, contexts: int) -> list:
+    evaluator = flag_rule.compile()
+    return [evaluator({"user": {"id": i}}) for i in range(contexts)]
+
+
+def test_allocation_follows_weights():
+    allocation = variants.allocate([1, 2, 1])
+    assert allocation == [(2500, 0), (7500, 1), (10000, 2)]
+    assert variants.is_valid(allocation, [1, 2, 1])
+    assert not variants.is_valid(allocation, [1, 1, 1])
+    assert variants.target_counts([1, 1, 1]) == [3334, 3333, 3333]
+
+
+def test_variants_are_assigned_by_weights():
+    flag_rule = FlagRule(
+        variants=[{"value": "a", "weight": 70}, {"value": "b", "weight": 30}],
+        bucket_by="user.id",
+        default="off",
+    )
+    counts = Counter(_assignments(flag_rule, 20000))
+    assert abs(counts["a"] / 20000 - 0.7) < 0.02
+
+
+def test_variants_are_sticky_across_weight_increases():
+    weights = [
+        {"value": "a", "weight": 20},
+        {"value": "b", "weight": 30},
+        {"value": "c", "weight": 50},
+    ]
+    before = FlagRule(variants=weights, bucket_by="user.id")
+    after = FlagRule(
+        variants=[*weights[:1], {"value": "b", "weight": 60}, weights[2]], bucket_by="user.id"
+    )
+    after.reallocate(before)
+
+    moved = {
+        (old, new)
+        for old, new in zip(_assignments(before, 5000), _assignments(after, 5000))
+        if old != new
+    }
+    assert moved == {("a", "b"), ("c", "b")}
+
+
+def test_variants_are_targeted_by_rules():
+    flag_rule = FlagRule(
+        rules={"==": [{"var": "country"}, "US"]},
+        variants=[{"value": "a", "weight": 1}],
+        default="off",
+    )
+    assert flag_rule.var_paths() == {"country", "key"}
+    assert flag_rule.compile()({"country": "US", "key": "k"}) == "a"
+    assert flag_rule.compile()({"country": "FR", "key": "k"}) == "off"
+
+
+@pytest.mark.parametrize(
+    "flag_variants",
+    [
+        [],
+        [{"value": "a", "weight": 0}],
+        [{"value": "a", "weight": 1}, {"value": "a", "weight": 2}],
+    ],
+)
+def test_invalid_variants_are_rejected(flag_variants):
+    with pytest.raises(ValueError):
+        FlagRule(variants=flag_variants)
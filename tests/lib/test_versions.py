@@ -0,0 +1,75 @@
+import pytest
+
+from src.lib.versions import parse_range, parse_version, satisfies
+
+
+def test_version_precedence():
+    ordered = [
+        "1.0.0-alpha",
+        "1.0.0-alpha.1",
+        "1.0.0-alpha.beta",
+        "1.0.0-beta",
+        "1.0.0-beta.2",
+        "1.0.0-beta.11",
+        "1.0.0-rc.1",
+        "1.0.0",
+        "1.0.1",
+        "1.10.0",
+        "2.0.0",
+    ]
+    assert sorted(ordered, key=parse_version) == ordered
+    assert parse_version("v1.2.3+build.5") == parse_version("1.2.3")
+    for version in ("1.2", "1.2.3.4", "a.b.c", 123):
+        with pytest.raises(ValueError):
+            parse_version(version)
+
+
+# results of satisfies() of the npm semver package
+@pytest.mark.parametrize(
+    "version, spec, expected",
+    [
+        ("1.2.3", "^1.2.0", True),
+        ("2.0.0", "^1.2.0", False),
+        ("0.2.5", "^0.2.3", True),
+        ("0.3.0", "^0.2.3", False),
+        ("0.0.4", "^0.0.3", False),
+        ("1.9.0", "^1.2", True),
+        ("0.2.9", "^0.2", True),
+        ("1.2.9", "~1.2.3", True),
+        ("1.3.0", "~1.2.3", False),
+        ("1.9.9", "~1", True),
+        ("1.5.0", "1.x", True),
+        ("2.0.0", "1.2.*", False),
+        ("1.4.9", "1.2 - 1.4", True),
+        ("1.5.0", "1.2 - 1.4", False),
+        ("1.4.0", "1.2.3 - 1.4.0", True),
+        ("1.2.0", ">1.2", False),
+        ("1.3.0", ">1.2", True),
+        ("1.2.9", "<=1.2", True),
+        ("1.2.0", "<1.2", False),
+        ("3.0.0", ">=1.2.0 <2.0.0 || ^3.1", False),
+        ("3.1.2", ">=1.2.0 <2.0.0 || ^3.1", True),
+        ("1.2.3", ">= 1.2.3", True),
+        ("1.0.0", "*", True),
+        ("1.0.0", "", True),
+        ("1.0.0", "<*", False),
+        ("1.2.3", "=1.2.3", True),
+        ("1.2.3-alpha", "^1.2.0", False),
+        ("1.2.3-beta.4", "^1.2.3-beta.2", True),
+        ("1.2.4-alpha", "^1.2.3-beta.2", False),
+        ("2.0.0-alpha", "<2.0.0", False),
+        # bounds like <2.0.0-0 of partial versions don't admit prereleases
+        ("1.3.0-beta", ">1.2", False),
+        ("2.0.0-alpha", "<=1", False),
+        ("1.2.3-beta", "1.2.3-alpha - 1.3", True),
+        ("not a version", "*", False),
+    ],
+)
+def test_satisfies(version, spec, expected):
+    assert satisfies(version, parse_range(spec)) is expected
+
+
+def test_invalid_ranges():
+    for spec in (">=1.0.0 <", "1.2.3.4", "^a", None):
+        with pytest.raises(ValueError):
+            parse_range(spec)
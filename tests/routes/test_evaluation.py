@@ -1,6 +1,16 @@
+import asyncio
+import base64
+import json
+from typing import Optional
+
 import pytest
 
+from src.app import app
+from src.client_bootstrap import short_flag_id, short_flag_ids
+from src.common.hash_ring import HashRing
+from src.exposures import ExposureRecorder
 from src.models import Environment, Flag, FlagRule, ApiKey
+from src.settings import settings
 
 
 @pytest.mark.asyncio
@@ -161,3 +171,437 @@ async def test_evaluation_evaluate_permissions(client, environment_factory):
         headers={"Authorization": f"Bearer {next(iter(env.server_side_keys))}"},
     )
     assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_client_bootstrap(client, project_factory):
+    env = Environment(name="env1")
+    project = await project_factory(environments=[env])
+    await project.add_flag(
+        Flag(name="ready_to_eat", rules={"==": [{"var": "pie.filling"}, "apple"]})
+    )
+    await project.add_flag(Flag(name="simple", rules=1, default=0))
+    headers = {"Authorization": f"Bearer {next(iter(env.client_side_keys))}"}
+
+    for _ in range(2):
+        response = await client.post(
+            f"/bootstrap/{env.id}",
+            json={"pie": {"filling": "apple"}, "user": "first"},
+            headers={**headers, "Accept-Encoding": "gzip"},
+        )
+        assert response.status_code == 200
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.json() == {"ready_to_eat": "True", "simple": "1"}
+
+    response = await client.post(
+        f"/bootstrap/{env.id}?short_ids=true",
+        json={"pie": {"filling": "pineapple"}},
+        headers={**headers, "Accept-Encoding": "identity"},
+    )
+    assert response.status_code == 200
+    assert "Content-Encoding" not in response.headers
+    assert response.json() == {
+        short_flag_id("ready_to_eat"): "False",
+        short_flag_id("simple"): "1",
+    }
+
+
+def test_short_flag_ids_collisions():
+    # flag_11500 and flag_27283 have the same short id
+    assert short_flag_id("flag_11500") == short_flag_id("flag_27283")
+    named_like_short_id = short_flag_id("simple")
+    assert short_flag_ids(["flag_11500", "flag_27283", "simple", "ready_to_eat"]) == {
+        "flag_11500": "flag_11500",
+        "flag_27283": "flag_27283",
+        "simple": named_like_short_id,
+        "ready_to_eat": short_flag_id("ready_to_eat"),
+    }
+    assert short_flag_ids(["simple", named_like_short_id]) == {
+        "simple": "simple",
+        named_like_short_id: short_flag_id(named_like_short_id),
+    }
+
+
+@pytest.mark.asyncio
+async def test_bulk_evaluation(client, project_factory):
+    env = Environment(name="env1")
+    project = await project_factory(environments=[env])
+    await project.add_flag(
+        Flag(name="ready_to_eat", rules={"==": [{"var": "pie.filling"}, "apple"]})
+    )
+
+    async def _body():
+        yield b'{"pie": {"filling": "apple"}}\n{"pie": {"fil'
+        yield b'ling": "pineapple"}}\n\nnot json\n{}'
+
+    response = await client.post(
+        f"/bulk/{env.id}",
+        content=_body(),
+        headers={"Authorization": f"Bearer {next(iter(env.server_side_keys))}"},
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0] == {"ready_to_eat": {"value": "True", "status": "ok", "reason": ""}}
+    assert lines[1] == {"ready_to_eat": {"value": "False", "status": "ok", "reason": ""}}
+    assert lines[2]["error"].startswith("Invalid context")
+    assert lines[3] == {
+        "ready_to_eat": {
+            "value": "False",
+            "status": "error",
+            "reason": "Invalid context: key 'pie' not found",
+        }
+    }
+
+    response = await client.post(
+        f"/bulk/{env.id}",
+        content=b"{}",
+        headers={"Authorization": f"Bearer {next(iter(env.client_side_keys))}"},
+    )
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_served_values_are_recorded(client, project_factory, evaluation_cache, monkeypatch):
+    recorder = ExposureRecorder(100, 100, 60, "user")
+    monkeypatch.setattr(settings, "EXPOSURES_ENABLED", True)
+    monkeypatch.setattr("src.exposures._exposure_recorder", recorder)
+    env = Environment(name="env1")
+    project = await project_factory(environments=[env])
+    await project.add_flag(Flag(name="simple", rules=1))
+    await project.add_flag(Flag(name="adult", rules={">=": [{"var": "age"}, 18]}))
+    await evaluation_cache.refresh()
+
+    def _exposures():
+        exposures = sorted(
+            (e["context_key"], e["meta"]["flag"], e["value"]) for e in recorder._buffer
+        )
+        recorder._buffer.clear()
+        return exposures
+
+    # the second context of the same cohort gets the cached payload
+    headers = {"Authorization": f"Bearer {next(iter(env.client_side_keys))}"}
+    for user in ["first", "second"]:
+        response = await client.post(
+            f"/bootstrap/{env.id}", json={"age": 20, "user": user}, headers=headers
+        )
+        assert response.status_code == 200
+    assert _exposures() == [
+        ("first", "adult", "True"),
+        ("first", "simple", "1"),
+        ("second", "adult", "True"),
+        ("second", "simple", "1"),
+    ]
+
+    response = await client.post(
+        f"/bulk/{env.id}",
+        content=b'{"age": 20, "user": "first"}\n{"age": 10, "user": "second"}',
+        headers={"Authorization": f"Bearer {next(iter(env.server_side_keys))}"},
+    )
+    assert response.status_code == 200
+    assert _exposures() == [
+        ("first", "adult", "True"),
+        ("first", "simple", "1"),
+        ("second", "adult", "False"),
+        ("second", "simple", "1"),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_rate_limits(client, project_factory):
+    env = Environment(name="env1")
+    project = await project_factory(environments=[env])
+    await project.add_flag(Flag(name="simple", rules=1))
+    limited_key = await env.create_api_key(
+        ApiKey(name="limited_key", rate_limit=0.01, rate_limit_burst=2)
+    )
+
+    headers = {"Authorization": f"Bearer {limited_key.key}"}
+    statuses = [(await client.post(f"/{env.id}", headers=headers)).status_code for _ in range(3)]
+    assert statuses == [200, 200, 429]
+
+    response = await client.post(f"/{env.id}/simple", headers=headers)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+
+    other_headers = {"Authorization": f"Bearer {next(iter(env.client_side_keys))}"}
+    response = await client.post(f"/{env.id}", headers=other_headers)
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_invalid_keys_are_not_rate_limited(client, project_factory, monkeypatch):
+    env = Environment(name="env1")
+    project = await project_factory(environments=[env])
+    await project.add_flag(Flag(name="simple", rules=1))
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENVIRONMENT_RATE", 0.01)
+    monkeypatch.setattr(settings, "RATE_LIMIT_ENVIRONMENT_BURST", 1)
+
+    for headers in [{"Authorization": "Bearer invalid"}, {"Authorization": "Basic a:b"}, {}]:
+        response = await client.post(f"/{env.id}", headers=headers)
+        assert response.status_code == 401
+
+    headers = {"Authorization": f"Bearer {next(iter(env.server_side_keys))}"}
+    statuses = [(await client.post(f"/{env.id}", headers=headers)).status_code for _ in range(2)]
+    assert statuses == [200, 429]
+
+
+@pytest.mark.asyncio
+async def test_requests_of_other_shards_are_redirected(client, project_factory, monkeypatch):
+    env = Environment(name="env1")
+    project = await project_factory(environments=[env])
+    await project.add_flag(Flag(name="simple", rules=1))
+    headers = {"Authorization": f"Bearer {next(iter(env.server_side_keys))}"}
+
+    nodes = ["http://node1:8080", "http://node2:8080"]
+    owner = HashRing(nodes).node_for(env.id)
+    monkeypatch.setattr(settings, "SHARDING_NODES", nodes)
+    monkeypatch.setattr("src.sharding._shard", None)
+
+    monkeypatch.setattr(settings, "SHARDING_NODE", owner)
+    response = await client.post(f"/{env.id}/simple", headers=headers)
+    assert response.status_code == 200
+
+    monkeypatch.setattr(settings, "SHARDING_NODE", next(n for n in nodes if n != owner))
+    monkeypatch.setattr("src.sharding._shard", None)
+    response = await client.post(f"/{env.id}/simple?debug=1", headers=headers)
+    assert response.status_code == 307
+    assert response.headers["Location"] == f"{owner}/{env.id}/simple?debug=1"
+    assert response.headers["X-Environment-Owner"] == owner
+
+
+@pytest.mark.asyncio
+async def test_msgpack_content_negotiation(client, project_factory):
+    msgpack = pytest.importorskip("msgpack")
+    env = Environment(name="env1")
+    project = await project_factory(environments=[env])
+    await project.add_flag(
+        Flag(name="ready_to_eat", rules={"==": [{"var": "pie.filling"}, "apple"]})
+    )
+    headers = {
+        "Authorization": f"Bearer {next(iter(env.server_side_keys))}",
+        "Accept": "application/msgpack",
+        "Content-Type": "application/msgpack",
+    }
+    expected = {"ready_to_eat": {"value": "True", "status": "ok", "reason": ""}}
+
+    response = await client.post(
+        f"/{env.id}", content=msgpack.packb({"pie": {"filling": "apple"}}), headers=headers
+    )
+    assert response.headers["Content-Type"] == "application/msgpack"
+    assert msgpack.unpackb(response.content) == expected
+
+    # JSON contexts get MessagePack results as well
+    response = await client.post(
+        f"/{env.id}/ready_to_eat",
+        json={"pie": {"filling": "apple"}},
+        headers={**headers, "Content-Type": "application/json"},
+    )
+    assert msgpack.unpackb(response.content) == expected["ready_to_eat"]
+
+    response = await client.post(f"/{env.id}", content=msgpack.packb([1]), headers=headers)
+    assert response.status_code == 422
+
+    response = await client.post(
+        f"/bulk/{env.id}",
+        content=msgpack.packb({"pie": {"filling": "apple"}}) + msgpack.packb(None),
+        headers=headers,
+    )
+    assert response.headers["Content-Type"] == "application/msgpack"
+    unpacker = msgpack.Unpacker()
+    unpacker.feed(response.content)
+    first, second = unpacker
+    assert first == expected
+    assert second["ready_to_eat"]["status"] == "error"
+
+
+def _context_param(context: dict) -> str:
+    data = json.dumps(context, sort_keys=True, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+@pytest.mark.asyncio
+async def test_cacheable_evaluation(client, project_factory, monkeypatch):
+    monkeypatch.setattr(settings, "EVALUATION_TOKEN_SECRET", "secret")
+    env = Environment(name="env1")
+    other_env = Environment(name="env2")
+    project = await project_factory(environments=[env, other_env])
+    await project.add_flag(
+        Flag(name="ready_to_eat", rules={"==": [{"var": "pie.filling"}, "apple"]})
+    )
+    client_key = next(iter(env.client_side_keys))
+
+    response = await client.post(
+        f"/token/{env.id}", headers={"Authorization": f"Bearer {next(iter(env.server_side_keys))}"}
+    )
+    assert response.status_code == 401
+    response = await client.post(
+        f"/token/{env.id}", headers={"Authorization": f"Bearer {client_key}"}
+    )
+    token = response.json()["token"]
+
+    # keys the flags don't read are pruned, so the contexts share the URL of their results
+    context = _context_param({"pie": {"filling": "apple"}, "user": "somebody"})
+    response = await client.get(f"/{env.id}/evaluate?context={context}&token={token}")
+    assert response.status_code == 307
+    canonical = _context_param({"pie": {"filling": "apple"}})
+    location = f"/{env.id}/evaluate?context={canonical}&token={token}"
+    assert response.headers["Location"] == location
+
+    response = await client.get(location)
+    assert response.json() == {"ready_to_eat": {"value": "True", "status": "ok", "reason": ""}}
+    assert response.headers["Cache-Control"].startswith("public, max-age=")
+    etag = response.headers["ETag"]
+
+    response = await client.get(location, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    await env.update_flag(
+        "ready_to_eat", FlagRule(rules={"==": [{"var": "pie.filling"}, "cherry"]}, default=False)
+    )
+    response = await client.get(location, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+    # tokens are valid only for their environment
+    response = await client.get(f"/{other_env.id}/evaluate?token={token}")
+    assert response.status_code == 401
+
+    response = await client.get(
+        f"/{env.id}/evaluate?context={canonical}",
+        headers={"Authorization": f"Bearer {client_key}"},
+    )
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"].startswith("private")
+
+    response = await client.get(f"/{env.id}/evaluate?context=W10&token={token}")
+    assert response.status_code == 422
+
+    # only GET evaluation accepts tokens
+    response = await client.post(f"/{env.id}?token={token}")
+    assert response.status_code == 401
+
+    # tokens expire
+    monkeypatch.setattr(settings, "EVALUATION_TOKEN_TTL", -1)
+    headers = {"Authorization": f"Bearer {client_key}"}
+    expired_token = (await client.post(f"/token/{env.id}", headers=headers)).json()["token"]
+    response = await client.get(f"/{env.id}/evaluate?context={canonical}&token={expired_token}")
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_cacheable_evaluation_of_cached_environments(
+    client, project_factory, evaluation_cache, monkeypatch
+):
+    monkeypatch.setattr(settings, "EVALUATION_TOKEN_SECRET", "secret")
+    env = Environment(name="env1")
+    project = await project_factory(environments=[env])
+    await project.add_flag(Flag(name="simple", rules=1))
+    await evaluation_cache.refresh()
+    assert evaluation_cache.get(env.id) is not None
+    client_key = next(iter(env.client_side_keys))
+
+    headers = {"Authorization": f"Bearer {client_key}"}
+    response = await client.post(f"/token/{env.id}", headers=headers)
+    assert response.status_code == 200
+    token = response.json()["token"]
+
+    location = f"/{env.id}/evaluate?context={_context_param({})}&token={token}"
+    response = await client.get(location)
+    assert response.status_code == 200
+    assert response.json()["simple"]["value"] == "1"
+
+    # new keys don't invalidate the tokens, revoked keys do
+    await env.create_api_key(ApiKey(name="new_key"))
+    await evaluation_cache.refresh()
+    assert (await client.get(location)).status_code == 200
+    await env.delete_api_key(client_key)
+    await evaluation_cache.refresh()
+    assert (await client.get(location)).status_code == 401
+
+
+async def _session(env_id: str, key: Optional[str], messages: list) -> list:
+    """ASGI messages sent by the session route, after it received the given ones"""
+    received = asyncio.Queue()
+    for message in [{"type": "websocket.connect"}, *messages, {"type": "websocket.disconnect"}]:
+        received.put_nowait(message)
+    sent = []
+    scope = {
+        "type": "websocket",
+        "path": f"/{env_id}/session",
+        "raw_path": f"/{env_id}/session".encode(),
+        "query_string": b"",
+        "headers": [(b"authorization", f"Bearer {key}".encode())] if key else [],
+        "root_path": "",
+        "scheme": "ws",
+        "server": ("test", 80),
+        "subprotocols": [],
+    }
+
+    async def _send(message):
+        sent.append(message)
+
+    await asyncio.wait_for(app(scope, received.get, _send), 5)
+    return [
+        json.loads(m["text"]) if m["type"] == "websocket.send" else m.get("code", m["type"])
+        for m in sent
+    ]
+
+
+def _context(context: dict) -> dict:
+    return {"type": "websocket.receive", "text": json.dumps({"context": context})}
+
+
+@pytest.mark.asyncio
+async def test_evaluation_session_limits(client, project_factory, monkeypatch):
+    env = Environment(name="env1")
+    project = await project_factory(environments=[env])
+    await project.add_flag(Flag(name="simple", rules=1))
+    limited_key = await env.create_api_key(
+        ApiKey(name="limited_key", rate_limit=0.01, rate_limit_burst=2)
+    )
+    monkeypatch.setattr(settings, "EVALUATION_SESSIONS_ENABLED", True)
+    monkeypatch.setattr("src.evaluation_sessions._evaluation_sessions", None)
+
+    # the connection and every context take a token
+    sent = await _session(env.id, limited_key.key, [_context({"a": 1}), _context({"a": 2})])
+    assert sent[0] == "websocket.accept"
+    assert sent[1]["results"]["simple"]["value"] == "1"
+    assert sent[2]["error"] == "Rate limit exceeded"
+    assert len(sent) == 3
+
+    sent = await _session(env.id, limited_key.key, [])
+    assert sent[0] == "websocket.accept"
+    assert sent[1]["retry_after"] > 0
+    assert sent[2] == 1013
+
+    key = next(iter(env.server_side_keys))
+    assert await _session(env.id, "invalid", [_context({})]) == [1008]
+    sent = await _session(env.id, key, [{"type": "websocket.receive", "bytes": b"{}"}])
+    assert sent == ["websocket.accept", 1003]
+
+    nodes = ["http://node1:8080", "http://node2:8080"]
+    owner = HashRing(nodes).node_for(env.id)
+    monkeypatch.setattr(settings, "SHARDING_NODES", nodes)
+    monkeypatch.setattr(settings, "SHARDING_NODE", next(n for n in nodes if n != owner))
+    monkeypatch.setattr("src.sharding._shard", None)
+    sent = await _session(env.id, key, [_context({})])
+    assert sent[1]["owner"] == owner
+    assert sent[2] == 1008
+
+
+@pytest.mark.asyncio
+async def test_requests_without_bearer_keys_of_cached_environments(
+    client, project_factory, evaluation_cache, monkeypatch
+):
+    env = Environment(name="env1")
+    project = await project_factory(environments=[env])
+    await project.add_flag(Flag(name="simple", rules=1))
+    await evaluation_cache.refresh()
+    monkeypatch.setattr(settings, "EVALUATION_SESSIONS_ENABLED", True)
+    monkeypatch.setattr("src.evaluation_sessions._evaluation_sessions", None)
+
+    response = await client.post(f"/{env.id}", headers={"Authorization": "Basic dXNlcjpwYXNz"})
+    assert response.status_code == 401
+    assert await _session(env.id, None, [_context({})]) == [1008]
@@ -0,0 +1,11 @@
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_health(client):
+    response = await client.get("/health_check")
+    assert response.status_code == 200
+
+    response = await client.get("/health_check/readiness")
+    assert response.status_code == 200
+    assert response.json()["ready"]
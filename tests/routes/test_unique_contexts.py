@@ -0,0 +1,73 @@
+import pytest
+
+from src.models import Environment, Flag
+from src.unique_contexts import UniqueContextsCounter
+
+
+@pytest.mark.asyncio
+async def test_unique_contexts_api(client, project_factory):
+    env = Environment(name="env1")
+    project = await project_factory(environments=[env])
+    await project.add_flag(Flag(name="new_checkout", rules={"<": [{"var": "key"}, 30]}))
+    env = await Environment.get(env.id)
+
+    # two workers which have seen overlapping contexts
+    counters = [UniqueContextsCounter(12, 100, 60, "key") for _ in range(2)]
+    for i in range(100):
+        context = {"key": i}
+        counters[i % 2].record(env.id, await env.evaluate_flags(context), context)
+        counters[0].record(env.id, await env.evaluate_flags(context), context)
+    for counter in counters:
+        await counter.persist()
+
+    response = await client.get(f"/admin/{env.id}/unique_contexts")
+    assert response.status_code == 200
+    counts = {(c["flag"], c["value"]): c["unique_contexts"] for c in response.json()}
+    # values are stored as they were served by the evaluation API
+    assert counts.keys() == {("new_checkout", "True"), ("new_checkout", "False")}
+    assert abs(counts[("new_checkout", "True")] - 30) <= 2
+    assert abs(counts[("new_checkout", "False")] - 70) <= 3
+
+
+@pytest.mark.asyncio
+async def test_persisted_sketches_are_evicted(client, project_factory):
+    env = Environment(name="env1")
+    project = await project_factory(environments=[env])
+    await project.add_flag(Flag(name="variant", rules={"var": "key"}))
+    env = await Environment.get(env.id)
+
+    counter = UniqueContextsCounter(12, 2, 60, "key")
+    for i in range(3):
+        context = {"key": i}
+        counter.record(env.id, await env.evaluate_flags(context), context)
+    # the third value waits until the sketches of the first two are persisted
+    await counter.persist()
+    for i in range(2, 4):
+        context = {"key": i}
+        counter.record(env.id, await env.evaluate_flags(context), context)
+    await counter.persist()
+
+    response = await client.get(f"/admin/{env.id}/unique_contexts")
+    counts = {c["value"]: c["unique_contexts"] for c in response.json()}
+    assert counts == {"0": 1, "1": 1, "2": 1, "3": 1}
+
+
+@pytest.mark.asyncio
+async def test_sketches_of_different_precisions(client, project_factory):
+    env = Environment(name="env1")
+    project = await project_factory(environments=[env])
+    await project.add_flag(Flag(name="enabled", rules=True))
+    env = await Environment.get(env.id)
+
+    # workers before and after the precision was changed
+    counters = [UniqueContextsCounter(precision, 100, 60, "key") for precision in (14, 10)]
+    for i in range(2000):
+        context = {"key": i}
+        counters[i % 2].record(env.id, await env.evaluate_flags(context), context)
+    for counter in counters:
+        await counter.persist()
+
+    response = await client.get(f"/admin/{env.id}/unique_contexts")
+    assert response.status_code == 200
+    [count] = response.json()
+    assert abs(count["unique_contexts"] - 2000) <= 150
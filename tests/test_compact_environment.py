@@ -0,0 +1,168 @@
+import json
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+
+from src.common.content_types import msgpack
+from src.compact_environment import CompactEnvironment
+from src.evaluation_cache import _deserialize, _serialize
+from src.lib.json_logic import OPERATIONS
+from src.models import ApiKeyDescription, Environment, FlagRule
+
+
+@pytest.mark.asyncio
+async def test_compact_environment_evaluates_as_environment():
+    environment = Environment.construct(
+        id="env1",
+        name="env1",
+        flags={
+            "simple": FlagRule(rules=1, default=0),
+            "ready_to_eat": FlagRule(
+                rules={"==": [{"var": "pie.filling"}, "apple"]},
+                default=True,
+            ),
+            "broken": FlagRule(rules={"unknown": [1]}, default=False),
+        },
+        server_side_keys={"server_key": ApiKeyDescription(name="server", rate_limit=5)},
+        client_side_keys={"client_key": ApiKeyDescription(name="client")},
+    )
+    compact = _deserialize(_serialize(environment)[1])
+    assert isinstance(compact, CompactEnvironment)
+
+    for context in ({"pie": {"filling": "apple"}}, {"pie": {}}, None):
+        assert await compact.evaluate_flags(context) == await environment.evaluate_flags(context)
+    assert await compact.evaluate_flag("ready_to_eat", {}) == (
+        await environment.evaluate_flag("ready_to_eat", {})
+    )
+    assert await compact.evaluate_flag("missing", {}) is None
+
+    assert compact.rules_version() == environment.rules_version()
+    assert compact.rules_complexity() == environment.rules_complexity()
+    assert compact.context_paths() == environment.context_paths() == {"pie.filling"}
+    assert {
+        f_name: f_rule.db_representation()
+        for f_name, f_rule in (await compact.get_all_rules()).items()
+    } == {f_name: f_rule.db_representation() for f_name, f_rule in environment.flags.items()}
+
+    assert "server_key" in compact.server_side_keys
+    assert "server_key" not in compact.client_side_keys
+    assert compact.server_side_keys.get("server_key").rate_limit == 5
+    assert compact.client_side_keys.get("client_key").rate_limit is None
+    assert compact.client_side_keys.get("unknown") is None
+
+    with pytest.raises(AttributeError):
+        compact.id = "env2"
+    with pytest.raises(TypeError):
+        compact.flags["simple"] = None
+
+
+@pytest.mark.asyncio
+async def test_static_flags_are_evaluated_once():
+    environment = Environment.construct(
+        id="env1",
+        name="env1",
+        flags={
+            "kill_switch": FlagRule(rules=True, default=False),
+            "constant": FlagRule(rules={"==": [1, 1]}, default=False),
+            "broken": FlagRule(rules={"/": [1, 0]}, default=False),
+            "ready_to_eat": FlagRule(
+                rules={"==": [{"var": "pie.filling"}, "apple"]}, default=False
+            ),
+        },
+        server_side_keys={},
+        client_side_keys={},
+    )
+    compact = _deserialize(_serialize(environment)[1])
+    assert set(compact.static_results) == {"kill_switch", "constant", "broken"}
+    assert set(compact.dynamic_flags) == {"ready_to_eat"}
+
+    for context in ({"pie": {"filling": "apple"}}, {}):
+        dynamic_results = compact.evaluate_dynamic_flags(context)
+        assert set(dynamic_results) == {"ready_to_eat"}
+        assert json.loads(compact.dump_results(dynamic_results)) == jsonable_encoder(
+            await environment.evaluate_flags(context)
+        )
+        if msgpack is not None:
+            assert msgpack.unpackb(compact.dump_results_msgpack(dynamic_results)) == (
+                json.loads(compact.dump_results(dynamic_results))
+            )
+    assert await compact.evaluate_flag("broken", {}) == (
+        await environment.evaluate_flag("broken", {})
+    )
+
+
+@pytest.mark.asyncio
+async def test_static_prerequisites_are_shared_by_requests():
+    environment = Environment.construct(
+        id="env1",
+        name="env1",
+        flags={
+            "enabled": FlagRule(rules=True, default=False),
+            "enabled_too": FlagRule(rules={"flag": "enabled"}, default=False),
+            "pro": FlagRule(
+                rules={"and": [{"flag": "enabled_too"}, {"==": [{"var": "plan"}, "pro"]}]},
+                default=False,
+            ),
+        },
+        server_side_keys={},
+        client_side_keys={},
+    )
+    compact = _deserialize(_serialize(environment)[1])
+    assert set(compact.static_results) == {"enabled", "enabled_too"}
+    static_evaluations = dict(compact._static_evaluations)
+
+    # requests read the static evaluations without changing them
+    assert compact.evaluate_dynamic_flags({"plan": "pro"})["pro"].value == "True"
+    assert (await compact.evaluate_flag("pro", {"plan": "free"})).value == "False"
+    assert dict(compact._static_evaluations) == static_evaluations
+
+
+def test_static_flags_without_valid_result_stay_dynamic():
+    environment = Environment.construct(
+        id="env1",
+        name="env1",
+        flags={"no_default": FlagRule(rules={"/": [1, 0]})},
+        server_side_keys={},
+        client_side_keys={},
+    )
+    compact = _deserialize(_serialize(environment)[1])
+    assert set(compact.dynamic_flags) == {"no_default"}
+
+
+@pytest.mark.asyncio
+async def test_subexpressions_are_evaluated_once(monkeypatch):
+    calls = []
+    in_operation = OPERATIONS["in"]
+
+    def _in(a, b):
+        calls.append(a)
+        return in_operation(a, b)
+
+    monkeypatch.setitem(OPERATIONS, "in", _in)
+    in_country = {"in": [{"var": "user.country"}, ["US", "CA", "shared_test"]]}
+    environment = Environment.construct(
+        id="env1",
+        name="env1",
+        flags={
+            "adult": FlagRule(
+                rules={"and": [in_country, {">=": [{"var": "user.age"}, 21]}]}, default=False
+            ),
+            "country": FlagRule(rules=in_country, default=False),
+            "variants": FlagRule(
+                rules={"!": in_country}, variants=[{"value": "a", "weight": 1}], default="off"
+            ),
+            "other": FlagRule(rules={"in": [{"var": "user.plan"}, ["pro"]]}, default=False),
+        },
+        server_side_keys={},
+        client_side_keys={},
+    )
+    compact = _deserialize(_serialize(environment)[1])
+    # 12 operations, the check of the country and its "var" are in three flags
+    assert compact.dedup_ratio() == 12 / 8
+
+    for context in ({"user": {"country": "US", "age": 30, "plan": "pro"}, "key": "k"}, {}):
+        expected = await environment.evaluate_flags(context)
+        calls.clear()
+        assert await compact.evaluate_flags(context) == expected
+        # the country is checked once, along with the plan
+        assert calls == (["US", "pro"] if context else [])
@@ -0,0 +1,31 @@
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_unchanged_environments_are_not_published_again(
+    client, cache_factory, environment_factory
+):
+    environment = await environment_factory(name="env1")
+    cache = cache_factory()
+    cache._shared.acquire_leadership()
+
+    assert await cache.refresh() == 1
+    published_at = cache._shared.published_at
+    assert await cache.refresh() == 1
+    assert cache._shared.published_at > published_at
+
+    await environment.delete()
+    assert await cache.refresh() == 2
+    assert cache.get(environment.id) is None
+
+
+@pytest.mark.parametrize(
+    "content",
+    [b"", b'{"published_at": 1.0}\nenv1 v1', b"not json\n", b'{"other": 1}\n', b"\xff\xfe\n"],
+)
+def test_corrupt_snapshot_file_is_not_restored(cache_factory, tmp_path, content):
+    path = tmp_path / "environments.snapshot"
+    path.write_bytes(content)
+    cache = cache_factory(snapshot_path=str(path))
+    assert not cache.restore()
+    assert cache._shared.generation == 0
@@ -0,0 +1,29 @@
+import pytest
+
+from src.evaluation_pool import EvaluationPool
+from src.models import Environment, FlagRule
+
+
+@pytest.mark.asyncio
+async def test_evaluation_pool():
+    environment = Environment.construct(
+        id="env1",
+        flags={
+            "simple": FlagRule(rules=1, default=0),
+            "ready_to_eat": FlagRule(
+                rules={"==": [{"var": "pie.filling"}, "apple"]},
+                default=True,
+            ),
+        },
+    )
+    pool = EvaluationPool(max_workers=1, cost_threshold=8)
+    try:
+        assert not pool.is_expensive(environment, {})
+        assert pool.is_expensive(environment, {"pie": {"filling": "apple"}})
+
+        for context in ({"pie": {"filling": "apple"}}, {"pie": {}}):
+            assert await pool.evaluate_flags(environment, context) == (
+                await environment.evaluate_flags(context)
+            )
+    finally:
+        pool.shutdown()
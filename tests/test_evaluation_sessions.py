@@ -0,0 +1,128 @@
+import json
+
+import pytest
+
+from src.evaluation_sessions import EvaluationSessions, SessionsLimitReached
+from src.models import Environment, FlagRule
+
+
+class _WebSocket:
+    def __init__(self):
+        self.messages = []
+
+    async def send_json(self, message):
+        self.messages.append(json.loads(json.dumps(message)))
+
+    async def close(self, code=1000):
+        pass
+
+
+def _environment(flags: dict) -> Environment:
+    return Environment.construct(
+        id="env1", name="env1", flags=flags, server_side_keys={}, client_side_keys={}
+    )
+
+
+def _flags(min_age: int) -> dict:
+    return {
+        "adult": FlagRule(rules={">=": [{"var": "age"}, min_age]}, default=False),
+        "checkout": FlagRule(rules={"flag": "adult"}, default=False),
+        "us": FlagRule(rules={"==": [{"var": "country"}, "US"]}, default=False),
+    }
+
+
+@pytest.mark.asyncio
+async def test_changed_values_are_pushed(monkeypatch):
+    current = {"environment": _environment(_flags(18))}
+
+    async def _load(ids):
+        return {"env1": current["environment"]}
+
+    tracked = []
+
+    def _track_results(environment_id, results, context):
+        if results:
+            tracked.append(
+                (context.get("age"), {f_name: res.value for f_name, res in results.items()})
+            )
+
+    monkeypatch.setattr("src.evaluation_sessions.track_results", _track_results)
+    sessions = EvaluationSessions(_load, poll_interval=1, max_sessions=10, send_timeout=1)
+    young, old, us_only = _WebSocket(), _WebSocket(), _WebSocket()
+    await sessions.open(current["environment"], {"age": 19, "country": "US"}, None, young)
+    await sessions.open(current["environment"], {"age": 40, "country": "US"}, None, old)
+    await sessions.open(current["environment"], {"age": 19, "country": "US"}, {"us"}, us_only)
+    assert young.messages[0]["results"]["checkout"]["value"] == "True"
+    assert set(us_only.messages[0]["results"]) == {"us"}
+    assert tracked[2] == (19, {"us": "True"})
+    tracked.clear()
+
+    await sessions.poll()
+    assert len(young.messages) == len(old.messages) == 1
+
+    evaluate = Environment.evaluate_rules
+    evaluated = []
+
+    def _evaluate_rules(rules, context, flags=None, evaluated_flags=None):
+        evaluated.append(set(rules))
+        return evaluate(rules, context, flags, evaluated_flags)
+
+    monkeypatch.setattr(Environment, "evaluate_rules", _evaluate_rules)
+    flags = _flags(21)
+    del flags["us"]
+    current["environment"] = _environment(flags)
+    await sessions.poll()
+
+    # the prerequisite and its dependent flag are evaluated
+    assert evaluated == [{"adult", "checkout"}] * 2
+    assert young.messages[1] == {
+        "results": {
+            "adult": {"value": "False", "status": "ok", "reason": ""},
+            "checkout": {"value": "False", "status": "ok", "reason": ""},
+        },
+        "removed": ["us"],
+    }
+    # the values of the old context didn't change
+    assert old.messages[1] == us_only.messages[1] == {"results": {}, "removed": ["us"]}
+    # only the pushed values are recorded
+    assert tracked == [(19, {"adult": "False", "checkout": "False"})]
+
+    current["environment"] = _environment({**flags, "adult": FlagRule(rules=False)})
+    await sessions.poll()
+    assert len(us_only.messages) == 2
+
+    with pytest.raises(SessionsLimitReached):
+        for _ in range(10):
+            await sessions.open(current["environment"], {}, None, _WebSocket())
+
+
+@pytest.mark.asyncio
+async def test_sessions_are_opened_with_the_rules_of_their_group():
+    current = {"environment": _environment(_flags(18))}
+
+    async def _load(ids):
+        return {"env1": current["environment"]}
+
+    sessions = EvaluationSessions(_load, poll_interval=1, max_sessions=10, send_timeout=1)
+    stale = current["environment"]
+    first = _WebSocket()
+    await sessions.open(stale, {"age": 19}, {"adult"}, first)
+    current["environment"] = _environment(_flags(21))
+    await sessions.poll()
+    assert first.messages[-1]["results"]["adult"]["value"] == "False"
+
+    # a request with an environment older than the group's gets the group's values
+    second = _WebSocket()
+    await sessions.open(stale, {"age": 19}, {"adult"}, second)
+    assert second.messages[0]["results"]["adult"]["value"] == "False"
+
+    # and with a newer one, the group is brought up to date too
+    current["environment"] = _environment(_flags(16))
+    third = _WebSocket()
+    session = await sessions.open(_environment(_flags(16)), {"age": 19}, {"adult"}, third)
+    assert third.messages[0]["results"]["adult"]["value"] == "True"
+    assert first.messages[-1]["results"]["adult"]["value"] == "True"
+    assert second.messages[-1]["results"]["adult"]["value"] == "True"
+
+    await sessions.update(session, stale, {"age": 17}, {"adult"})
+    assert third.messages[-1]["results"]["adult"]["value"] == "True"
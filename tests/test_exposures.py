@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from src.common.metrics import metrics
+from src.exposures import ExposureRecorder
+from src.models import FlagEvaluationResult, FlagEvaluationStatus
+
+
+class _Collection:
+    def __init__(self):
+        self.batches = []
+
+    async def insert_many(self, documents, ordered=True):
+        self.batches.append(documents)
+
+
+async def _no_collection():
+    pass
+
+
+def _results(*flag_names):
+    return {
+        f_name: FlagEvaluationResult(value="on", status=FlagEvaluationStatus.OK, reason="")
+        for f_name in flag_names
+    }
+
+
+@pytest.mark.asyncio
+async def test_exposures_are_buffered_and_flushed_in_batches(monkeypatch):
+    collection = _Collection()
+    monkeypatch.setattr(ExposureRecorder, "_collection", staticmethod(lambda: collection))
+    recorder = ExposureRecorder(
+        buffer_size=4, flush_size=2, flush_interval=60, context_key="user.id"
+    )
+
+    dropped = metrics.get("exposures_dropped_total")
+    recorder.record("env1", _results("a", "b", "c"), {"user": {"id": 42}})
+    recorder.record("env1", _results("d", "e"), None)
+    assert metrics.get("exposures_dropped_total") == dropped + 1
+    assert collection.batches == []
+
+    await recorder.stop()
+    assert [len(batch) for batch in collection.batches] == [2, 2]
+    exposures = [exposure for batch in collection.batches for exposure in batch]
+    assert [e["meta"] for e in exposures] == [
+        {"environment_id": "env1", "flag": f_name} for f_name in ("a", "b", "c", "d")
+    ]
+    assert [e["context_key"] for e in exposures] == [42, 42, 42, None]
+    assert all(e["value"] == "on" for e in exposures)
+
+
+@pytest.mark.asyncio
+async def test_batch_being_flushed_is_written_on_stop(monkeypatch):
+    collection = _Collection()
+    inserting, release = asyncio.Event(), asyncio.Event()
+    insert_many = collection.insert_many
+
+    async def _slow_insert_many(documents, ordered=True):
+        inserting.set()
+        await release.wait()
+        await insert_many(documents, ordered)
+
+    collection.insert_many = _slow_insert_many
+    monkeypatch.setattr(ExposureRecorder, "_collection", staticmethod(lambda: collection))
+    monkeypatch.setattr(ExposureRecorder, "create_collection", staticmethod(_no_collection))
+    recorder = ExposureRecorder(buffer_size=10, flush_size=2, flush_interval=60, context_key="id")
+    await recorder.start()
+
+    recorder.record("env1", _results("a", "b"), None)
+    await inserting.wait()
+    recorder.record("env1", _results("c"), None)
+    stop = asyncio.create_task(recorder.stop())
+    await asyncio.sleep(0)
+    release.set()
+    await stop
+
+    flushed = [[e["meta"]["flag"] for e in batch] for batch in collection.batches]
+    assert flushed == [["a", "b"], ["c"]]
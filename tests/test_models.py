@@ -1,7 +1,9 @@
 import pytest
 
 from src.app import initiate_database
-from src.models import Project
+from src.common.base_model import SCHEMA_VERSIONS_COLLECTION
+from src.common.db import get_mongo_client
+from src.models import Project, Environment
 
 
 @pytest.mark.asyncio
@@ -19,3 +21,38 @@ async def test_base_model():
     project = await Project.find_one(Project.name == "some2345")
     assert project.name == "some2345"
     assert project.created_at != project.updated_at
+
+
+@pytest.mark.asyncio
+async def test_schema_setup_is_skipped_when_up_to_date(monkeypatch):
+    await initiate_database()
+    db = get_mongo_client().get_default_database()
+    versions = {doc["_id"]: doc["version"] async for doc in db[SCHEMA_VERSIONS_COLLECTION].find()}
+    assert versions == {
+        "Project": Project.schema_version,
+        "Environment": Environment.schema_version,
+    }
+
+    commands = []
+
+    def _record(cls, name):
+        method = getattr(cls, name)
+
+        def _recorded(self, *args, **kwargs):
+            commands.append(name)
+            return method(self, *args, **kwargs)
+
+        monkeypatch.setattr(cls, name, _recorded)
+
+    for name in ("command", "create_collection", "list_collection_names"):
+        _record(type(db), name)
+    for name in ("index_information", "create_indexes", "create_index"):
+        _record(type(db[SCHEMA_VERSIONS_COLLECTION]), name)
+
+    # no index or collection commands when the schema versions are up to date
+    await initiate_database()
+    assert commands == []
+
+    monkeypatch.undo()
+    await Environment(name="some").create()
+    assert await Environment.find_one(Environment.name == "some")
@@ -0,0 +1,78 @@
+import pytest
+
+from src.compact_environment import CompactEnvironment
+from src.models import Environment, FlagEvaluationStatus, FlagRule, order_flags
+
+
+def _flags() -> dict:
+    return {
+        "new-checkout": FlagRule(
+            rules={"and": [{"flag": "payments-v2"}, {"==": [{"var": "country"}, "US"]}]},
+            default=False,
+        ),
+        "payments-v2": FlagRule(rules={"in": [{"var": "plan"}, ["pro", "team"]]}, default=False),
+        "maintenance": FlagRule(rules={"flag": "payments-v2"}, default=False),
+    }
+
+
+def test_flags_are_ordered_after_prerequisites():
+    order = order_flags(_flags())
+    assert order.index("payments-v2") < order.index("new-checkout")
+
+
+@pytest.mark.parametrize(
+    "flags",
+    [
+        {"a": FlagRule(rules={"flag": "b"}), "b": FlagRule(rules={"!": {"flag": "a"}})},
+        {"a": FlagRule(rules={"flag": "missing"})},
+        {"a": FlagRule(rules={"flag": {"var": "name"}})},
+    ],
+)
+def test_invalid_prerequisites_are_rejected(flags):
+    with pytest.raises(ValueError):
+        order_flags(flags)
+
+
+def test_prerequisites_are_evaluated_once(monkeypatch):
+    evaluated = []
+    evaluate = Environment._evaluate
+
+    def _evaluate(flag_rule, context):
+        evaluated.append(flag_rule)
+        return evaluate(flag_rule, context)
+
+    monkeypatch.setattr(Environment, "_evaluate", staticmethod(_evaluate))
+
+    flags = _flags()
+    results = Environment.evaluate_rules(flags, {"country": "US", "plan": "pro"})
+    assert {name: res.value for name, res in results.items()} == {
+        "new-checkout": "True",
+        "payments-v2": "True",
+        "maintenance": "True",
+    }
+    assert len(evaluated) == 3
+
+    results = Environment.evaluate_rules({"new-checkout": flags["new-checkout"]}, {}, flags)
+    assert results["new-checkout"].status == FlagEvaluationStatus.ERROR
+
+
+def test_static_prerequisites_are_reused():
+    flags = {
+        "payments-v2": FlagRule(rules=True, default=False),
+        "new-checkout": FlagRule(
+            rules={"and": [{"flag": "payments-v2"}, {"var": "beta"}]}, default=False
+        ),
+        "maintenance": FlagRule(rules={"!": {"flag": "payments-v2"}}, default=True),
+    }
+    compact = CompactEnvironment(
+        {
+            "_id": "e" * 24,
+            "flags": {name: flag.db_representation() for name, flag in flags.items()},
+            "server_side_keys": {},
+            "client_side_keys": {},
+        }
+    )
+    assert set(compact.static_results) == {"payments-v2", "maintenance"}
+    assert compact.static_results["maintenance"].value == "False"
+    assert compact.context_paths() == {"beta"}
+    assert compact.evaluate_dynamic_flags({"beta": True})["new-checkout"].value == "True"